@@ -0,0 +1,319 @@
+import json
+import math
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from pydantic import BaseModel
+from app.api.depth import QUICK_MODEL, VERIFIER_AGENT
+from app.api.model_config import model_routing
+from app.api.request_context import UsageRecorder
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# USD per million tokens (input, output). Override with LLM_PRICES, e.g. '{"gpt-4o": [2.5, 10]}'
+DEFAULT_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+DOWNGRADES = {"gpt-4o": "gpt-4o-mini"}
+
+@dataclass(frozen=True)
+class StageProfile:
+    role: str
+    model: str
+    includes_input: bool
+    # Stages of different branches run concurrently (see FULL_REVIEW_BRANCHES)
+    branch: Optional[str] = None
+
+# The agents each endpoint runs, in order, and whether their task prompt embeds the
+# request payload (the others only see previous task outputs).
+ENDPOINT_STAGES: Dict[str, List[StageProfile]] = {
+    "/refactoring-assistant": [
+        StageProfile("Code Analysis Expert", "gpt-4o-mini", True),
+        StageProfile("Refactoring Opportunity Identifier", "gpt-4o", True),
+        StageProfile("Refactoring Suggestions Expert", "gpt-4o-mini", True),
+        StageProfile("Code Refactoring Specialist", "gpt-4o", True),
+    ],
+    "/multi-agent-debugging-assistant": [
+        StageProfile("Bug Finder", "gpt-4o-mini", True),
+        StageProfile("Bug Analyzer", "gpt-4o", True),
+        StageProfile("Fix Planner", "gpt-4o-mini", True),
+        StageProfile("Code Fixer", "gpt-4o", True),
+    ],
+    "/doc-generator-assistant": [
+        StageProfile("Code Parser", "gpt-4o-mini", True),
+        StageProfile("Documentation Writer", "gpt-4o", False),
+        StageProfile("Examples Generator", "gpt-4o-mini", False),
+    ],
+    "/llm-app-development-assistant": [
+        StageProfile("Feasibility Analyst", "gpt-4o-mini", True),
+        StageProfile("Solution Architect", "gpt-4o", True),
+        StageProfile("Implementation Planner", "gpt-4o-mini", True),
+        StageProfile("Development Advisor", "gpt-4o", True),
+    ],
+}
+
+# /full-review runs one shared analysis in place of each pipeline's first stage, then
+# the rest of the three pipelines concurrently
+FULL_REVIEW_BRANCHES = {
+    "refactoring": "/refactoring-assistant",
+    "debugging": "/multi-agent-debugging-assistant",
+    "documentation": "/doc-generator-assistant",
+}
+SHARED_ANALYSIS_STAGE = StageProfile("Code Review Analyst", "gpt-4o-mini", True)
+# The agent the quick tier runs, where it is not the pipeline's last
+QUICK_ROLES = {"/doc-generator-assistant": "Documentation Writer"}
+
+def pipeline(endpoint: str, depth: str = "standard") -> List[StageProfile]:
+    """
+    The stages a request at `depth` runs: the final agent (or QUICK_ROLES') alone on the quick model,
+    the full pipeline, or the pipeline plus the verifier (see app/api/depth.py).
+    """
+    if endpoint == "/full-review":
+        stages = [] if depth == "quick" else [SHARED_ANALYSIS_STAGE]
+        for branch, branch_endpoint in FULL_REVIEW_BRANCHES.items():
+            branch_stages = pipeline(branch_endpoint, depth)
+            if depth != "quick":
+                branch_stages = branch_stages[1:]
+            stages += [StageProfile(stage.role, stage.model, stage.includes_input, branch) for stage in branch_stages]
+        return stages
+    stages = ENDPOINT_STAGES.get(endpoint, [])
+    if depth == "quick":
+        return [StageProfile(QUICK_ROLES.get(endpoint, stage.role), QUICK_MODEL, True) for stage in stages[-1:]]
+    if depth == "deep":
+        return stages + [StageProfile(VERIFIER_AGENT.role, VERIFIER_AGENT.model, True)]
+    return stages
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:  # unknown model, or the encoding cannot be loaded offline
+        logger.warning(f"No local tokenizer for '{model}', estimating from characters: {e}")
+        return None
+
+def load_tokenizer(model: str = "gpt-4o"):
+    """Loads the encoding count_tokens uses; tiktoken may download it on first use, so this runs at startup."""
+    _encoding(model)
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+class _StageStats:
+    """Exponentially weighted history of one agent's stage, seeded with conservative priors."""
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.llm_calls = 3.0
+        self.overhead_tokens = 2000.0
+        self.completion_tokens = 1000.0
+        self.seconds = 20.0
+
+    def update(self, llm_calls, overhead_tokens, completion_tokens, seconds):
+        a = self.alpha
+        self.llm_calls += a * (llm_calls - self.llm_calls)
+        self.overhead_tokens += a * (overhead_tokens - self.overhead_tokens)
+        self.completion_tokens += a * (completion_tokens - self.completion_tokens)
+        self.seconds += a * (seconds - self.seconds)
+
+@dataclass
+class AdmissionEstimate:
+    endpoint: str
+    depth: str
+    input_tokens: int
+    prompt_tokens: int
+    completion_tokens: int
+    cost_usd: float
+    latency_seconds: float
+    model_overrides: Dict[str, str] = field(default_factory=dict)
+    # (tokens, cost_usd, seconds) per stage, in pipeline order
+    stages: List[Tuple[int, float, float]] = field(default_factory=list)
+
+    def remaining(self, completed_stages: int) -> Tuple[int, float, float]:
+        """Estimated (tokens, cost_usd, seconds) of the stages after the first `completed_stages`."""
+        rest = self.stages[completed_stages:]
+        return sum(stage[0] for stage in rest), sum(stage[1] for stage in rest), sum(stage[2] for stage in rest)
+
+    def summary(self) -> dict:
+        return {
+            "depth": self.depth,
+            "input_tokens": self.input_tokens,
+            "estimated_prompt_tokens": self.prompt_tokens,
+            "estimated_completion_tokens": self.completion_tokens,
+            "estimated_cost_usd": round(self.cost_usd, 4),
+            "estimated_latency_seconds": round(self.latency_seconds, 1),
+            "model_overrides": self.model_overrides,
+        }
+
+class AdmissionController:
+    """
+    Pre-flight admission for crew requests.
+
+    Before a crew starts, the payload is tokenized locally and each stage of the
+    endpoint's pipeline is priced from per-agent history (LLM calls per stage, prompt
+    overhead, completion size, duration), updated after every run. Requests over
+    the input limit get a 413. Requests over the cost or latency limit are
+    downgraded to cheaper models when that brings them under, and get a 413
+    otherwise. When the crew queue is deeper than `overload_queue_depth`, the most
+    expensive requests relative to recent traffic get a 429. The share shed grows
+    with the queue, and Retry-After is how long `crew_slots` slots take to drain
+    the queue back under that depth at the recent crews' estimated duration.
+    """
+
+    def __init__(self, max_input_tokens: int, max_cost_usd: float, max_latency_seconds: float,
+                 allow_downgrade: bool = True, overload_queue_depth: int = 8, alpha: float = 0.2,
+                 crew_slots: int = 4):
+        self.max_input_tokens = max_input_tokens
+        self.max_cost_usd = max_cost_usd
+        self.max_latency_seconds = max_latency_seconds
+        self.allow_downgrade = allow_downgrade
+        self.overload_queue_depth = overload_queue_depth
+        self.crew_slots = max(1, crew_slots)
+        self.alpha = alpha
+        self.prices = dict(DEFAULT_PRICES)
+        if os.environ.get("LLM_PRICES"):
+            self.prices.update({model: tuple(price) for model, price in json.loads(os.environ["LLM_PRICES"]).items()})
+        self._stats: Dict[tuple, _StageStats] = {}
+        self._recent_costs = deque(maxlen=200)
+        self._recent_latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.downgraded = 0
+        self.shed = 0
+
+    def _stage_stats(self, endpoint: str, depth: str, role: str) -> _StageStats:
+        # A quick run's single agent does the whole job, so its history is kept apart
+        key = (endpoint, "quick" if depth == "quick" else "full", role)
+        if key not in self._stats:
+            self._stats[key] = _StageStats(self.alpha)
+        return self._stats[key]
+
+    def estimate(self, endpoint: str, payload: BaseModel, overrides: Optional[Dict[str, str]] = None,
+                 input_tokens: Optional[int] = None) -> AdmissionEstimate:
+        overrides = overrides or {}
+        depth = getattr(payload, "depth", "standard")
+        if input_tokens is None:
+            input_tokens = count_tokens(payload.model_dump_json())
+        prompt_total = completion_total = 0
+        cost = latency = 0.0
+        branch_latency: Dict[str, float] = {}
+        stages = []
+        for stage in pipeline(endpoint, depth):
+            stats = self._stage_stats(endpoint, depth, stage.role)
+            # The quick tier's model replaces the agent's, routed or not
+            model = stage.model if depth == "quick" else model_routing.model_for(endpoint, stage.role, stage.model)
+            model = overrides.get(model, model)
+            per_call = stats.overhead_tokens + (input_tokens if stage.includes_input else 0)
+            prompt = stats.llm_calls * per_call
+            completion = stats.completion_tokens
+            input_price, output_price = self.prices.get(model, self.prices["gpt-4o"])
+            stage_cost = (prompt * input_price + completion * output_price) / 1_000_000
+            stages.append((int(prompt + completion), stage_cost, stats.seconds))
+            prompt_total += prompt
+            completion_total += completion
+            cost += stage_cost
+            if stage.branch is None:
+                latency += stats.seconds
+            else:
+                branch_latency[stage.branch] = branch_latency.get(stage.branch, 0.0) + stats.seconds
+        latency += max(branch_latency.values(), default=0.0)
+        return AdmissionEstimate(endpoint, depth, input_tokens, int(prompt_total), int(completion_total), cost, latency, overrides, stages)
+
+    def _shed_threshold(self, queue_depth: int) -> Optional[float]:
+        """Cost above which requests are shed: the top 10% at the overload depth, 10% more per extra queued crew."""
+        if queue_depth < self.overload_queue_depth or len(self._recent_costs) < 10:
+            return None
+        shed_fraction = min(0.9, 0.1 * (queue_depth - self.overload_queue_depth + 1))
+        costs = sorted(self._recent_costs)
+        return costs[int(len(costs) * (1 - shed_fraction))]
+
+    def _retry_after(self, queue_depth: int) -> int:
+        crew_seconds = sum(self._recent_latencies) / max(1, len(self._recent_latencies))
+        return max(1, math.ceil((queue_depth - self.overload_queue_depth + 1) * crew_seconds / self.crew_slots))
+
+    def admit(self, endpoint: str, payload: BaseModel, queue_depth: int = 0, shareable: bool = False) -> AdmissionEstimate:
+        """
+        Returns the estimate the request was admitted under, or raises HTTPException.
+
+        `shareable` requests will attach to an identical run already in flight, cost
+        nothing extra and are never shed. Tokenizing a large payload takes a while,
+        so call this off the event loop.
+        """
+        input_tokens = count_tokens(payload.model_dump_json())
+        with self._lock:
+            estimate = self.estimate(endpoint, payload, input_tokens=input_tokens)
+            if estimate.input_tokens > self.max_input_tokens:
+                self.rejected += 1
+                raise HTTPException(status_code=413, detail={
+                    "reason": f"Input is {estimate.input_tokens} tokens; the limit is {self.max_input_tokens}",
+                    **estimate.summary(),
+                })
+
+            if estimate.cost_usd > self.max_cost_usd or estimate.latency_seconds > self.max_latency_seconds:
+                downgraded = self.estimate(endpoint, payload, DOWNGRADES, input_tokens) if self.allow_downgrade else None
+                if downgraded and downgraded.cost_usd <= self.max_cost_usd and downgraded.latency_seconds <= self.max_latency_seconds:
+                    logger.info(f"Downgrading {endpoint} request from ${estimate.cost_usd:.3f} to ${downgraded.cost_usd:.3f}")
+                    self.downgraded += 1
+                    estimate = downgraded
+                else:
+                    self.rejected += 1
+                    raise HTTPException(status_code=413, detail={
+                        "reason": f"Estimated cost ${estimate.cost_usd:.3f} / {estimate.latency_seconds:.0f}s exceeds "
+                                  f"the limit of ${self.max_cost_usd:.2f} / {self.max_latency_seconds:.0f}s",
+                        **estimate.summary(),
+                    })
+
+            threshold = None if shareable else self._shed_threshold(queue_depth)
+            if threshold is not None and estimate.cost_usd >= threshold:
+                self.shed += 1
+                raise HTTPException(status_code=429, headers={"Retry-After": str(self._retry_after(queue_depth))}, detail={
+                    "reason": f"Server overloaded ({queue_depth} crews queued); shedding requests estimated above ${threshold:.3f}",
+                    **estimate.summary(),
+                })
+
+            self._recent_costs.append(estimate.cost_usd)
+            self._recent_latencies.append(estimate.latency_seconds)
+            return estimate
+
+    def record(self, estimate: AdmissionEstimate, usage: UsageRecorder):
+        """Feeds the actual per-stage usage of a finished run back into the history."""
+        profiles = {stage.role: stage for stage in pipeline(estimate.endpoint, estimate.depth)}
+        with self._lock:
+            for stage in usage.completed_stages:
+                profile = profiles.get(stage.role)
+                if profile is None or stage.llm_calls == 0:
+                    continue
+                per_call = stage.prompt_tokens / stage.llm_calls
+                overhead = max(0.0, per_call - (estimate.input_tokens if profile.includes_input else 0))
+                self._stage_stats(estimate.endpoint, estimate.depth, stage.role).update(
+                    stage.llm_calls, overhead, stage.completion_tokens, stage.seconds
+                )
+
+    def stats(self) -> dict:
+        return {
+            "rejected": self.rejected,
+            "downgraded": self.downgraded,
+            "shed": self.shed,
+            "stages": {
+                f"{endpoint} {role}" + (" (quick)" if scope == "quick" else ""): vars(stats)
+                for (endpoint, scope, role), stats in self._stats.items()
+            },
+        }
+
+admission = AdmissionController(
+    max_input_tokens=int(os.environ.get("ADMISSION_MAX_INPUT_TOKENS", 32000)),
+    max_cost_usd=float(os.environ.get("ADMISSION_MAX_COST_USD", 1.0)),
+    max_latency_seconds=float(os.environ.get("ADMISSION_MAX_LATENCY_SECONDS", 300)),
+    allow_downgrade=os.environ.get("ADMISSION_ALLOW_DOWNGRADE", "true").lower() == "true",
+    overload_queue_depth=int(os.environ.get("ADMISSION_OVERLOAD_QUEUE_DEPTH", 8)),
+    crew_slots=int(os.environ.get("CREW_CONCURRENCY", 4)),
+)
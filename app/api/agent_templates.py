@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Tuple
+from crewai import Agent
+from app.api.batching import current_batch_rounds
+from app.api.deadlines import deadline_callback
+from app.api.llm import get_chat_model
+from app.api.logger import crew_verbose
+from app.api.model_config import model_routing
+from app.api.request_context import current_endpoint, tool_usage_callback
+
+@dataclass(frozen=True)
+class AgentTemplate:
+    """
+    Everything about an agent that does not change between requests.
+
+    Templates are module-level constants. `bind()` turns one into a fresh `Agent`
+    for a single crew run: shared tools and model clients are reused, and only
+    per-request state (the agent itself, its REPL, its verbosity) is created.
+    Every tool gets the deadline callback, so no tool call starts after its
+    request is cancelled, and is counted against the stage that called it.
+    `hedged` roles hedge their slow completions (see
+    `ManagedChatOpenAI`). `model` is the default: the model config file can route
+    the role to another model or backend, for every endpoint or the current one.
+    In bulk runs agents have no tools.
+    """
+    role: str
+    backstory: str
+    goal: str
+    model: str
+    tools: Tuple[Callable[[], Any], ...] = ()
+    hedged: bool = False
+
+    def chat_model(self):
+        """The role's chat model under the current routes."""
+        route = model_routing.route(current_endpoint(), self.role)
+        model = route.model if route is not None and route.model else self.model
+        backend = route.backend if route is not None else None
+        # A role routed to one backend has no other backend to hedge on
+        return get_chat_model(model, hedge_key=self.role if self.hedged and backend is None else None, backend=backend)
+
+    def bind(self, **overrides) -> Agent:
+        config = dict(
+            role=self.role,
+            backstory=self.backstory,
+            goal=self.goal,
+            tools=[factory() for factory in self.tools],
+            allow_delegation=False,
+            verbose=crew_verbose(),
+            llm=self.chat_model(),
+        )
+        config.update(overrides)
+        if current_batch_rounds() is not None:
+            # A tool call would cost a batch round of its own, so bulk runs go without
+            config["tools"] = []
+        for tool in config["tools"]:
+            for callback in (deadline_callback, tool_usage_callback):
+                if callback not in (tool.callbacks or []):
+                    tool.callbacks = [*(tool.callbacks or []), callback]
+        return Agent(**config)
@@ -1,4 +1,5 @@
 from fastapi import HTTPException, Header
+from app.api.auth.tenants import Tenant, default_tenant, load_tenants
 #from google.cloud import secretmanager
 import os
 
@@ -13,8 +14,14 @@ import os
 #     return response.payload.data.decode("UTF-8")
 
 # Function to ensure incoming request is from controller with key
-def key_check(api_key: str = Header(None)):
+def key_check(api_key: str = Header(None)) -> Tenant:
   
+  tenants = load_tenants()
+  if tenants:
+    if api_key is None or api_key not in tenants:
+      raise HTTPException(status_code=401, detail="Invalid API Request Key")
+    return tenants[api_key]
+
   if os.environ['ENV_TYPE'] == "production":
     #set_key = access_secret_file("backend-access")
     set_key = "production"
@@ -22,4 +29,6 @@ def key_check(api_key: str = Header(None)):
     set_key = "dev"
   
   if api_key is None or api_key != set_key:
-    raise HTTPException(status_code=401, detail="Invalid API Request Key")
\ No newline at end of file
+    raise HTTPException(status_code=401, detail="Invalid API Request Key")
+
+  return default_tenant()
\ No newline at end of file
@@ -0,0 +1,33 @@
+import json
+import os
+from typing import Dict, Literal, Optional
+from pydantic import BaseModel, Field
+
+class Tenant(BaseModel):
+    name: str
+    priority: Literal["interactive", "batch"] = Field(default="interactive", description="Interactive tenants are always scheduled ahead of batch tenants")
+    weight: float = Field(default=1.0, gt=0, description="Share of capacity relative to other tenants of the same priority")
+    max_concurrent_crews: int = Field(default=2, ge=1, description="Crews this tenant may run at once per worker")
+    tokens_per_minute: Optional[int] = Field(default=None, description="LLM token quota across all workers; unlimited when not set")
+    admin: bool = Field(default=False, description="May read every tenant's usage counters")
+
+_tenants: Optional[Dict[str, Tenant]] = None
+
+def load_tenants() -> Dict[str, Tenant]:
+    """
+    Reads the API key to tenant mapping from API_TENANTS_FILE (a JSON file) or
+    API_TENANTS (inline JSON), e.g. {"<api-key>": {"name": "ide-plugin", "priority": "interactive"}}.
+    """
+    global _tenants
+    if _tenants is None:
+        raw = os.environ.get("API_TENANTS")
+        path = os.environ.get("API_TENANTS_FILE")
+        if path:
+            with open(path) as f:
+                raw = f.read()
+        _tenants = {key: Tenant(**config) for key, config in json.loads(raw).items()} if raw else {}
+    return _tenants
+
+def default_tenant() -> Tenant:
+    """Tenant used for the single static key when no mapping is configured."""
+    return Tenant(name="default", priority="interactive", max_concurrent_crews=int(os.environ.get("CREW_CONCURRENCY", 4)), admin=True)
@@ -0,0 +1,253 @@
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import openai
+from app.api.llm_backends import Backend
+from app.api.metrics import counters
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Bulk runs (see app/api/bulk.py) send their LLM calls through a provider batch
+# interface instead of calling the chat completions API one at a time. The runs
+# move in rounds: once every live run is waiting on its next call, the waiting
+# calls go out as one batch per backend and model, and each run continues when
+# the round's results are in. Agents have no tools in bulk runs, so each stage
+# is a single call and a round is one stage of every run.
+
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+class BatchCallFailed(Exception):
+    """A call that got no response from the batch interface within its attempts."""
+
+@dataclass
+class BatchCall:
+    backend: Backend
+    body: dict
+    custom_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0
+    response: Optional[dict] = None
+    error: Optional[str] = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+class BatchRounds:
+    """
+    Collects the calls of the runs that joined it and submits them in rounds.
+
+    A round starts when every live run is waiting on a call, or `max_wait_seconds`
+    after its first call, so one run busy outside the LLM cannot hold up the rest
+    forever. Calls the batch did not answer, e.g. when it expired, go into the next
+    round, up to `max_attempts` times.
+    """
+
+    def __init__(self, poll_seconds: float, max_wait_seconds: float, max_attempts: int, completion_window: str):
+        self.poll_seconds = poll_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.max_attempts = max_attempts
+        self.completion_window = completion_window
+        self.rounds = 0
+        self.batches = 0
+        self.calls = 0
+        self.retried = 0
+        self.failed = 0
+        # Prompt and completion tokens by model, for pricing the run
+        self.usage: Dict[str, List[int]] = {}
+        self._live = 0
+        self._waiting: List[BatchCall] = []
+        self._first_waiting_at = 0.0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._clients: Dict[Tuple[Optional[str], str], openai.OpenAI] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "BatchRounds":
+        return cls(
+            poll_seconds=float(os.environ.get("BULK_POLL_SECONDS", 30)),
+            max_wait_seconds=float(os.environ.get("BULK_ROUND_MAX_WAIT_SECONDS", 300)),
+            max_attempts=int(os.environ.get("BULK_MAX_ATTEMPTS", 3)),
+            completion_window=os.environ.get("BULK_COMPLETION_WINDOW", "24h"),
+        )
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="batch-rounds", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def join(self, runs: int = 1):
+        """Counts runs that will send calls; join them all before any starts, or the first round goes out with one."""
+        with self._condition:
+            self._live += runs
+
+    def leave(self):
+        with self._condition:
+            self._live -= 1
+            self._condition.notify_all()
+
+    def call(self, backend: Backend, body: dict) -> dict:
+        """Queues a chat completion request for the next round and waits for its response body."""
+        call = BatchCall(backend, body)
+        self._queue([call])
+        call.done.wait()
+        if call.error is not None:
+            raise BatchCallFailed(call.error)
+        return call.response
+
+    def _queue(self, calls: List[BatchCall]):
+        with self._condition:
+            if not self._waiting:
+                self._first_waiting_at = time.monotonic()
+            self._waiting.extend(calls)
+            self._condition.notify_all()
+
+    def _next_round(self) -> Optional[List[BatchCall]]:
+        with self._condition:
+            while True:
+                if self._waiting:
+                    waited = time.monotonic() - self._first_waiting_at
+                    if len(self._waiting) >= self._live or waited >= self.max_wait_seconds:
+                        calls, self._waiting = self._waiting, []
+                        return calls
+                    self._condition.wait(self.max_wait_seconds - waited)
+                elif self._closed:
+                    return None
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            calls = self._next_round()
+            if calls is None:
+                return
+            try:
+                self._round(calls)
+            except Exception as e:
+                # Anything unexpected; the round's calls are tried again rather than left waiting
+                logger.error(f"Batch round of {len(calls)} calls failed: {e}")
+                self._retry_or_fail(calls, str(e))
+
+    def _round(self, calls: List[BatchCall]):
+        self.rounds += 1
+        counters.inc("bulk_rounds")
+        groups: Dict[Tuple[str, str], List[BatchCall]] = {}
+        for call in calls:
+            call.attempts += 1
+            groups.setdefault((call.backend.name, call.body.get("model", "")), []).append(call)
+        started = time.monotonic()
+        submitted = []
+        # The batch interface takes one model per file
+        for group in groups.values():
+            try:
+                submitted.append((group, self._submit(group)))
+            except openai.OpenAIError as e:
+                logger.error(f"Could not submit a batch of {len(group)} calls: {e}")
+                self._retry_or_fail(group, str(e))
+        logger.info(f"Batch round {self.rounds}: {len(calls)} calls in {len(submitted)} batches")
+        unanswered: List[BatchCall] = []
+        for group, batch_id in submitted:
+            try:
+                unanswered += self._collect(group, batch_id)
+            except openai.OpenAIError as e:
+                logger.error(f"Could not collect batch {batch_id}: {e}")
+                unanswered += group
+        counters.inc("bulk_round_seconds", time.monotonic() - started)
+        if unanswered:
+            self._retry_or_fail(unanswered, "No response in the batch output")
+
+    def _client(self, backend: Backend) -> openai.OpenAI:
+        key = (backend.base_url, backend.api_key_env)
+        if key not in self._clients:
+            self._clients[key] = openai.OpenAI(base_url=backend.base_url, api_key=os.environ.get(backend.api_key_env))
+        return self._clients[key]
+
+    def _submit(self, calls: List[BatchCall]) -> str:
+        client = self._client(calls[0].backend)
+        lines = [json.dumps({"custom_id": call.custom_id, "method": "POST", "url": "/v1/chat/completions", "body": call.body})
+                 for call in calls]
+        upload = client.files.create(file=("bulk.jsonl", io.BytesIO("\n".join(lines).encode())), purpose="batch")
+        batch = client.batches.create(input_file_id=upload.id, endpoint="/v1/chat/completions", completion_window=self.completion_window)
+        self.batches += 1
+        self.calls += len(calls)
+        counters.inc("bulk_batches")
+        counters.inc("bulk_calls", len(calls))
+        return batch.id
+
+    def _collect(self, calls: List[BatchCall], batch_id: str) -> List[BatchCall]:
+        """Waits for a batch, hands each call its response and returns the calls left without one."""
+        client = self._client(calls[0].backend)
+        batch = client.batches.retrieve(batch_id)
+        while batch.status not in FINISHED_STATUSES:
+            time.sleep(self.poll_seconds)
+            batch = client.batches.retrieve(batch_id)
+        if batch.status != "completed":
+            logger.warning(f"Batch {batch_id} ended {batch.status}; collecting what it finished")
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                for line in client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        result = json.loads(line)
+                        results[result["custom_id"]] = result
+        unanswered = []
+        for call in calls:
+            result = results.get(call.custom_id)
+            response = (result or {}).get("response") or {}
+            if response.get("status_code") == 200:
+                call.response, call.error = response["body"], None
+                usage = call.response.get("usage") or {}
+                tokens = self.usage.setdefault(call.body.get("model", ""), [0, 0])
+                tokens[0] += usage.get("prompt_tokens", 0)
+                tokens[1] += usage.get("completion_tokens", 0)
+                call.done.set()
+            else:
+                if result is not None:
+                    call.error = json.dumps(result.get("error") or response.get("body"))
+                unanswered.append(call)
+        return unanswered
+
+    def _retry_or_fail(self, calls: List[BatchCall], reason: str):
+        retry = []
+        for call in calls:
+            if call.attempts < self.max_attempts:
+                retry.append(call)
+            else:
+                call.error = call.error or reason
+                call.done.set()
+        self.retried += len(retry)
+        self.failed += len(calls) - len(retry)
+        counters.inc("bulk_calls_retried", len(retry))
+        counters.inc("bulk_calls_failed", len(calls) - len(retry))
+        if retry:
+            self._queue(retry)
+
+    def stats(self) -> dict:
+        return {"rounds": self.rounds, "batches": self.batches, "calls": self.calls, "retried": self.retried,
+                "failed": self.failed, "tokens": {model: {"prompt": prompt, "completion": completion}
+                                                  for model, (prompt, completion) in sorted(self.usage.items())}}
+
+_rounds: ContextVar[Optional[BatchRounds]] = ContextVar("batch_rounds", default=None)
+
+@contextmanager
+def batch_mode(rounds: BatchRounds):
+    """Sends the LLM calls made in this context through `rounds` instead of the chat completions API."""
+    token = _rounds.set(rounds)
+    try:
+        yield
+    finally:
+        _rounds.reset(token)
+
+def current_batch_rounds() -> Optional[BatchRounds]:
+    return _rounds.get()
@@ -0,0 +1,103 @@
+import argparse
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from typing import List, Optional
+from app.api.batching import BatchRounds, batch_mode
+from app.api.request_context import endpoint_scope, record_usage
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Share of the interactive price the provider charges for batched calls
+BATCH_PRICE_RATIO = float(os.environ.get("BULK_PRICE_RATIO", 0.5))
+
+def _run_one(index: int, endpoint: str, payload: dict, rounds: BatchRounds, results: List[Optional[dict]]):
+    from app.api.router import CREW_ENDPOINTS
+
+    schema, crew_func = CREW_ENDPOINTS[endpoint]
+    started = time.monotonic()
+    with batch_mode(rounds), record_usage() as usage, endpoint_scope(endpoint):
+        try:
+            results[index] = {"index": index, "output": crew_func(schema(**payload))}
+        except Exception as e:
+            logger.error(f"Bulk run {index} on {endpoint} failed: {e}")
+            results[index] = {"index": index, "error": f"{type(e).__name__}: {e}"}
+        finally:
+            rounds.leave()
+    results[index]["total_tokens"] = usage.total_tokens
+    results[index]["seconds"] = round(time.monotonic() - started, 3)
+
+def run_bulk(endpoint: str, payloads: List[dict], rounds: Optional[BatchRounds] = None,
+             concurrency: Optional[int] = None) -> List[dict]:
+    """
+    Runs the endpoint's crew on every payload with its LLM calls batched, and
+    returns one result per payload, in order. Runs go in waves of `concurrency`
+    (BULK_CONCURRENCY); the runs of a wave move through their stages together.
+    """
+    own_rounds = rounds is None
+    rounds = rounds or BatchRounds.from_env()
+    concurrency = concurrency or int(os.environ.get("BULK_CONCURRENCY", 200))
+    results: List[Optional[dict]] = [None] * len(payloads)
+    if own_rounds:
+        rounds.start()
+    try:
+        for wave_start in range(0, len(payloads), concurrency):
+            wave = range(wave_start, min(wave_start + concurrency, len(payloads)))
+            rounds.join(len(wave))
+            threads = [
+                threading.Thread(target=contextvars.copy_context().run, name=f"bulk-{index}",
+                                 args=(_run_one, index, endpoint, payloads[index], rounds, results))
+                for index in wave
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            logger.info(f"Bulk wave of {len(wave)} runs done; {rounds.stats()}")
+    finally:
+        if own_rounds:
+            rounds.stop()
+    return results
+
+def batch_cost(rounds: BatchRounds) -> dict:
+    """What the run's tokens cost at batch prices, and what they would have cost interactively."""
+    from app.api.admission import admission
+
+    interactive = 0.0
+    for model, (prompt, completion) in rounds.usage.items():
+        input_price, output_price = admission.prices.get(model, admission.prices["gpt-4o"])
+        interactive += (prompt * input_price + completion * output_price) / 1_000_000
+    return {"batch_usd": round(interactive * BATCH_PRICE_RATIO, 6), "interactive_usd": round(interactive, 6)}
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run a crew endpoint over many inputs through the provider batch interface.")
+    parser.add_argument("endpoint", help="e.g. /doc-generator-assistant")
+    parser.add_argument("input", help="JSON lines, one request body per line")
+    parser.add_argument("output", help="JSON lines, one result per input line, in order")
+    parser.add_argument("--concurrency", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    with open(args.input) as f:
+        payloads = [json.loads(line) for line in f if line.strip()]
+    rounds = BatchRounds.from_env()
+    rounds.start()
+    started = time.monotonic()
+    try:
+        results = run_bulk(args.endpoint, payloads, rounds, args.concurrency)
+    finally:
+        rounds.stop()
+    with open(args.output, "w") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    failed = sum(1 for result in results if "error" in result)
+    summary = {"runs": len(results), "failed": failed, "seconds": round(time.monotonic() - started, 1),
+               **rounds.stats(), **batch_cost(rounds)}
+    print(json.dumps(summary, indent=2))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
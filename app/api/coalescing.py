@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict
+from pydantic import BaseModel
+from app.api.deadlines import Deadline
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+def request_key(endpoint: str, payload: BaseModel, tenant: str) -> str:
+    """
+    Endpoint, tenant and a SHA-256 of the payload serialized with sorted keys and
+    no whitespace. Runs are only shared within a tenant, since the run is scheduled
+    and charged to the tenant that started it.
+    """
+    canonical = json.dumps(payload.model_dump(), sort_keys=True, separators=(",", ":"), default=str)
+    return f"{endpoint}:{tenant}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+class _SharedRun:
+    def __init__(self, deadline: Deadline):
+        self.deadline = deadline
+        self.task: asyncio.Task = None
+        self.waiters = 0
+
+class RequestCoalescer:
+    """
+    Runs concurrent identical requests from the same tenant as a single crew.
+
+    The first request for a key starts `execute()` as a task; requests with the
+    same key that arrive while it is running await the same task. Each waiter
+    awaits through `asyncio.shield`, so a waiter that is cancelled (for example
+    because its client went away) leaves the shared run untouched for the others.
+
+    The run has its own deadline, the latest of its waiters' deadlines, which
+    `execute(deadline)` hands to the crew. When the last waiter leaves before the
+    run finishes, nobody is left to read the result: the deadline is cancelled
+    with that waiter's reason and the task is cancelled.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, _SharedRun] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def is_in_flight(self, endpoint: str, payload: BaseModel, tenant: str) -> bool:
+        return request_key(endpoint, payload, tenant) in self._in_flight
+
+    def _start(self, key: str, execute: Callable[[Deadline], Awaitable[Any]], deadline: Deadline) -> _SharedRun:
+        shared = _SharedRun(Deadline(deadline.at))
+        task = shared.task = asyncio.get_running_loop().create_task(execute(shared.deadline))
+        self._in_flight[key] = shared
+        self.started += 1
+
+        def _forget(_):
+            if self._in_flight.get(key) is shared:
+                del self._in_flight[key]
+            # Retrieve the exception so an abandoned failed run is not reported as unhandled
+            if not task.cancelled():
+                task.exception()
+
+        task.add_done_callback(_forget)
+        return shared
+
+    async def run(self, endpoint: str, payload: BaseModel, tenant: str, execute: Callable[[Deadline], Awaitable[Any]], deadline: Deadline):
+        """Awaits the tenant's shared run for the payload; the waiter's `deadline.reason` says why it left, if it did."""
+        key = request_key(endpoint, payload, tenant)
+        shared = self._in_flight.get(key)
+        if shared is None:
+            shared = self._start(key, execute, deadline)
+        else:
+            self.coalesced += 1
+            shared.deadline.extend(deadline.at)
+            logger.info(f"Attaching to in-flight run for {endpoint} ({shared.waiters} waiting)")
+
+        shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        finally:
+            shared.waiters -= 1
+            if shared.waiters == 0 and not shared.task.done():
+                self.abandoned += 1
+                logger.info(f"Cancelling abandoned run for {endpoint}")
+                shared.deadline.cancel(deadline.reason or "abandoned")
+                shared.task.cancel()
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "started": self.started, "coalesced": self.coalesced, "abandoned": self.abandoned}
+
+coalescer = RequestCoalescer()
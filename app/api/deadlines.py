@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Seconds a request may take when it sends no X-Request-Deadline header.
+# Override per endpoint with REQUEST_DEADLINES, e.g. '{"/doc-generator-assistant": 240}'
+DEFAULT_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", 300))
+MAX_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_MAX_SECONDS", 900))
+ENDPOINT_DEADLINES = {
+    "/refactoring-assistant": 240.0,
+    "/multi-agent-debugging-assistant": 240.0,
+    "/doc-generator-assistant": 180.0,
+    "/llm-app-development-assistant": 300.0,
+    "/full-review": 300.0,
+}
+# Tiers whose default differs from the endpoint's, see app/api/depth.py
+DEPTH_DEADLINES = {
+    "quick": float(os.environ.get("DEPTH_QUICK_DEADLINE_SECONDS", 60)),
+    "deep": float(os.environ.get("DEPTH_DEEP_DEADLINE_SECONDS", 480)),
+}
+if os.environ.get("REQUEST_DEADLINES"):
+    ENDPOINT_DEADLINES.update({endpoint: float(seconds) for endpoint, seconds in json.loads(os.environ["REQUEST_DEADLINES"]).items()})
+
+class RequestCancelled(BaseException):
+    """
+    Raised inside a crew whose request passed its deadline or was abandoned.
+
+    Like `asyncio.CancelledError` it derives from BaseException, so the agent
+    executor's and tool runner's `except Exception` handlers (which retry or hand
+    the error back to the model) let it through and the crew stops.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class Deadline:
+    """A point in (monotonic) time after which a request's remaining work is pointless, and a way to cancel it sooner."""
+
+    def __init__(self, at: float):
+        self.at = at
+        self.reason: Optional[str] = None
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.monotonic() + seconds)
+
+    @classmethod
+    def for_request(cls, endpoint: str, header: Optional[str], depth: str = "standard") -> "Deadline":
+        """
+        From the X-Request-Deadline header (seconds from now), else the default for
+        the depth tier or the endpoint, capped at the maximum.
+        """
+        seconds = DEPTH_DEADLINES.get(depth) or ENDPOINT_DEADLINES.get(endpoint, DEFAULT_DEADLINE_SECONDS)
+        if header:
+            try:
+                seconds = float(header)
+            except ValueError:
+                pass
+        return cls.after(max(0.0, min(seconds, MAX_DEADLINE_SECONDS)))
+
+    def remaining(self) -> float:
+        return self.at - time.monotonic()
+
+    def extend(self, at: float):
+        self.at = max(self.at, at)
+
+    def cancel(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self.reason is None and self.remaining() <= 0:
+            self.cancel("deadline")
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+    def sleep(self, seconds: float):
+        """time.sleep that wakes up, and raises, as soon as the request is cancelled or out of time."""
+        self._cancelled.wait(max(0.0, min(seconds, self.remaining())))
+        self.check()
+
+_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]):
+    """Makes `deadline` the deadline of LLM and tool calls made in this context, including `asyncio.to_thread` calls."""
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+def current_deadline() -> Optional[Deadline]:
+    return _deadline.get()
+
+def check_deadline():
+    deadline = _deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+class DeadlineCallback(BaseCallbackHandler):
+    """Stops a tool call from starting once its request is cancelled or out of time."""
+    raise_error = True
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        check_deadline()
+
+deadline_callback = DeadlineCallback()
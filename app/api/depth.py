@@ -0,0 +1,58 @@
+import os
+from textwrap import dedent
+from typing import Type
+from crewai import Task
+from pydantic import BaseModel
+from app.api.agent_templates import AgentTemplate
+from app.api.llm import get_chat_model
+from app.api.tools import python_repl_tool
+
+# Each endpoint takes a `depth`:
+# - quick: the endpoint's final agent (the documentation writer for docs) alone, on QUICK_MODEL and without tools;
+# - standard: the full pipeline;
+# - deep: the pipeline plus a verifier that checks the final output against the input.
+# Every tier returns the endpoint's usual response schema.
+DEPTHS = ("quick", "standard", "deep")
+QUICK_MODEL = os.environ.get("DEPTH_QUICK_MODEL", "gpt-4o-mini")
+
+QUICK_INSTRUCTIONS = "No earlier analysis has been done for you: find what needs to change yourself and produce the result in a single pass."
+
+VERIFIER_AGENT = AgentTemplate(
+    role="Output Verifier",
+    backstory=dedent("""You are a meticulous senior reviewer who checks the work of other experts against the original request before it is delivered."""),
+    goal=dedent("""Verify the final output against the original input, correct any mistake or omission, and return the output in the same format."""),
+    model="gpt-4o",
+    tools=(python_repl_tool,),
+)
+
+def quick_overrides() -> dict:
+    """Agent overrides for the quick tier."""
+    return {"llm": get_chat_model(QUICK_MODEL), "tools": []}
+
+def depth_instructions(depth: str) -> str:
+    return QUICK_INSTRUCTIONS if depth == "quick" else ""
+
+def verification_task(agent, schema: Type[BaseModel], checks: str, original: str) -> Task:
+    """
+    Deep tier: reviews the previous task's output, given `original` (the request as
+    the pipeline saw it), and returns it corrected in the same `schema`.
+    """
+    output_schema = schema.schema_json(indent=2)
+    return Task(
+        description=dedent(f"""
+            Review the output of the previous task, which must match the **{schema.__name__}** schema, against the original input below.
+            {checks.strip()}
+            Correct every problem you find and return the complete output, not only the corrections, in **JSON format** matching the **{schema.__name__}** schema.
+            If there is nothing to correct, return the previous output unchanged.
+
+            **Format**:
+            ```json
+            {output_schema}
+            ```
+
+            **Original Input**:
+{original}
+        """),
+        agent=agent,
+        expected_output=f"The verified output in JSON format matching the schema: {output_schema}",
+    )
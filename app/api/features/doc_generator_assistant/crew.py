@@ -1,84 +1,63 @@
 from app.api.schemas.doc_generator_assistant_schema import (
     CodeInput,
-    DocumentationOutput,
+    ExamplesOutput,
+    ModuleDocumentation,
     ParsingOutput,
 )
+from app.api.features.doc_generator_assistant.renderer import merge_examples, render_documentation
 from crewai import (
-    Agent, 
     Task,
     Crew
 )
 from textwrap import dedent
-from langchain_openai import ChatOpenAI
-from langchain_community.tools import WikipediaQueryRun
-from langchain_community.utilities import WikipediaAPIWrapper
-from langchain_community.tools.wikidata.tool import WikidataAPIWrapper, WikidataQueryRun
-from langchain_community.utilities import ArxivAPIWrapper
-from langchain.tools import Tool
-import json
+from app.api.agent_templates import AgentTemplate
+from app.api.depth import VERIFIER_AGENT, quick_overrides, verification_task
+from app.api.logger import crew_verbose
+from app.api.request_context import stage_completed
+from app.api.tools import arxiv_tool, wikidata_query_tool, wikipedia_query_tool
+from typing import Sequence
 from langchain_core.output_parsers import JsonOutputParser
 
+RESEARCH_TOOLS = (wikipedia_query_tool, wikidata_query_tool, arxiv_tool)
+
+# Agent 1: Code Parser
+CODE_PARSER_AGENT = AgentTemplate(
+    role="Code Parser",
+    backstory=dedent("""You are an expert in parsing code to extract functions, classes, and modules."""),
+    goal=dedent("""Parse the provided code and extract all functions, classes, and modules along with their signatures."""),
+    model="gpt-4o-mini",
+    tools=RESEARCH_TOOLS,
+)
+
+# Agent 2: Documentation Writer
+DOCUMENTATION_WRITER_AGENT = AgentTemplate(
+    role="Documentation Writer",
+    backstory=dedent("""You specialize in writing detailed documentation for code elements such as functions, classes, and modules."""),
+    goal=dedent("""Write comprehensive documentation for each extracted code element, including descriptions, parameters, return types, and usage examples."""),
+    model="gpt-4o",
+    tools=RESEARCH_TOOLS,
+    hedged=True,
+)
+
+# Agent 3: Examples Generator
+EXAMPLES_GENERATOR_AGENT = AgentTemplate(
+    role="Examples Generator",
+    backstory=dedent("""You provide practical usage examples for code elements to demonstrate how they can be used."""),
+    goal=dedent("""Generate usage examples for each code element to help users understand how to use them in practice."""),
+    model="gpt-4o-mini",
+    tools=RESEARCH_TOOLS,
+)
+
 class CustomAgents:
-    def __init__(self):
-        self.OpenAIGPT4Mini = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-        self.OpenAIGPT4 = ChatOpenAI(model="gpt-4o", temperature=0)
-        self.tools = [WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper()),
-                 WikidataQueryRun(api_wrapper=WikidataAPIWrapper()),
-                 Tool(
-                     name="Arxiv",
-                     func=ArxivAPIWrapper().run,
-                     description="A wrapper around Arxiv. Useful for when you need to access academic papers."
-                 )]
-
-    def code_parser_agent(self):
-        # Agent 1: Code Parser
-        return Agent(
-            role="Code Parser",
-            backstory=dedent("""You are an expert in parsing code to extract functions, classes, and modules."""),
-            goal=dedent("""Parse the provided code and extract all functions, classes, and modules along with their signatures."""),
-            tools=self.tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4Mini,
-        )
+    def code_parser_agent(self, **overrides):
+        return CODE_PARSER_AGENT.bind(**overrides)
 
-    def documentation_writer_agent(self):
-        # Agent 2: Documentation Writer
-        return Agent(
-            role="Documentation Writer",
-            backstory=dedent("""You specialize in writing detailed documentation for code elements such as functions, classes, and modules."""),
-            goal=dedent("""Write comprehensive documentation for each extracted code element, including descriptions, parameters, return types, and usage examples."""),
-            tools=self.tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4,
-        )
+    def documentation_writer_agent(self, **overrides):
+        return DOCUMENTATION_WRITER_AGENT.bind(**overrides)
 
-    def examples_generator_agent(self):
-        # Agent 3: Examples Generator
-        return Agent(
-            role="Examples Generator",
-            backstory=dedent("""You provide practical usage examples for code elements to demonstrate how they can be used."""),
-            goal=dedent("""Generate usage examples for each code element to help users understand how to use them in practice."""),
-            tools=self.tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4Mini,
-        )
+    def examples_generator_agent(self, **overrides):
+        return EXAMPLES_GENERATOR_AGENT.bind(**overrides)
 
-    def final_assembler_agent(self):
-        # Agent 4: Final Assembler
-        tools = []
-        return Agent(
-            role="Final Assembler",
-            backstory=dedent("""You assemble all the documentation pieces into a final, cohesive documentation output."""),
-            goal=dedent("""Compile all the documentation and examples into a well-structured documentation file in the desired format."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4,
-        )
-    
 class CustomTasks:
     def __init__(self):
         pass
@@ -108,16 +87,17 @@ class CustomTasks:
         )
 
     def documentation_writing_task(self, agent, code_input: CodeInput):
-        documentation_output_schema = DocumentationOutput.schema_json(indent=2)
+        module_documentation_schema = ModuleDocumentation.schema_json(indent=2)
         return Task(
             description=dedent(f"""
                 Based on the parsed code elements provided, write comprehensive documentation for each function, class, and module.
-                Include descriptions, parameters, return types, and any other relevant details.
-                Provide your output in **JSON format** matching the **DocumentationOutput** schema.
+                Include descriptions, parameters, return types, and any other relevant details. Give each parameter and attribute
+                as an object with a "name", a "type" and a "description". Leave `examples` empty: they are written separately.
+                Provide your output in **JSON format** matching the **ModuleDocumentation** schema.
 
                 **Format**:
                 ```json
-                {documentation_output_schema}
+                {module_documentation_schema}
                 ```
 
                 **Parsed Elements**:
@@ -127,23 +107,20 @@ class CustomTasks:
                 {code_input.context if code_input.context else 'N/A'}
             """),
             agent=agent,
-            expected_output=f"The documentation output in JSON format matching the schema: {documentation_output_schema}",
+            expected_output=f"The module documentation in JSON format matching the schema: {module_documentation_schema}",
         )
 
-    def examples_generation_task(self, agent, code_input: CodeInput):
-        examples_output_schema = {
-            "examples": [{"element_name": "str", "example_code": "str"}]
-        }
-        examples_output_schema_json = json.dumps(examples_output_schema, indent=2)
-
+    def examples_generation_task(self, agent, code_input: CodeInput, context=None):
+        examples_output_schema = ExamplesOutput.schema_json(indent=2)
         return Task(
             description=dedent(f"""
-                Generate usage examples for each code element extracted.
+                Generate usage examples for each code element extracted. Name each example's element as it is named in the code:
+                the function or class name, `Class.method` for a method, or the module name for an example of the module as a whole.
                 Provide your output in **JSON format** matching the **ExamplesOutput** schema.
 
                 **Format**:
                 ```json
-                {examples_output_schema_json}
+                {examples_output_schema}
                 ```
 
                 **Code Elements**:
@@ -153,77 +130,119 @@ class CustomTasks:
                 {code_input.context if code_input.context else 'N/A'}
             """),
             agent=agent,
-            expected_output=f"The examples output in JSON format matching the schema: {examples_output_schema_json}",
+            expected_output=f"The examples output in JSON format matching the schema: {examples_output_schema}",
+            context=context,
         )
 
-    def documentation_assembly_task(self, agent, code_input: CodeInput):
-        final_documentation_schema = {
-            "documentation": "str"
-        }
-        final_documentation_schema_json = json.dumps(final_documentation_schema, indent=2)
-
+    def quick_documentation_task(self, agent, code_input: CodeInput):
+        module_documentation_schema = ModuleDocumentation.schema_json(indent=2)
         return Task(
             description=dedent(f"""
-                Assemble all the documentation and examples into a well-structured documentation file.
-                Ensure the documentation is clear, comprehensive, and follows best practices.
-                Provide your output in **JSON format** matching the **FinalDocumentation** schema.
+                Write well-structured documentation for the following {code_input.language} code, covering each function, class, and module
+                with descriptions, parameters, return types, and a short usage example, in a single pass. Give each parameter and attribute
+                as an object with a "name", a "type" and a "description".
+                Provide your output in **JSON format** matching the **ModuleDocumentation** schema.
 
                 **Format**:
                 ```json
-                {final_documentation_schema_json}
+                {module_documentation_schema}
                 ```
 
-                **Documentation Components**:
-                (Include the documentation and examples from the previous tasks.)
+                **Code**:
+                ```{code_input.language}
+                {code_input.code_snippet}
+                ```
 
                 **Additional Context**:
                 {code_input.context if code_input.context else 'N/A'}
             """),
             agent=agent,
-            expected_output=f"The final documentation in JSON format matching the schema: {final_documentation_schema_json}",
+            expected_output=f"The module documentation in JSON format matching the schema: {module_documentation_schema}",
         )
 
+VERIFICATION_CHECKS = dedent("""
+    Check that the documentation covers every public function, class and module of the code, that signatures,
+    parameters and return types match the code exactly, and that every example would run against it. The output
+    of the examples task belongs in the `examples` of the elements each example shows.""")
+
+# The pipeline's stages in order. The documentation is rendered locally from their output
+STAGES = ("parse", "write", "examples")
+
 class DocumentationGeneratorCrew:
-    def __init__(self, code_snippet, language="python", context=None):
-        self.code_input = CodeInput(code_snippet=code_snippet, language=language, context=context)
+    def __init__(self, code_snippet, language="python", context=None, depth="standard", stages=STAGES):
+        self.code_input = CodeInput(code_snippet=code_snippet, language=language, context=context, depth=depth)
+        self.stages = stages
         self.agents = CustomAgents()
         self.tasks = CustomTasks()
 
     def run(self):
-        # Define agents
-        code_parser_agent = self.agents.code_parser_agent()
-        documentation_writer_agent = self.agents.documentation_writer_agent()
-        examples_generator_agent = self.agents.examples_generator_agent()
-        final_assembler_agent = self.agents.final_assembler_agent()
-
-        # Define tasks
-        code_parsing_task = self.tasks.code_parsing_task(code_parser_agent, self.code_input)
-        documentation_writing_task = self.tasks.documentation_writing_task(documentation_writer_agent, self.code_input)
-        examples_generation_task = self.tasks.examples_generation_task(examples_generator_agent, self.code_input)
-        documentation_assembly_task = self.tasks.documentation_assembly_task(final_assembler_agent, self.code_input)
-
-        # Create the crew
-        crew = Crew(
-            agents=[
+        """Runs the crew and returns the documentation as a ModuleDocumentation dict, ready to render."""
+        module_parser = JsonOutputParser(pydantic_object=ModuleDocumentation)
+        if self.code_input.depth == "quick":
+            # The documentation writer alone, on the fast model, working from the code itself
+            documentation_writer_agent = self.agents.documentation_writer_agent(**quick_overrides())
+            agents = [documentation_writer_agent]
+            tasks = [self.tasks.quick_documentation_task(documentation_writer_agent, self.code_input)]
+            by_stage = {}
+        else:
+            # Define agents
+            code_parser_agent = self.agents.code_parser_agent()
+            documentation_writer_agent = self.agents.documentation_writer_agent()
+            examples_generator_agent = self.agents.examples_generator_agent()
+
+            # Define tasks
+            code_parsing_task = self.tasks.code_parsing_task(code_parser_agent, self.code_input)
+            documentation_writing_task = self.tasks.documentation_writing_task(documentation_writer_agent, self.code_input)
+            # The examples are written from the parsed signatures, not from the previous task's documentation
+            examples_generation_task = self.tasks.examples_generation_task(
+                examples_generator_agent, self.code_input,
+                context=[code_parsing_task] if "parse" in self.stages else None,
+            )
+
+            agents = [
                 code_parser_agent,
                 documentation_writer_agent,
                 examples_generator_agent,
-                final_assembler_agent,
-            ],
-            tasks=[
+            ]
+            tasks = [
                 code_parsing_task,
                 documentation_writing_task,
                 examples_generation_task,
-                documentation_assembly_task,
-            ],
-            verbose=True,
+            ]
+            if tuple(self.stages) != STAGES:
+                # A full review starts after the parsing it shares (see full_review/crew.py)
+                selected = [i for i, stage in enumerate(STAGES) if stage in self.stages]
+                agents = [agents[i] for i in selected]
+                tasks = [tasks[i] for i in selected]
+            by_stage = {stage: task for stage, task in zip(STAGES, [code_parsing_task, documentation_writing_task, examples_generation_task]) if stage in self.stages}
+
+        if self.code_input.depth == "deep":
+            verifier_agent = VERIFIER_AGENT.bind()
+            original = self.code_input.model_dump_json(indent=2, exclude={"depth"})
+            verifier_task = verification_task(verifier_agent, ModuleDocumentation, VERIFICATION_CHECKS, original)
+            # The verifier merges the examples into the documentation it checks
+            verifier_task.context = [by_stage[stage] for stage in ("write", "examples") if stage in by_stage] or None
+            agents.append(verifier_agent)
+            tasks.append(verifier_task)
+
+        # Create the crew
+        crew = Crew(
+            agents=agents,
+            tasks=tasks,
+            verbose=crew_verbose(),
+            task_callback=stage_completed,
         )
 
         result = crew.kickoff()
-        return result
-    
-def run_documentation_generator_crew(args: CodeInput):
-    parser = JsonOutputParser(pydantic_object=DocumentationOutput)
-    crew = DocumentationGeneratorCrew(args.code_snippet, args.language, args.context)
-    results = crew.run()
-    return parser.parse(results.raw)
\ No newline at end of file
+        if self.code_input.depth != "standard" or "write" not in by_stage:
+            return module_parser.parse(result.raw)
+        module = module_parser.parse(by_stage["write"].output.raw)
+        if "examples" in by_stage:
+            module = merge_examples(module, JsonOutputParser(pydantic_object=ExamplesOutput).parse(by_stage["examples"].output.raw))
+        return module
+
+def run_documentation_generator_crew(args: CodeInput, stages: Sequence[str] = STAGES):
+    crew = DocumentationGeneratorCrew(args.code_snippet, args.language, args.context, args.depth, stages)
+    module = crew.run()
+    # What the Final Assembler agent used to do, in milliseconds and without tokens
+    return {"documentation": render_documentation(module, args.output_format, args.language)}
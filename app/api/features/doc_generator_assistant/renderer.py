@@ -0,0 +1,239 @@
+import html
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Renders a ModuleDocumentation (as parsed from the agents' JSON, so any field may be
+# missing or of the wrong type) in place of an LLM assembler. Elements render in the
+# order the writer listed them; fields a model left out or malformed are skipped.
+
+def _parameters(items: Optional[List[dict]]) -> List[Tuple[str, Optional[str], str]]:
+    """(name, type, description) of each parameter or attribute; keys the writer added are folded into the description."""
+    parameters = []
+    for item in items or []:
+        if isinstance(item, str):
+            item = {"name": item}
+        if not isinstance(item, dict):
+            continue
+        item = dict(item)
+        name = str(item.pop("name", None) or item.pop("parameter", None) or item.pop("attribute", None) or "")
+        type_ = item.pop("type", None)
+        description = str(item.pop("description", None) or "")
+        extra = "; ".join(f"{key}: {value}" for key, value in item.items() if value not in (None, ""))
+        if not name:
+            continue
+        parameters.append((name, str(type_) if type_ else None, f"{description} ({extra})" if description and extra else description or extra))
+    return parameters
+
+def _signature(function: dict) -> str:
+    return f"{function.get('function_name', '')}({', '.join(name for name, _, _ in _parameters(function.get('parameters')))})"
+
+def _named(elements: Optional[List[dict]], key: str) -> List[dict]:
+    return [element for element in elements or [] if isinstance(element, dict) and element.get(key)]
+
+def _examples(element: dict) -> List[str]:
+    examples = element.get("examples")
+    examples = [examples] if isinstance(examples, str) else examples if isinstance(examples, list) else []
+    return [example for example in examples if isinstance(example, str) and example.strip()]
+
+def _element_names(module: dict) -> Dict[str, dict]:
+    """Every documented element by the names an example may use for it."""
+    names = {}
+    for function in _named(module.get("functions"), "function_name"):
+        names[function["function_name"]] = function
+    for cls in _named(module.get("classes"), "class_name"):
+        names[cls["class_name"]] = cls
+        for method in _named(cls.get("methods"), "function_name"):
+            names[f"{cls['class_name']}.{method['function_name']}"] = method
+    return names
+
+def merge_examples(module: Any, examples: Any) -> Any:
+    """
+    Adds the examples stage's output to the elements they show; those for unknown
+    elements, and bare code strings, go to the module. Entries that are neither are skipped.
+    """
+    if not isinstance(module, dict):
+        return module
+    names = _element_names(module)
+    if isinstance(examples, dict):
+        examples = examples.get("examples")
+    for example in examples if isinstance(examples, list) else []:
+        if isinstance(example, str):
+            name, code = "", example
+        elif isinstance(example, dict):
+            name, code = str(example.get("element_name") or "").strip(), example.get("example_code")
+        else:
+            continue
+        if not isinstance(code, str) or not code.strip():
+            continue
+        target = names.get(name) or names.get(name.split("(")[0].strip()) or module
+        existing = target.get("examples")
+        existing = existing if isinstance(existing, list) else [existing] if isinstance(existing, str) else []
+        if code not in existing:
+            target["examples"] = existing + [code]
+    return module
+
+# Markdown
+
+def _markdown_function(function: dict, level: int, language: str) -> List[str]:
+    lines = [f"{'#' * level} `{_signature(function)}`", ""]
+    if function.get("description"):
+        lines += [str(function["description"]), ""]
+    parameters = _parameters(function.get("parameters"))
+    if parameters:
+        lines += ["**Parameters**", ""]
+        lines += [f"- `{name}`" + (f" (`{type_}`)" if type_ else "") + (f": {description}" if description else "") for name, type_, description in parameters]
+        lines.append("")
+    if function.get("return_type"):
+        lines += [f"**Returns:** `{function['return_type']}`", ""]
+    lines += _markdown_examples(function, language)
+    return lines
+
+def _markdown_examples(element: dict, language: str) -> List[str]:
+    lines = []
+    for example in _examples(element):
+        lines += [f"```{language}", example.strip("\n"), "```", ""]
+    return (["**Examples**", ""] + lines) if lines else []
+
+def render_markdown(module: dict, language: str) -> str:
+    lines = [f"# {str(module.get('module_name') or 'Module')}", ""]
+    if module.get("description"):
+        lines += [str(module["description"]), ""]
+    lines += _markdown_examples(module, language)
+    functions, classes = _named(module.get("functions"), "function_name"), _named(module.get("classes"), "class_name")
+    if functions:
+        lines += ["## Functions", ""]
+        for function in functions:
+            lines += _markdown_function(function, 3, language)
+    if classes:
+        lines += ["## Classes", ""]
+        for cls in classes:
+            lines += [f"### `{cls['class_name']}`", ""]
+            if cls.get("description"):
+                lines += [str(cls["description"]), ""]
+            attributes = _parameters(cls.get("attributes"))
+            if attributes:
+                lines += ["**Attributes**", ""]
+                lines += [f"- `{name}`" + (f" (`{type_}`)" if type_ else "") + (f": {description}" if description else "") for name, type_, description in attributes]
+                lines.append("")
+            lines += _markdown_examples(cls, language)
+            for method in _named(cls.get("methods"), "function_name"):
+                lines += _markdown_function(method, 4, language)
+    return "\n".join(lines).rstrip() + "\n"
+
+# reStructuredText, with Sphinx's domain directives
+
+def _indent(lines: List[str], by: int) -> List[str]:
+    return [(" " * by + line) if line else "" for line in lines]
+
+def _rst_heading(text: str, underline: str) -> List[str]:
+    return [text, underline * len(text), ""]
+
+def _rst_examples(element: dict, language: str) -> List[str]:
+    lines = []
+    for example in _examples(element):
+        lines += [f".. code-block:: {language}", ""] + _indent(example.strip("\n").splitlines(), 3) + [""]
+    return lines
+
+def _rst_function(function: dict, directive: str, language: str) -> List[str]:
+    body = []
+    if function.get("description"):
+        body += str(function["description"]).splitlines() + [""]
+    for name, type_, description in _parameters(function.get("parameters")):
+        body.append(f":param {name}: {description}".rstrip())
+        if type_:
+            body.append(f":type {name}: {type_}")
+    if function.get("return_type"):
+        body.append(f":rtype: {function['return_type']}")
+    if body and body[-1]:
+        body.append("")
+    body += _rst_examples(function, language)
+    return [f".. {directive}:: {_signature(function)}", ""] + _indent(body, 3)
+
+def render_rst(module: dict, language: str) -> str:
+    lines = _rst_heading(str(module.get("module_name") or "Module"), "=")
+    if module.get("description"):
+        lines += str(module["description"]).splitlines() + [""]
+    lines += _rst_examples(module, language)
+    functions, classes = _named(module.get("functions"), "function_name"), _named(module.get("classes"), "class_name")
+    if functions:
+        lines += _rst_heading("Functions", "-")
+        for function in functions:
+            lines += _rst_function(function, "function", language)
+    if classes:
+        lines += _rst_heading("Classes", "-")
+        for cls in classes:
+            body = []
+            if cls.get("description"):
+                body += str(cls["description"]).splitlines() + [""]
+            for name, type_, description in _parameters(cls.get("attributes")):
+                # Directive options come before the blank line, content after it
+                body += [f".. attribute:: {name}"] + _indent([f":type: {type_}"] if type_ else [], 3) + [""]
+                body += _indent([description, ""], 3) if description else []
+            body += _rst_examples(cls, language)
+            for method in _named(cls.get("methods"), "function_name"):
+                body += _rst_function(method, "method", language)
+            lines += [f".. class:: {cls['class_name']}", ""] + _indent(body, 3)
+    return "\n".join(lines).rstrip() + "\n"
+
+# HTML fragment
+
+def _html_examples(element: dict, language: str) -> List[str]:
+    return [
+        f'<pre><code class="language-{html.escape(language)}">{html.escape(example.strip(chr(10)))}</code></pre>'
+        for example in _examples(element)
+    ]
+
+def _html_definitions(items: List[Tuple[str, Optional[str], str]]) -> List[str]:
+    lines = ["<dl>"]
+    for name, type_, description in items:
+        lines.append(f"<dt><code>{html.escape(name)}</code>" + (f" (<code>{html.escape(type_)}</code>)" if type_ else "") + "</dt>")
+        lines.append(f"<dd>{html.escape(description)}</dd>")
+    return lines + ["</dl>"]
+
+def _html_function(function: dict, level: int, language: str) -> List[str]:
+    lines = ['<section class="function">', f"<h{level}><code>{html.escape(_signature(function))}</code></h{level}>"]
+    if function.get("description"):
+        lines.append(f"<p>{html.escape(str(function['description']))}</p>")
+    parameters = _parameters(function.get("parameters"))
+    if parameters:
+        lines += ["<h6>Parameters</h6>"] + _html_definitions(parameters)
+    if function.get("return_type"):
+        lines.append(f"<p><strong>Returns:</strong> <code>{html.escape(str(function['return_type']))}</code></p>")
+    return lines + _html_examples(function, language) + ["</section>"]
+
+def render_html(module: dict, language: str) -> str:
+    lines = ['<article class="module-documentation">', f"<h1>{html.escape(str(module.get('module_name') or 'Module'))}</h1>"]
+    if module.get("description"):
+        lines.append(f"<p>{html.escape(str(module['description']))}</p>")
+    lines += _html_examples(module, language)
+    functions, classes = _named(module.get("functions"), "function_name"), _named(module.get("classes"), "class_name")
+    if functions:
+        lines.append("<h2>Functions</h2>")
+        for function in functions:
+            lines += _html_function(function, 3, language)
+    if classes:
+        lines.append("<h2>Classes</h2>")
+        for cls in classes:
+            lines += ['<section class="class">', f"<h3><code>{html.escape(str(cls['class_name']))}</code></h3>"]
+            if cls.get("description"):
+                lines.append(f"<p>{html.escape(str(cls['description']))}</p>")
+            attributes = _parameters(cls.get("attributes"))
+            if attributes:
+                lines += ["<h6>Attributes</h6>"] + _html_definitions(attributes)
+            lines += _html_examples(cls, language)
+            for method in _named(cls.get("methods"), "function_name"):
+                lines += _html_function(method, 4, language)
+            lines.append("</section>")
+    return "\n".join(lines + ["</article>"]) + "\n"
+
+RENDERERS: Dict[str, Callable[[dict, str], str]] = {
+    "markdown": render_markdown,
+    "rst": render_rst,
+    "html": render_html,
+}
+
+def render_documentation(module: Any, output_format: str = "markdown", language: str = "python") -> str:
+    """Renders a module, or each module of a list in turn; text the agents returned instead of JSON passes through as is."""
+    if isinstance(module, str):
+        return module
+    modules = module if isinstance(module, list) else [module]
+    return "\n".join(RENDERERS[output_format](item, language) for item in modules if isinstance(item, dict))
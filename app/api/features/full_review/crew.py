@@ -0,0 +1,160 @@
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from app.api.schemas.full_review_schema import CodeInput, SharedAnalysis
+from app.api.schemas.doc_generator_assistant_schema import CodeInput as DocumentationCodeInput
+from app.api.schemas.refactoring_assistant_schema import CodeInput as RefactoringCodeInput
+from app.api.features.doc_generator_assistant.crew import STAGES as DOCUMENTATION_STAGES, run_documentation_generator_crew
+from app.api.features.multi_agent_debugging_assistant.crew import STAGES as DEBUGGING_STAGES, input_details, run_multi_agent_debugging_crew, static_findings
+from app.api.features.multi_agent_debugging_assistant.static_analysis import StaticReport, analyze_code, record_report, static_analysis_enabled
+from app.api.features.refactoring_assistant.crew import STAGES as REFACTORING_STAGES, run_refactoring_assistant_crew
+from crewai import (
+    Crew,
+    Task
+)
+from textwrap import dedent
+from app.api.agent_templates import AgentTemplate
+from app.api.logger import crew_verbose, setup_logger
+from app.api.request_context import merge_usage, record_usage, stage_completed
+from app.api.tools import python_repl_tool
+from langchain_core.output_parsers import JsonOutputParser
+
+logger = setup_logger(__name__)
+
+# Does the work of the Code Analysis Expert, Bug Finder and Code Parser in one pass
+SHARED_ANALYSIS_AGENT = AgentTemplate(
+    role="Code Review Analyst",
+    backstory=dedent("""You are an expert code reviewer who reads code once and records everything later reviewers need: its structure, its quality issues and metrics, and its bugs."""),
+    goal=dedent("""Analyze the provided code in a single pass: extract its functions, classes and modules with their signatures, identify issues and code smells with complexity metrics, and find its bugs."""),
+    model="gpt-4o-mini",
+    tools=(python_repl_tool,),
+)
+
+class CustomAgents:
+    def shared_analysis_agent(self, **overrides):
+        return SHARED_ANALYSIS_AGENT.bind(**overrides)
+
+class CustomTasks:
+    def __init__(self):
+        pass
+
+    def shared_analysis_task(self, agent, code_input: CodeInput, static_report: Optional[StaticReport] = None):
+        shared_analysis_schema = SharedAnalysis.schema_json(indent=2)
+        return Task(
+            description=dedent(f"""
+                Analyze the following {code_input.language} code snippet for three reviews that will build on your analysis:
+                - **structure**: all functions, classes, and modules along with their signatures and docstrings;
+                - **quality**: issues, potential bugs, and code smells, with complexity metrics such as cyclomatic complexity, maintainability index, and technical debt;
+                - **bugs**: syntax errors, runtime errors, logical errors and any unexpected behavior, with detailed information about each bug.
+                Provide your output in **JSON format** matching the **SharedAnalysis** schema.
+
+                **Format**:
+                ```json
+                {shared_analysis_schema}
+                ```
+
+                **Code**:
+                ```{code_input.language}
+                {code_input.code_snippet}
+                ```
+
+                **Additional Context**:
+                {code_input.context if code_input.context else 'N/A'}
+{input_details(code_input, None)}
+{static_findings(static_report)}
+            """),
+            agent=agent,
+            expected_output=f"The shared analysis in JSON format matching the schema: {shared_analysis_schema}",
+        )
+
+class FullReviewCrew:
+    def __init__(self, code_input: CodeInput):
+        self.code_input = code_input
+        self.agents = CustomAgents()
+        self.tasks = CustomTasks()
+
+    def run(self):
+        # The shared analysis finds the bugs in place of the Bug Finder, so it gets the static findings
+        static_report = None
+        if static_analysis_enabled(self.code_input):
+            static_report = analyze_code(self.code_input.code_snippet, self.code_input.language)
+            record_report(static_report)
+        shared_analysis_agent = self.agents.shared_analysis_agent()
+        shared_analysis_task = self.tasks.shared_analysis_task(shared_analysis_agent, self.code_input, static_report)
+
+        # Create the crew
+        crew = Crew(
+            agents=[shared_analysis_agent],
+            tasks=[shared_analysis_task],
+            verbose=crew_verbose(),
+            task_callback=stage_completed,
+        )
+
+        result = crew.kickoff()
+        return result
+
+def with_analysis(context: Optional[str], title: str, analysis: Optional[dict]) -> Optional[str]:
+    """Adds one part of the shared analysis to a branch's context, in place of the branch's own first stage."""
+    if analysis is None:
+        return context
+    shared = f"{title} (the output of the previous task, shared with the other reviews of this code):\n{json.dumps(analysis, indent=2)}"
+    return f"{context}\n\n{shared}" if context else shared
+
+def _run_branch(run, *args):
+    # Each branch records its own usage, so its stages stay in order; the totals are merged afterwards
+    with record_usage() as usage:
+        try:
+            return run(*args), None, usage
+        except Exception as e:
+            return None, e, usage
+
+def run_full_review_crew(args: CodeInput):
+    """
+    Refactoring, debugging and documentation of one snippet. One shared analysis
+    replaces the first stage of each pipeline, and the rest of the three pipelines
+    run concurrently on top of it. At depth quick there is no shared analysis and
+    the three quick crews run concurrently.
+    """
+    analysis = None
+    if args.depth != "quick":
+        results = FullReviewCrew(args).run()
+        analysis = JsonOutputParser(pydantic_object=SharedAnalysis).parse(results.raw)
+    shared = analysis or {}
+
+    base = args.model_dump(include={"code_snippet", "language", "context", "depth"})
+    branches = {
+        "refactoring": (
+            run_refactoring_assistant_crew,
+            RefactoringCodeInput(**{**base, "output_mode": args.output_mode,
+                                    "context": with_analysis(args.context, "Code analysis", shared.get("quality"))}),
+            REFACTORING_STAGES[1:] if analysis else REFACTORING_STAGES,
+        ),
+        "debugging": (
+            run_multi_agent_debugging_crew,
+            args.model_copy(update={"context": with_analysis(args.context, "Bugs found", shared.get("bugs"))}),
+            DEBUGGING_STAGES[1:] if analysis else DEBUGGING_STAGES,
+        ),
+        "documentation": (
+            run_documentation_generator_crew,
+            DocumentationCodeInput(**{**base, "output_format": args.documentation_format,
+                                      "context": with_analysis(args.context, "Parsing output", shared.get("structure"))}),
+            DOCUMENTATION_STAGES[1:] if analysis else DOCUMENTATION_STAGES,
+        ),
+    }
+
+    output = {"analysis": analysis, "errors": {}}
+    with ThreadPoolExecutor(max_workers=len(branches), thread_name_prefix="full-review") as pool:
+        # A copy of the context per branch carries the deadline, model overrides and usage recorder along
+        futures = {
+            name: pool.submit(contextvars.copy_context().run, _run_branch, *branch)
+            for name, branch in branches.items()
+        }
+        for name, future in futures.items():
+            output[name], error, usage = future.result()
+            merge_usage(usage)
+            if error is not None:
+                # The other branches are still worth returning
+                logger.error(f"Full review branch '{name}' failed: {error}")
+                output["errors"][name] = str(error)
+    return output
@@ -1,202 +1,142 @@
 from app.api.schemas.llm_app_development_assistant_schema import ApplicationIdea, DevelopmentOutput
 from crewai import (
-    Agent,
     Task,
     Crew
 )
 from textwrap import dedent
-from langchain_openai import ChatOpenAI
-from langchain_community.tools import TavilySearchResults
-from langchain_community.utilities import WikipediaAPIWrapper
-from langchain_community.tools.arxiv.tool import ArxivAPIWrapper
-from langchain.tools import Tool
+from typing import Optional
+import os
+from app.api.agent_templates import AgentTemplate
+from app.api.depth import VERIFIER_AGENT, depth_instructions, quick_overrides, verification_task
+from app.api.logger import crew_verbose
+from app.api.request_context import stage_completed
+from app.api.tools import arxiv_tool, tavily_search_tool, wikipedia_tool
+from app.api.features.llm_app_development_assistant.research import format_research_context, prefetch_research
 from langchain_core.output_parsers import JsonOutputParser
 
+RESEARCH_TOOLS = (tavily_search_tool, wikipedia_tool, arxiv_tool)
+
+# Agent 1: Feasibility Analyst
+FEASIBILITY_AGENT = AgentTemplate(
+    role="Feasibility Analyst",
+    backstory=dedent("""You are an expert in assessing the feasibility of software projects, especially those involving LLMs. You utilize tools like Wikipedia and Arxiv to gather necessary information."""),
+    goal=dedent("""Analyze the user's application idea and determine the feasibility of developing the desired LLM application. Provide detailed reasons and recommendations, using the provided tools to support your analysis."""),
+    model="gpt-4o-mini",
+    tools=RESEARCH_TOOLS,
+)
+
+# Agent 2: Solution Architect
+DESIGN_AGENT = AgentTemplate(
+    role="Solution Architect",
+    backstory=dedent("""You specialize in designing architectures for applications that leverage LLMs. You frequently consult resources like Wikipedia and Arxiv for the latest design patterns and technologies."""),
+    goal=dedent("""Provide a detailed design architecture for the LLM application, including components, data flow, and integrations. Use the provided tools to enhance your design recommendations."""),
+    model="gpt-4o",
+    tools=RESEARCH_TOOLS,
+    hedged=True,
+)
+
+# Agent 3: Implementation Planner
+IMPLEMENTATION_AGENT = AgentTemplate(
+    role="Implementation Planner",
+    backstory=dedent("""You provide detailed implementation plans for software projects involving LLMs. You utilize tools like Wikipedia and Arxiv to inform your planning."""),
+    goal=dedent("""Create an implementation plan for the LLM application, including timeline, cost estimation, and resource requirements. Use the provided tools to inform your plan."""),
+    model="gpt-4o-mini",
+    tools=RESEARCH_TOOLS,
+)
+
+# Agent 4: Development Advisor
+OUTPUT_AGENT = AgentTemplate(
+    role="Development Advisor",
+    backstory=dedent("""You combine all the information and provide a comprehensive development output to the user. You leverage tools like Wikipedia and Arxiv to ensure your advice is well-informed."""),
+    goal=dedent("""Using the initial application idea, provide a comprehensive development output, including feasibility, design architecture, recommended tools, implementation plan, and other relevant details, matching the DevelopmentOutput schema. Use the provided tools to enhance your recommendations."""),
+    model="gpt-4o",
+    tools=RESEARCH_TOOLS,
+)
+
 class CustomAgents:
-    def __init__(self):
-        self.OpenAIGPT4Mini = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-        self.OpenAIGPT4 = ChatOpenAI(model="gpt-4o", temperature=0)
-
-    def feasibility_agent(self):
-        # Agent 1: Feasibility Analyst
-        tools = [
-            TavilySearchResults(
-                max_results=5,
-                search_depth="advanced",
-                include_answer=True,
-                include_raw_content=True,
-            ),
-            Tool(
-                name="Wikipedia",
-                func=WikipediaAPIWrapper().run,
-                description="Access Wikipedia articles for information."
-            ),
-            Tool(
-                name="Arxiv",
-                func=ArxivAPIWrapper().run,
-                description="Access academic papers from Arxiv."
-            ),
-        ]
-        return Agent(
-            role="Feasibility Analyst",
-            backstory=dedent("""You are an expert in assessing the feasibility of software projects, especially those involving LLMs. You utilize tools like Wikipedia and Arxiv to gather necessary information."""),
-            goal=dedent("""Analyze the user's application idea and determine the feasibility of developing the desired LLM application. Provide detailed reasons and recommendations, using the provided tools to support your analysis."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4Mini,
-        )
+    def feasibility_agent(self, **overrides):
+        return FEASIBILITY_AGENT.bind(**overrides)
 
-    def design_agent(self):
-        # Agent 2: Solution Architect
-        tools = [
-            TavilySearchResults(
-                max_results=5,
-                search_depth="advanced",
-                include_answer=True,
-                include_raw_content=True,
-            ),
-            Tool(
-                name="Wikipedia",
-                func=WikipediaAPIWrapper().run,
-                description="Access Wikipedia articles for information."
-            ),
-            Tool(
-                name="Arxiv",
-                func=ArxivAPIWrapper().run,
-                description="Access academic papers from Arxiv."
-            ),
-        ]
-        return Agent(
-            role="Solution Architect",
-            backstory=dedent("""You specialize in designing architectures for applications that leverage LLMs. You frequently consult resources like Wikipedia and Arxiv for the latest design patterns and technologies."""),
-            goal=dedent("""Provide a detailed design architecture for the LLM application, including components, data flow, and integrations. Use the provided tools to enhance your design recommendations."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4,
-        )
+    def design_agent(self, **overrides):
+        return DESIGN_AGENT.bind(**overrides)
 
-    def implementation_agent(self):
-        # Agent 3: Implementation Planner
-        tools = [
-            TavilySearchResults(
-                max_results=5,
-                search_depth="advanced",
-                include_answer=True,
-                include_raw_content=True,
-            ),
-            Tool(
-                name="Wikipedia",
-                func=WikipediaAPIWrapper().run,
-                description="Access Wikipedia articles for information."
-            ),
-            Tool(
-                name="Arxiv",
-                func=ArxivAPIWrapper().run,
-                description="Access academic papers from Arxiv."
-            ),
-        ]
-        return Agent(
-            role="Implementation Planner",
-            backstory=dedent("""You provide detailed implementation plans for software projects involving LLMs. You utilize tools like Wikipedia and Arxiv to inform your planning."""),
-            goal=dedent("""Create an implementation plan for the LLM application, including timeline, cost estimation, and resource requirements. Use the provided tools to inform your plan."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4Mini,
-        )
+    def implementation_agent(self, **overrides):
+        return IMPLEMENTATION_AGENT.bind(**overrides)
 
-    def output_agent(self):
-        # Agent 4: Development Advisor
-        tools = [
-            TavilySearchResults(
-                max_results=5,
-                search_depth="advanced",
-                include_answer=True,
-                include_raw_content=True,
-            ),
-            Tool(
-                name="Wikipedia",
-                func=WikipediaAPIWrapper().run,
-                description="Access Wikipedia articles for information."
-            ),
-            Tool(
-                name="Arxiv",
-                func=ArxivAPIWrapper().run,
-                description="Access academic papers from Arxiv."
-            ),
-        ]
-        return Agent(
-            role="Development Advisor",
-            backstory=dedent("""You combine all the information and provide a comprehensive development output to the user. You leverage tools like Wikipedia and Arxiv to ensure your advice is well-informed."""),
-            goal=dedent("""Using the initial application idea, provide a comprehensive development output, including feasibility, design architecture, recommended tools, implementation plan, and other relevant details, matching the DevelopmentOutput schema. Use the provided tools to enhance your recommendations."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4,
-        )
+    def output_agent(self, **overrides):
+        return OUTPUT_AGENT.bind(**overrides)
+
+def research_instructions(purpose: str, research_context: Optional[str]) -> str:
+    if research_context is None:
+        return f"**Use the tools provided to {purpose}.**"
+    return f"**Use the Research Context below to {purpose}; cite sources by their [number].**"
+
+def research_section(research_context: Optional[str]) -> str:
+    if research_context is None:
+        return ""
+    return f"\n                **Research Context**:\n\n{research_context}\n"
 
 class CustomTasks:
     def __init__(self):
         pass
 
-    def feasibility_task(self, agent, application_idea: ApplicationIdea):
+    def feasibility_task(self, agent, application_idea: ApplicationIdea, research_context: Optional[str] = None):
         return Task(
             description=dedent(f"""
                 Analyze the following application idea and determine the feasibility of developing the desired LLM application.
                 Provide detailed reasons and recommendations.
-                **Use the tools provided to support your analysis.**
+                {research_instructions("support your analysis", research_context)}
 
                 **Application Idea**:
 
-    {application_idea.model_dump_json(indent=2)}
-
+    {application_idea.model_dump_json(indent=2, exclude={"prefetch_research", "depth"})}
+{research_section(research_context)}
             """),
             agent=agent,
             expected_output="A feasibility analysis with detailed reasons and recommendations.",
         )
 
-    def design_task(self, agent, application_idea: ApplicationIdea):
+    def design_task(self, agent, application_idea: ApplicationIdea, research_context: Optional[str] = None):
         return Task(
             description=dedent(f"""
                 Provide a detailed design architecture for the following application idea.
                 Include components, data flow, and integrations.
-                **Use the tools provided to enhance your design recommendations.**
+                {research_instructions("enhance your design recommendations", research_context)}
 
                 **Application Idea**:
 
-    {application_idea.model_dump_json(indent=2)}
-
+    {application_idea.model_dump_json(indent=2, exclude={"prefetch_research", "depth"})}
+{research_section(research_context)}
             """),
             agent=agent,
             expected_output="A design architecture including components, data flow, and integrations.",
         )
 
-    def implementation_task(self, agent, application_idea: ApplicationIdea):
+    def implementation_task(self, agent, application_idea: ApplicationIdea, research_context: Optional[str] = None):
         return Task(
             description=dedent(f"""
                 Create an implementation plan for the following application idea.
                 Include timeline, cost estimation, and resource requirements.
-                **Use the tools provided to inform your plan.**
+                {research_instructions("inform your plan", research_context)}
 
                 **Application Idea**:
 
-    {application_idea.model_dump_json(indent=2)}
-
+    {application_idea.model_dump_json(indent=2, exclude={"prefetch_research", "depth"})}
+{research_section(research_context)}
             """),
             agent=agent,
             expected_output="An implementation plan including timeline, cost estimation, and resource requirements.",
         )
 
-    def development_output_task(self, agent, application_idea: ApplicationIdea):
+    def development_output_task(self, agent, application_idea: ApplicationIdea, research_context: Optional[str] = None):
         development_output_schema = DevelopmentOutput.schema_json(indent=2)
         return Task(
             description=dedent(f"""
                 Using the initial application idea, provide a comprehensive development output.
                 Include feasibility, design architecture, recommended tools, implementation plan, and other relevant details.
+                {depth_instructions(application_idea.depth)}
                 Provide your output in **JSON format** matching the **DevelopmentOutput** schema.
-                **Use the tools provided to ensure your advice is well-informed.**
+                {research_instructions("ensure your advice is well-informed", research_context)}
 
                 **Format**:
 
@@ -205,50 +145,79 @@ class CustomTasks:
 
                 **Application Idea**:
 
-    {application_idea.model_dump_json(indent=2)}
-
+    {application_idea.model_dump_json(indent=2, exclude={"prefetch_research", "depth"})}
+{research_section(research_context)}
             """),
             agent=agent,
             expected_output=f"The development output in JSON format matching the schema: {development_output_schema}",
         )
 
+VERIFICATION_CHECKS = dedent("""
+    Check that every field is filled in and specific to this idea, that the recommended tools fit the design
+    architecture, and that the implementation plan, timeline and cost estimates are consistent with each other.""")
+
 class LLMDevelopmentAssistantCrew:
-    def __init__(self, project_name, description):
+    def __init__(self, project_name, description, prefetch_research=False, depth="standard"):
         self.application_idea = ApplicationIdea(
             project_name=project_name,
-            description=description
+            description=description,
+            depth=depth,
         )
+        self.prefetch_research = prefetch_research
         self.agents = CustomAgents()
         self.tasks = CustomTasks()
 
     def run(self):
-        # Define agents
-        feasibility_agent = self.agents.feasibility_agent()
-        design_agent = self.agents.design_agent()
-        implementation_agent = self.agents.implementation_agent()
-        output_agent = self.agents.output_agent()
-
-        # Define tasks
-        feasibility_task = self.tasks.feasibility_task(feasibility_agent, self.application_idea)
-        design_task = self.tasks.design_task(design_agent, self.application_idea)
-        implementation_task = self.tasks.implementation_task(implementation_agent, self.application_idea)
-        development_output_task = self.tasks.development_output_task(output_agent, self.application_idea)
-
-        # Create the crew
-        crew = Crew(
-            agents=[
+        if self.application_idea.depth == "quick":
+            # The development advisor alone, on the fast model and without research
+            output_agent = self.agents.output_agent(**quick_overrides())
+            agents = [output_agent]
+            tasks = [self.tasks.development_output_task(output_agent, self.application_idea)]
+        else:
+            # With prefetched research the agents reason over the shared context instead of calling tools
+            research_context = None
+            overrides = {}
+            if self.prefetch_research:
+                research_context = format_research_context(prefetch_research(self.application_idea))
+                overrides = {"tools": []}
+
+            # Define agents
+            feasibility_agent = self.agents.feasibility_agent(**overrides)
+            design_agent = self.agents.design_agent(**overrides)
+            implementation_agent = self.agents.implementation_agent(**overrides)
+            output_agent = self.agents.output_agent(**overrides)
+
+            # Define tasks
+            feasibility_task = self.tasks.feasibility_task(feasibility_agent, self.application_idea, research_context)
+            design_task = self.tasks.design_task(design_agent, self.application_idea, research_context)
+            implementation_task = self.tasks.implementation_task(implementation_agent, self.application_idea, research_context)
+            development_output_task = self.tasks.development_output_task(output_agent, self.application_idea, research_context)
+
+            agents = [
                 feasibility_agent,
                 design_agent,
                 implementation_agent,
                 output_agent,
-            ],
-            tasks=[
+            ]
+            tasks = [
                 feasibility_task,
                 design_task,
                 implementation_task,
                 development_output_task,
-            ],
-            verbose=True,
+            ]
+
+        if self.application_idea.depth == "deep":
+            verifier_agent = VERIFIER_AGENT.bind(tools=[])
+            original = self.application_idea.model_dump_json(indent=2, exclude={"prefetch_research", "depth"})
+            agents.append(verifier_agent)
+            tasks.append(verification_task(verifier_agent, DevelopmentOutput, VERIFICATION_CHECKS, original))
+
+        # Create the crew
+        crew = Crew(
+            agents=agents,
+            tasks=tasks,
+            verbose=crew_verbose(),
+            task_callback=stage_completed,
         )
 
         result = crew.kickoff()
@@ -256,6 +225,9 @@ class LLMDevelopmentAssistantCrew:
     
 def run_llm_development_assistant_crew(args: ApplicationIdea):
     parser = JsonOutputParser(pydantic_object=DevelopmentOutput)
-    crew = LLMDevelopmentAssistantCrew(args.project_name, args.description)
+    prefetch = args.prefetch_research
+    if prefetch is None:
+        prefetch = os.environ.get("LLM_APP_PREFETCH_RESEARCH", "false").lower() == "true"
+    crew = LLMDevelopmentAssistantCrew(args.project_name, args.description, prefetch, args.depth)
     results = crew.run()
     return parser.parse(results.raw)
\ No newline at end of file
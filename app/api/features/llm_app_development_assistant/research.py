@@ -0,0 +1,135 @@
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import List, Optional
+from app.api.schemas.llm_app_development_assistant_schema import ApplicationIdea
+from app.api.tools import arxiv_tool, tavily_search_tool, wikipedia_tool
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+PREFETCH_TIMEOUT_SECONDS = float(os.environ.get("LLM_APP_PREFETCH_TIMEOUT_SECONDS", 20))
+RESEARCH_MAX_CHARS = int(os.environ.get("LLM_APP_RESEARCH_MAX_CHARS", 8000))
+
+_STOPWORDS = {
+    "about", "after", "also", "application", "based", "be", "build", "could", "each", "from", "have", "into",
+    "that", "their", "them", "then", "there", "these", "they", "this", "using", "want", "what", "when",
+    "which", "will", "with", "would", "your", "should", "users", "user", "app", "like", "make", "allow",
+}
+
+# Threads are only started on the first prefetch, so the pool is safe to create before gunicorn forks
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="research")
+
+@dataclass(frozen=True)
+class ResearchQuery:
+    source: str
+    query: str
+
+@dataclass
+class ResearchResult:
+    source: str
+    query: str
+    title: str
+    content: str
+    url: Optional[str] = None
+    score: float = 0.0
+
+def keywords(idea: ApplicationIdea, limit: int = 6) -> List[str]:
+    words = re.findall(r"[a-zA-Z][a-zA-Z0-9+#-]{3,}", f"{idea.project_name} {idea.description}".lower())
+    counts = Counter(word for word in words if word not in _STOPWORDS)
+    return [word for word, _ in counts.most_common(limit)]
+
+def research_queries(idea: ApplicationIdea) -> List[ResearchQuery]:
+    """The searches the agents would otherwise make one at a time, derived from the idea."""
+    terms = keywords(idea)
+    summary = re.split(r"(?<=[.!?])\s", idea.description.strip(), maxsplit=1)[0][:200]
+    return [
+        ResearchQuery("Tavily", f"{idea.project_name}: {summary} LLM application architecture"),
+        ResearchQuery("Tavily", f"frameworks and tools for building LLM applications for {' '.join(terms[:3])}"),
+        ResearchQuery("Wikipedia", " ".join(terms[:3])),
+        ResearchQuery("Wikipedia", "Large language model"),
+        ResearchQuery("Arxiv", f"large language model {' '.join(terms[:4])}"),
+    ]
+
+def _parse_tavily(query: ResearchQuery, output) -> List[ResearchResult]:
+    if not isinstance(output, list):  # the tool returns the error text instead of raising
+        raise RuntimeError(str(output)[:200])
+    return [
+        ResearchResult(query.source, query.query, item.get("title") or item.get("url", ""), item.get("content", ""), item.get("url"))
+        for item in output if isinstance(item, dict) and item.get("content")
+    ]
+
+def _parse_documents(pattern: str, query: ResearchQuery, output: str) -> List[ResearchResult]:
+    """Wikipedia and Arxiv wrappers return 'Field: value' blocks separated by blank lines."""
+    results = []
+    for block in str(output).split("\n\n"):
+        title = re.search(pattern, block)
+        if title:
+            results.append(ResearchResult(query.source, query.query, title.group(1).strip(), block.strip()))
+    return results
+
+SOURCES = {
+    "Tavily": (tavily_search_tool, _parse_tavily),
+    "Wikipedia": (wikipedia_tool, lambda query, output: _parse_documents(r"Page: (.*)", query, output)),
+    "Arxiv": (arxiv_tool, lambda query, output: _parse_documents(r"(?:Title|Page): (.*)", query, output)),
+}
+
+def _run(query: ResearchQuery) -> List[ResearchResult]:
+    factory, parse = SOURCES[query.source]
+    return parse(query, factory().run(query.query))
+
+def _tokens(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]{3,}", text.lower()))
+
+def rank(results: List[ResearchResult], terms: List[str]) -> List[ResearchResult]:
+    """Drops repeated and near-identical results, then orders the rest by how many of the idea's terms they cover."""
+    unique: List[ResearchResult] = []
+    seen_keys = set()
+    seen_tokens: List[set] = []
+    for result in results:
+        key = (result.url or result.title).strip().lower()
+        tokens = _tokens(result.content)
+        if key in seen_keys or any(len(tokens & other) > 0.8 * min(len(tokens), len(other)) for other in seen_tokens if other):
+            continue
+        seen_keys.add(key)
+        seen_tokens.append(tokens)
+        result.score = sum(1 for term in terms if term in tokens) / max(1, len(terms))
+        unique.append(result)
+    return sorted(unique, key=lambda result: result.score, reverse=True)
+
+def prefetch_research(idea: ApplicationIdea, timeout: float = PREFETCH_TIMEOUT_SECONDS) -> List[ResearchResult]:
+    """Runs every research query concurrently. Sources that fail or miss the timeout are left out."""
+    started = time.monotonic()
+    queries = research_queries(idea)
+    futures = {_executor.submit(_run, query): query for query in queries}
+    done, pending = wait(futures, timeout=timeout)
+    results = []
+    succeeded = 0
+    for future in done:
+        try:
+            results.extend(future.result())
+            succeeded += 1
+        except Exception as e:
+            logger.warning(f"Research query to {futures[future].source} failed: {e}")
+    for future in pending:
+        future.cancel()
+        logger.warning(f"Research query to {futures[future].source} did not finish within {timeout}s")
+    ranked = rank(results, keywords(idea))
+    logger.info(f"Prefetched {len(ranked)} research results from {succeeded}/{len(queries)} queries in {time.monotonic() - started:.1f}s")
+    return ranked
+
+def format_research_context(results: List[ResearchResult], max_chars: int = RESEARCH_MAX_CHARS) -> str:
+    sections, used = [], 0
+    for index, result in enumerate(results, start=1):
+        source = f"{result.source}, {result.url}" if result.url else result.source
+        section = f"[{index}] {result.title} ({source})\n{result.content.strip()}"
+        if used + len(section) > max_chars:
+            section = section[:max(0, max_chars - used)]
+        if not section:
+            break
+        sections.append(section)
+        used += len(section)
+    return "\n\n".join(sections) if sections else "No research results were available."
@@ -3,101 +3,133 @@ from app.api.schemas.multi_agent_debugging_assistant_schema import (
     CodeInput, 
     DebuggingPlan, 
     FixSuggestions,
-    FixedCode
+    FixedCode,
+    FixedCodePatch
 )
 from crewai import (
-    Agent,
     Task,
     Crew
     )
 from textwrap import dedent
-from langchain_openai import ChatOpenAI
-from langchain_experimental.tools import PythonREPLTool
-from langchain_community.tools import WikipediaQueryRun
-from langchain_community.utilities import WikipediaAPIWrapper
-from langchain_community.tools.wikidata.tool import WikidataAPIWrapper, WikidataQueryRun
-from langchain_community.utilities import ArxivAPIWrapper
-from langchain.tools import Tool
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Sequence
+import json
+from app.api.agent_templates import AgentTemplate
+from app.api.depth import VERIFIER_AGENT, depth_instructions, quick_overrides, verification_task
+from app.api.fingerprint import starting_point_prompt
+from app.api.patching import DIFF_INSTRUCTIONS, number_lines, patched_output
+from app.api.features.multi_agent_debugging_assistant.harness import run_harness, sandbox_enabled, verification
+from app.api.features.multi_agent_debugging_assistant.slicing import CodeSlice, record_slice, slice_code, slicing_enabled
+from app.api.features.multi_agent_debugging_assistant.static_analysis import (
+    StaticReport,
+    analyze_code,
+    record_report,
+    static_analysis_enabled,
+    tool_call_baseline
+)
+from app.api.logger import crew_verbose
+from app.api.request_context import current_usage, stage_completed
+from app.api.tools import arxiv_tool, python_repl_tool, wikidata_query_tool, wikipedia_query_tool
 from langchain_core.output_parsers import JsonOutputParser
 
-class CustomAgents:
-    def __init__(self):
-        self.OpenAIGPT4Mini = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-        self.OpenAIGPT4 = ChatOpenAI(model="gpt-4o", temperature=0)
-
-    def bug_finder_agent(self):
-        # Agent 1: Bug Finder
-        tools = [PythonREPLTool()]
-        return Agent(
-            role="Bug Finder",
-            backstory=dedent("""You are an expert in identifying bugs in code. You can detect syntax errors, runtime errors, logical errors, and any unexpected behavior."""),
-            goal=dedent("""Examine the provided code and identify any bugs, errors, or anomalies. Provide detailed information about each bug found."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4Mini,
-        )
+RESEARCH_TOOLS = (wikipedia_query_tool, wikidata_query_tool, arxiv_tool)
 
-    def bug_analyzer_agent(self):
-        # Agent 2: Bug Analyzer
-        tools = [
-            WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper()),
-            WikidataQueryRun(api_wrapper=WikidataAPIWrapper()),
-            Tool(
-                name="Arxiv",
-                func=ArxivAPIWrapper().run,
-                description="A wrapper around Arxiv. Useful for accessing academic papers."
-            )
-        ]
-        return Agent(
-            role="Bug Analyzer",
-            backstory=dedent("""You specialize in analyzing bugs to determine their root causes and potential fixes."""),
-            goal=dedent("""Analyze the identified bugs, determine their root causes, and assess their impact on the overall code."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4,
-        )
+# Agent 1: Bug Finder
+BUG_FINDER_AGENT = AgentTemplate(
+    role="Bug Finder",
+    backstory=dedent("""You are an expert in identifying bugs in code. You can detect syntax errors, runtime errors, logical errors, and any unexpected behavior."""),
+    goal=dedent("""Examine the provided code and identify any bugs, errors, or anomalies. Provide detailed information about each bug found."""),
+    model="gpt-4o-mini",
+    tools=(python_repl_tool,),
+)
 
-    def fix_planner_agent(self):
-        # Agent 3: Fix Planner
-        tools = [
-            WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper()),
-            WikidataQueryRun(api_wrapper=WikidataAPIWrapper()),
-            Tool(
-                name="Arxiv",
-                func=ArxivAPIWrapper().run,
-                description="A wrapper around Arxiv. Useful for accessing academic papers."
-            )
-        ]
-        return Agent(
-            role="Fix Planner",
-            backstory=dedent("""You provide detailed plans on how to fix the identified bugs, including estimated effort and any affected dependencies."""),
-            goal=dedent("""Develop a step-by-step plan to fix the bugs, including priorities, estimated time, and required resources."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4Mini,
-        )
+# Agent 2: Bug Analyzer
+BUG_ANALYZER_AGENT = AgentTemplate(
+    role="Bug Analyzer",
+    backstory=dedent("""You specialize in analyzing bugs to determine their root causes and potential fixes."""),
+    goal=dedent("""Analyze the identified bugs, determine their root causes, and assess their impact on the overall code."""),
+    model="gpt-4o",
+    tools=RESEARCH_TOOLS,
+    hedged=True,
+)
+
+# Agent 3: Fix Planner
+FIX_PLANNER_AGENT = AgentTemplate(
+    role="Fix Planner",
+    backstory=dedent("""You provide detailed plans on how to fix the identified bugs, including estimated effort and any affected dependencies."""),
+    goal=dedent("""Develop a step-by-step plan to fix the bugs, including priorities, estimated time, and required resources."""),
+    model="gpt-4o-mini",
+    tools=RESEARCH_TOOLS,
+)
 
-    def code_fixer_agent(self):
-        # Agent 4: Code Fixer
-        tools = [PythonREPLTool()]
-        return Agent(
-            role="Code Fixer",
-            backstory=dedent("""You apply fixes to the code based on the debugging plan and produce the fixed code along with a summary of changes made."""),
-            goal=dedent("""Apply the fixes to the code and produce the fixed code along with a summary of the changes made and any new dependencies introduced."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4,
+# Agent 4: Code Fixer
+CODE_FIXER_AGENT = AgentTemplate(
+    role="Code Fixer",
+    backstory=dedent("""You apply fixes to the code based on the debugging plan and produce the fixed code along with a summary of changes made."""),
+    goal=dedent("""Apply the fixes to the code and produce the fixed code along with a summary of the changes made and any new dependencies introduced."""),
+    model="gpt-4o",
+    tools=(python_repl_tool,),
+)
+
+class CustomAgents:
+    def bug_finder_agent(self, **overrides):
+        return BUG_FINDER_AGENT.bind(**overrides)
+
+    def bug_analyzer_agent(self, **overrides):
+        return BUG_ANALYZER_AGENT.bind(**overrides)
+
+    def fix_planner_agent(self, **overrides):
+        return FIX_PLANNER_AGENT.bind(**overrides)
+
+    def code_fixer_agent(self, **overrides):
+        return CODE_FIXER_AGENT.bind(**overrides)
+
+def input_details(code_input: CodeInput, execution_report: Optional[str]) -> str:
+    """The optional debugging fields that were provided, and the measured execution results if the harness ran."""
+    fields = [
+        ("Dependencies", ", ".join(code_input.dependencies) if code_input.dependencies else None),
+        ("Environment", code_input.environment),
+        ("Expected Behavior", code_input.expected_behavior),
+        ("Actual Behavior", code_input.actual_behavior),
+        ("Error Message", code_input.error_message),
+        ("Stack Trace", code_input.stack_trace),
+        ("Inputs", json.dumps(code_input.inputs) if code_input.inputs else None),
+        ("Expected Outputs", json.dumps(code_input.outputs) if code_input.outputs else None),
+    ]
+    sections = [f"\n                **{name}**:\n                {value}" for name, value in fields if value]
+    if execution_report:
+        sections.append(
+            "\n                **Execution Results** (measured by running the original code; use these for execution time, "
+            "resource usage and test results instead of estimating them):\n" + execution_report
         )
+    return "\n".join(sections)
+
+def static_findings(static_report: Optional[StaticReport]) -> str:
+    """The static analyzer's findings for the agent that finds bugs, if there are any."""
+    if static_report is None or not static_report.findings:
+        return ""
+    return "\n                **Static Analysis Findings**:\n" + static_report.prompt()
+
+def code_section(code_input: CodeInput, code_slice: Optional[CodeSlice]) -> str:
+    """The code as the analyzer and planner see it: whole, or the slice relevant to the reported error."""
+    if code_slice is None:
+        return f"""
+                **Code**:
+
+    {code_input.language}
+    {code_input.code_snippet}"""
+    return f"""
+                **Relevant Code** ({code_slice.summary()}):
+
+    {code_input.language}
+{code_slice.numbered()}"""
 
 class CustomTasks:
     def __init__(self):
         pass
 
-    def bug_finding_task(self, agent, code_input: CodeInput):
+    def bug_finding_task(self, agent, code_input: CodeInput, execution_report: Optional[str] = None,
+                         static_report: Optional[StaticReport] = None):
         analysis_output_schema = AnalysisOutput.schema_json(indent=2)
         return Task(
             description=dedent(f"""
@@ -117,12 +149,15 @@ class CustomTasks:
 
                 **Additional Context**:
                 {code_input.context if code_input.context else 'N/A'}
+{input_details(code_input, execution_report)}
+{static_findings(static_report)}
             """),
             agent=agent,
             expected_output=f"The analysis output in JSON format matching the schema: {analysis_output_schema}",
         )
 
-    def bug_analysis_task(self, agent, code_input: CodeInput):
+    def bug_analysis_task(self, agent, code_input: CodeInput, execution_report: Optional[str] = None,
+                          code_slice: Optional[CodeSlice] = None):
         debugging_plan_schema = DebuggingPlan.schema_json(indent=2)
         return Task(
             description=dedent(f"""
@@ -133,20 +168,18 @@ class CustomTasks:
 
     json
 {debugging_plan_schema}
-
-                **Code**:
-
-    {code_input.language}
-    {code_input.code_snippet}
+{code_section(code_input, code_slice)}
 
                 **Additional Context**:
                 {code_input.context if code_input.context else 'N/A'}
+{input_details(code_input, execution_report)}
             """),
             agent=agent,
             expected_output=f"The debugging plan in JSON format matching the schema: {debugging_plan_schema}",
         )
 
-    def fix_planning_task(self, agent, code_input: CodeInput):
+    def fix_planning_task(self, agent, code_input: CodeInput, execution_report: Optional[str] = None,
+                          code_slice: Optional[CodeSlice] = None):
         fix_suggestions_schema = FixSuggestions.schema_json(indent=2)
         return Task(
             description=dedent(f"""
@@ -158,25 +191,23 @@ class CustomTasks:
 
     json
 {fix_suggestions_schema}
-
-                **Code**:
-
-    {code_input.language}
-    {code_input.code_snippet}
+{code_section(code_input, code_slice)}
 
                 **Additional Context**:
                 {code_input.context if code_input.context else 'N/A'}
+{input_details(code_input, execution_report)}
             """),
             agent=agent,
             expected_output=f"The fix suggestions in JSON format matching the schema: {fix_suggestions_schema}",
         )
 
-    def code_fixing_task(self, agent, code_input: CodeInput):
+    def code_fixing_task(self, agent, code_input: CodeInput, execution_report: Optional[str] = None):
         fixed_code_schema = FixedCode.schema_json(indent=2)
         return Task(
             description=dedent(f"""
                 Apply the fix suggestions to the following code.
                 Ensure the code remains functional and free of the identified bugs.
+                {depth_instructions(code_input.depth)}
                 Provide the fixed code and a summary of changes made in **JSON format** matching the **FixedCode** schema.
 
                 **Format**:
@@ -191,52 +222,198 @@ class CustomTasks:
 
                 **Additional Context**:
                 {code_input.context if code_input.context else 'N/A'}
+{input_details(code_input, execution_report)}
+
+                {starting_point_prompt()}
             """),
             agent=agent,
             expected_output=f"The fixed code in JSON format matching the schema: {fixed_code_schema}",
         )
-    
+
+    def code_fixing_patch_task(self, agent, code_input: CodeInput, execution_report: Optional[str] = None,
+                               code_slice: Optional[CodeSlice] = None):
+        patch_schema = FixedCodePatch.schema_json(indent=2)
+        title, numbered = "with line numbers", number_lines(code_input.code_snippet)
+        if code_slice is not None:
+            title, numbered = code_slice.summary(), code_slice.numbered()
+        return Task(
+            description=dedent(f"""
+                Apply the fix suggestions to the following code.
+                Ensure the code remains functional and free of the identified bugs.
+                {depth_instructions(code_input.depth)}
+                {DIFF_INSTRUCTIONS}
+                Provide the edits and a summary of changes made in **JSON format** matching the **FixedCodePatch** schema.
+
+                **Format**:
+                ```json
+                {patch_schema}
+                ```
+
+                **Original Code** ({title}):
+                ```{code_input.language}
+{numbered}
+                ```
+
+                **Additional Context**:
+                {code_input.context if code_input.context else 'N/A'}
+{input_details(code_input, execution_report)}
+
+                {starting_point_prompt()}
+            """),
+            agent=agent,
+            expected_output=f"The edits in JSON format matching the schema: {patch_schema}",
+        )
+
+VERIFICATION_CHECKS = dedent("""
+    Check that the fixed code is complete, resolves the reported and identified bugs without introducing new ones,
+    produces the expected outputs for the given inputs, and that `changes_made` describes every change.""")
+
+# The pipeline's stages in order, and the schema each one outputs
+STAGES = ("find", "analyze", "plan", "fix")
+STAGE_SCHEMAS = {"find": AnalysisOutput, "analyze": DebuggingPlan, "plan": FixSuggestions, "fix": FixedCode}
+
 class DebuggingAssistantCrew:
-    def __init__(self, code_snippet, language="python", context=None):
-        self.code_input = CodeInput(code_snippet=code_snippet, language=language, context=context)
+    def __init__(self, code_input: CodeInput, execution_report: Optional[str] = None, stages: Sequence[str] = STAGES,
+                 static_report: Optional[StaticReport] = None):
+        self.code_input = code_input
+        self.execution_report = execution_report
+        self.stages = stages
+        self.static_report = static_report
+        self.code_slice = None
+        if code_input.depth != "quick" and set(stages) - {"find"} and slicing_enabled(code_input):
+            # The finder reads the whole file; the stages after it see what the reported error points at
+            self.code_slice = slice_code(code_input)
+            record_slice(self.code_slice)
         self.agents = CustomAgents()
         self.tasks = CustomTasks()
 
-    def run(self):
-        # Define agents
-        bug_finder_agent = self.agents.bug_finder_agent()
-        bug_analyzer_agent = self.agents.bug_analyzer_agent()
-        fix_planner_agent = self.agents.fix_planner_agent()
-        code_fixer_agent = self.agents.code_fixer_agent()
-
-        # Define tasks
-        bug_finding_task = self.tasks.bug_finding_task(bug_finder_agent, self.code_input)
-        bug_analysis_task = self.tasks.bug_analysis_task(bug_analyzer_agent, self.code_input)
-        fix_planning_task = self.tasks.fix_planning_task(fix_planner_agent, self.code_input)
-        code_fixing_task = self.tasks.code_fixing_task(code_fixer_agent, self.code_input)
+    @property
+    def patch_mode(self) -> bool:
+        """Whether the fixer returns edits: a fixer that sees a slice cannot rewrite the whole file."""
+        return self.code_input.output_mode == "diff" or self.code_slice is not None
 
-        # Create the crew
-        crew = Crew(
-            agents=[
+    def code_fixing_task(self, agent):
+        if self.patch_mode:
+            return self.tasks.code_fixing_patch_task(agent, self.code_input, self.execution_report, self.code_slice)
+        return self.tasks.code_fixing_task(agent, self.code_input, self.execution_report)
+
+    def run(self):
+        # With measured execution results the finder and fixer have no use for a REPL of their own
+        repl_overrides = {"tools": []} if self.execution_report else {}
+        static_report = None
+
+        if self.code_input.depth == "quick":
+            # The code fixer alone, on the fast model
+            code_fixer_agent = self.agents.code_fixer_agent(**quick_overrides())
+            agents = [code_fixer_agent]
+            tasks = [self.code_fixing_task(code_fixer_agent)]
+        else:
+            if "find" in self.stages and static_analysis_enabled(self.code_input):
+                static_report = self.static_report or analyze_code(self.code_input.code_snippet, self.code_input.language)
+                record_report(static_report)
+            # Code that does not compile gives the finder nothing to run
+            finder_overrides = {"tools": []} if static_report is not None and not static_report.compiles else repl_overrides
+
+            # Define agents
+            bug_finder_agent = self.agents.bug_finder_agent(**finder_overrides)
+            bug_analyzer_agent = self.agents.bug_analyzer_agent()
+            fix_planner_agent = self.agents.fix_planner_agent()
+            code_fixer_agent = self.agents.code_fixer_agent(**repl_overrides)
+
+            # Define tasks
+            report = self.execution_report
+            bug_finding_task = self.tasks.bug_finding_task(bug_finder_agent, self.code_input, report, static_report)
+            bug_analysis_task = self.tasks.bug_analysis_task(bug_analyzer_agent, self.code_input, report, self.code_slice)
+            fix_planning_task = self.tasks.fix_planning_task(fix_planner_agent, self.code_input, report, self.code_slice)
+            code_fixing_task = self.code_fixing_task(code_fixer_agent)
+
+            agents = [
                 bug_finder_agent,
                 bug_analyzer_agent,
                 fix_planner_agent,
                 code_fixer_agent,
-            ],
-            tasks=[
+            ]
+            tasks = [
                 bug_finding_task,
                 bug_analysis_task,
                 fix_planning_task,
                 code_fixing_task,
-            ],
-            verbose=True,
+            ]
+            if tuple(self.stages) != STAGES:
+                # A debugging session re-runs only the stages a follow-up needs (see sessions.py),
+                # and a full review starts after the analysis it shares (see full_review/crew.py)
+                selected = [i for i, stage in enumerate(STAGES) if stage in self.stages]
+                agents = [agents[i] for i in selected]
+                tasks = [tasks[i] for i in selected]
+
+        if self.code_input.depth == "deep":
+            verifier_agent = VERIFIER_AGENT.bind(**repl_overrides)
+            schema, original = FixedCode, self.code_input.model_dump_json(indent=2, exclude={"output_mode", "depth"})
+            if self.patch_mode:
+                # Edits refer to line numbers, so the verifier needs them too
+                numbered = self.code_slice.numbered() if self.code_slice else number_lines(self.code_input.code_snippet)
+                schema, original = FixedCodePatch, numbered + input_details(self.code_input, None)
+            if self.execution_report:
+                original += "\n\nExecution results of the original code:\n" + self.execution_report
+            agents.append(verifier_agent)
+            tasks.append(verification_task(verifier_agent, schema, VERIFICATION_CHECKS, original))
+
+        # Create the crew
+        crew = Crew(
+            agents=agents,
+            tasks=tasks,
+            verbose=crew_verbose(),
+            task_callback=stage_completed,
         )
 
         result = crew.kickoff()
+        if static_report is not None and not self.execution_report:
+            self.record_finder_tool_calls(static_report)
         return result
 
-def run_multi_agent_debugging_crew(args: CodeInput):
-    parser = JsonOutputParser(pydantic_object=FixedCode)
-    crew = DebuggingAssistantCrew(args.code_snippet, args.language, args.context)
+    def record_finder_tool_calls(self, static_report: StaticReport):
+        # Without execution results the findings alone decide whether the finder has a REPL
+        usage = current_usage()
+        stage = next((stage for stage in (usage.completed_stages if usage else []) if stage.role == BUG_FINDER_AGENT.role), None)
+        if stage is not None:
+            tool_call_baseline.record(bool(static_report.findings), stage.tool_calls, had_repl=static_report.compiles)
+
+def prepare_run(args: CodeInput, stages: Sequence[str]):
+    """
+    The harness run and the static analysis of the original code, each when it applies.
+    The analysis runs while the harness waits on the sandboxed interpreter.
+    """
+    analyze = args.depth != "quick" and "find" in stages and static_analysis_enabled(args)
+    if not sandbox_enabled(args):
+        return None, analyze_code(args.code_snippet, args.language) if analyze else None
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="static-analysis") as pool:
+        analysis = pool.submit(analyze_code, args.code_snippet, args.language) if analyze else None
+        before = run_harness(args.code_snippet, args)
+        return before, analysis.result() if analysis else None
+
+def run_multi_agent_debugging_crew(args: CodeInput, stages: Sequence[str] = STAGES):
+    before, static_report = prepare_run(args, stages)
+    crew = DebuggingAssistantCrew(args, before.prompt() if before else None, stages, static_report)
+    results = crew.run()
+    if crew.patch_mode:
+        parser = JsonOutputParser(pydantic_object=FixedCodePatch)
+        fixed = patched_output(args.code_snippet, args.language, parser.parse(results.raw))
+    else:
+        parser = JsonOutputParser(pydantic_object=FixedCode)
+        fixed = parser.parse(results.raw)
+    if before is not None and isinstance(fixed, dict) and isinstance(fixed.get("code_snippet"), str):
+        fixed.update(verification(before, run_harness(fixed["code_snippet"], args)))
+    return fixed
+
+def run_debugging_stages(code_input: CodeInput, stages: Sequence[str], execution_report: Optional[str] = None) -> Dict[str, Any]:
+    """Runs the given stages of the standard pipeline and returns each stage's parsed output by stage name."""
+    crew = DebuggingAssistantCrew(code_input.model_copy(update={"depth": "standard"}), execution_report, stages)
     results = crew.run()
-    return parser.parse(results.raw)
\ No newline at end of file
+    outputs = {}
+    for stage, task_output in zip([stage for stage in STAGES if stage in stages], results.tasks_output):
+        if stage == "fix" and crew.patch_mode:
+            parser = JsonOutputParser(pydantic_object=FixedCodePatch)
+            outputs[stage] = patched_output(code_input.code_snippet, code_input.language, parser.parse(task_output.raw))
+        else:
+            outputs[stage] = JsonOutputParser(pydantic_object=STAGE_SCHEMAS[stage]).parse(task_output.raw)
+    return outputs
@@ -0,0 +1,208 @@
+import json
+import os
+import pwd
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+from app.api.schemas.multi_agent_debugging_assistant_schema import CodeInput
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+RUNNER = os.path.join(os.path.dirname(__file__), "harness_runner.py")
+TIMEOUT_SECONDS = int(os.environ.get("DEBUG_SANDBOX_TIMEOUT_SECONDS", 10))
+MEMORY_MB = int(os.environ.get("DEBUG_SANDBOX_MEMORY_MB", 512))
+OUTPUT_LIMIT = 2000
+
+_slots = threading.BoundedSemaphore(int(os.environ.get("DEBUG_SANDBOX_CONCURRENCY", 2)))
+
+# Snippets run under bubblewrap: no network, a private PID namespace and /proc, no
+# capabilities, and a filesystem of the system libraries and the interpreter,
+# read-only, plus the scratch directory. The server's files and environment are not
+# in it. A server running as root starts it as DEBUG_SANDBOX_USER instead.
+BWRAP = shutil.which(os.environ.get("DEBUG_SANDBOX_BWRAP", "bwrap"))
+SANDBOX_USER = os.environ.get("DEBUG_SANDBOX_USER", "nobody")
+SANDBOX_RUNNER = "/sandbox/harness_runner.py"
+_missing_bwrap_logged = threading.Event()
+SYSTEM_DIRS = ("/usr", "/lib", "/lib32", "/lib64", "/bin", "/sbin", "/etc/alternatives", "/etc/ld.so.cache")
+
+def sandbox_enabled(code_input: CodeInput) -> bool:
+    if os.environ.get("DEBUG_SANDBOX", "false").lower() != "true" or code_input.language.lower() not in ("python", "py"):
+        return False
+    if BWRAP is None:
+        if not _missing_bwrap_logged.is_set():
+            _missing_bwrap_logged.set()
+            logger.error("DEBUG_SANDBOX is on but bubblewrap (bwrap) is not installed; snippets are not run")
+        return False
+    return True
+
+def _sandbox_user() -> Optional[pwd.struct_passwd]:
+    """The user the sandbox runs as when the server is root; otherwise the server's own, unprivileged, user."""
+    return pwd.getpwnam(SANDBOX_USER) if os.geteuid() == 0 else None
+
+def _sandbox_command(workdir: str, args: List[str]) -> List[str]:
+    command = [
+        BWRAP, "--unshare-all", "--die-with-parent", "--new-session", "--cap-drop", "ALL", "--clearenv",
+        "--uid", "65534", "--gid", "65534",
+        "--proc", "/proc", "--dev", "/dev", "--tmpfs", "/tmp",
+    ]
+    for path in (*SYSTEM_DIRS, *sorted({sys.base_prefix, sys.prefix})):
+        command += ["--ro-bind-try", path, path]
+    command += [
+        "--ro-bind", RUNNER, SANDBOX_RUNNER,
+        "--bind", workdir, "/work", "--chdir", "/work",
+        "--setenv", "PATH", "/usr/local/bin:/usr/bin:/bin",
+        "--setenv", "PYTHONHASHSEED", "0",
+        "--setenv", "PYTHONDONTWRITEBYTECODE", "1",
+    ]
+    return command + [sys.executable, "-I", SANDBOX_RUNNER, *args]
+
+@dataclass
+class CaseResult:
+    case: int
+    stdin: Optional[str]
+    expected_output: Optional[str]
+    stdout: str
+    stderr: str
+    exit_code: Optional[int]
+    passed: Optional[bool]
+    timed_out: bool = False
+    error: Optional[str] = None
+    wall_ms: Optional[float] = None
+    cpu_ms: Optional[float] = None
+    max_rss_mb: Optional[float] = None
+    baseline_rss_mb: Optional[float] = None
+
+@dataclass
+class HarnessReport:
+    cases: List[CaseResult]
+
+    @property
+    def passed(self) -> int:
+        return sum(1 for case in self.cases if case.passed)
+
+    @property
+    def checked(self) -> int:
+        return sum(1 for case in self.cases if case.passed is not None)
+
+    @property
+    def wall_ms(self) -> float:
+        return round(sum(case.wall_ms or 0 for case in self.cases), 3)
+
+    @property
+    def max_rss_mb(self) -> float:
+        return max((case.max_rss_mb or 0 for case in self.cases), default=0.0)
+
+    def summary(self) -> dict:
+        return {
+            "passed": self.passed,
+            "checked": self.checked,
+            "total_wall_ms": self.wall_ms,
+            "max_rss_mb": self.max_rss_mb,
+            "cases": [asdict(case) for case in self.cases],
+        }
+
+    def prompt(self) -> str:
+        checked = f"{self.passed}/{self.checked} matched the expected output" if self.checked else "no expected outputs were given"
+        lines = [f"Ran {len(self.cases)} case(s) in a sandbox; {checked}."]
+        for case in self.cases:
+            if case.timed_out:
+                lines.append(f"- Case {case.case} was killed after hitting the {TIMEOUT_SECONDS}s time/CPU limit or the {MEMORY_MB} MB memory limit")
+            else:
+                status = {True: "passed", False: "FAILED", None: "ran"}[case.passed]
+                lines.append(f"- Case {case.case} {status}: exit code {case.exit_code}, {case.wall_ms} ms wall, "
+                             f"{case.cpu_ms} ms CPU, {case.max_rss_mb} MB peak RSS (interpreter baseline {case.baseline_rss_mb} MB)")
+            if case.stdin is not None:
+                lines.append(f"  input: {case.stdin!r}")
+            if case.expected_output is not None:
+                lines.append(f"  expected output: {case.expected_output!r}")
+            lines.append(f"  actual output: {case.stdout!r}")
+            if case.error or case.stderr:
+                lines.append(f"  error: {case.error or case.stderr}")
+        return "\n".join(lines)
+
+def _cases(code_input: CodeInput):
+    inputs = code_input.inputs or []
+    outputs = code_input.outputs or []
+    count = max(len(inputs), len(outputs), 1)
+    for i in range(count):
+        yield (inputs[i] if i < len(inputs) else None, outputs[i] if i < len(outputs) else None)
+
+def _matches(actual: str, expected: str) -> bool:
+    return " ".join(actual.split()) == " ".join(expected.split())
+
+def _run_case(number: int, workdir: str, stdin: Optional[str], expected: Optional[str]) -> CaseResult:
+    metrics_path = os.path.join(workdir, f"metrics-{number}.json")
+    user = _sandbox_user()
+    command = _sandbox_command(workdir, ["snippet.py", f"metrics-{number}.json", str(TIMEOUT_SECONDS), str(MEMORY_MB)])
+    try:
+        completed = subprocess.run(
+            command, input=stdin or "", capture_output=True, text=True, cwd=workdir, env={}, timeout=TIMEOUT_SECONDS + 2,
+            user=user.pw_uid if user else None, group=user.pw_gid if user else None, extra_groups=[] if user else None,
+        )
+    except subprocess.TimeoutExpired as e:
+        stdout = e.stdout.decode(errors="replace") if isinstance(e.stdout, bytes) else (e.stdout or "")
+        return CaseResult(number, stdin, expected, stdout[:OUTPUT_LIMIT], "", None, False if expected is not None else None,
+                          timed_out=True, wall_ms=TIMEOUT_SECONDS * 1000.0)
+    metrics = {}
+    if os.path.exists(metrics_path):
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+    if not metrics and completed.stderr.startswith("bwrap:"):
+        # The sandbox could not be set up, e.g. user namespaces are not allowed; the snippet never ran
+        logger.error(f"Harness sandbox failed to start: {completed.stderr.strip()}")
+        return CaseResult(number, stdin, expected, "", "", None, None, error=f"Sandbox failed to start: {completed.stderr.strip()}")
+    stdout = completed.stdout
+    passed = _matches(stdout, expected) if expected is not None else None
+    if completed.returncode != 0 and passed is None:
+        passed = False
+    return CaseResult(
+        number, stdin, expected, stdout[:OUTPUT_LIMIT], completed.stderr[-OUTPUT_LIMIT:], completed.returncode, passed,
+        # Without metrics the runner was killed, most likely by the CPU or memory limit
+        timed_out=not metrics and completed.returncode < 0,
+        error=metrics.get("error"), wall_ms=metrics.get("wall_ms"), cpu_ms=metrics.get("cpu_ms"),
+        max_rss_mb=metrics.get("max_rss_mb"), baseline_rss_mb=metrics.get("baseline_rss_mb"),
+    )
+
+def run_harness(code: str, code_input: CodeInput) -> HarnessReport:
+    """
+    Runs `code` once per provided input in a fresh interpreter inside the
+    sandbox, with CPU, memory, file size, file descriptor and process limits, a
+    scratch working directory and an empty environment. Each input is fed on stdin
+    and the output compared with the matching expected output, ignoring
+    whitespace differences. Without inputs or outputs the code runs once.
+    """
+    with _slots, tempfile.TemporaryDirectory(prefix="debug-harness-") as workdir:
+        with open(os.path.join(workdir, "snippet.py"), "w") as f:
+            f.write(code)
+        user = _sandbox_user()
+        if user is not None:
+            # The sandbox user writes its measurements here, and reads nothing else of the server's
+            os.chown(workdir, user.pw_uid, user.pw_gid)
+        cases = [_run_case(number, workdir, stdin, expected)
+                 for number, (stdin, expected) in enumerate(_cases(code_input), start=1)]
+    report = HarnessReport(cases)
+    logger.info(f"Harness: {report.passed}/{report.checked} cases passed in {report.wall_ms} ms")
+    return report
+
+def verification(before: HarnessReport, after: HarnessReport) -> dict:
+    """Measured comparison of the original and fixed code for the debugging response."""
+    improvements = {
+        "passed_before": float(before.passed),
+        "passed_after": float(after.passed),
+        "wall_ms_before": before.wall_ms,
+        "wall_ms_after": after.wall_ms,
+        "max_rss_mb_before": before.max_rss_mb,
+        "max_rss_mb_after": after.max_rss_mb,
+    }
+    tests = [
+        f"Case {case.case}: " + ("timed out" if case.timed_out else {True: "passed", False: "failed", None: "ran"}[case.passed])
+        + f" ({case.wall_ms} ms, exit code {case.exit_code})"
+        for case in after.cases
+    ]
+    return {"performance_improvements": improvements, "tests_performed": tests,
+            "verification": {"original": before.summary(), "fixed": after.summary()}}
@@ -0,0 +1,54 @@
+"""
+Runs one snippet under resource limits and writes its measurements as JSON.
+
+    python -I harness_runner.py CODE_PATH METRICS_PATH CPU_SECONDS MEMORY_MB
+
+Executed by harness.py in a fresh interpreter; it imports nothing from the app.
+"""
+import json
+import os
+import resource
+import runpy
+import sys
+import time
+import traceback
+
+def main():
+    code_path, metrics_path = sys.argv[1], sys.argv[2]
+    cpu_seconds, memory_mb = int(sys.argv[3]), int(sys.argv[4])
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    resource.setrlimit(resource.RLIMIT_AS, (memory_mb * 1024 * 1024,) * 2)
+    resource.setrlimit(resource.RLIMIT_FSIZE, (10 * 1024 * 1024,) * 2)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (64, 64))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+
+    pid = os.getpid()
+    baseline_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    exit_code, error = 0, None
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    try:
+        runpy.run_path(code_path, run_name="__main__")
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        exit_code = 1
+        error = traceback.format_exc(limit=-5)
+    wall, cpu = time.perf_counter() - wall_started, time.process_time() - cpu_started
+    sys.stdout.flush()
+    if os.getpid() != pid:  # a child the snippet forked; only the snippet's own process reports
+        os._exit(exit_code)
+
+    with open(metrics_path, "w") as f:
+        json.dump({
+            "exit_code": exit_code,
+            "error": error,
+            "wall_ms": round(wall * 1000, 3),
+            "cpu_ms": round(cpu * 1000, 3),
+            "baseline_rss_mb": round(baseline_rss_kb / 1024, 2),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        }, f)
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from app.api.schemas.multi_agent_debugging_assistant_schema import CodeInput
+from app.api.features.multi_agent_debugging_assistant.crew import STAGES, run_debugging_stages
+from app.api.features.multi_agent_debugging_assistant.harness import CaseResult, HarnessReport, run_harness, sandbox_enabled, verification
+from app.api.work_queue import JobStore, work_queue
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+STAGE_TITLES = {
+    "find": "Bugs found (AnalysisOutput)",
+    "analyze": "Root-cause analysis (DebuggingPlan)",
+    "plan": "Fix suggestions (FixSuggestions)",
+    "fix": "Fixed code (FixedCode)",
+}
+
+EVIDENCE_FIELDS = (
+    ("stack_trace", "Stack trace"),
+    ("error_message", "Error message"),
+    ("actual_behavior", "Observed behavior"),
+    ("note", "Note"),
+)
+
+class SessionError(ValueError):
+    """A session message that cannot be served; the message is sent back to the client."""
+
+@dataclass
+class Turn:
+    kind: str
+    stages: List[str]
+
+@dataclass
+class DebuggingSession:
+    """
+    Server-side state of an iterative debugging conversation: the code and its
+    debugging fields, the latest output of each stage, the evidence the client has
+    added since, and the turns so far. `revision` counts the saves, so a worker
+    can tell its copy from a newer one another worker saved.
+    """
+    id: str
+    tenant: str
+    code_input: CodeInput
+    outputs: Dict[str, Any] = field(default_factory=dict)
+    evidence: List[str] = field(default_factory=list)
+    turns: List[Turn] = field(default_factory=list)
+    execution_report: Optional[HarnessReport] = None
+    created: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    revision: int = 0
+    busy: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def size_bytes(self) -> int:
+        state = [self.code_input.model_dump(), self.outputs, self.evidence, [vars(turn) for turn in self.turns]]
+        return len(json.dumps(state, default=str))
+
+    def to_state(self) -> dict:
+        report = self.execution_report
+        return {
+            "id": self.id,
+            "tenant": self.tenant,
+            "revision": self.revision,
+            "code_input": self.code_input.model_dump(),
+            "outputs": self.outputs,
+            "evidence": self.evidence,
+            "turns": [vars(turn) for turn in self.turns],
+            "execution_report": [asdict(case) for case in report.cases] if report is not None else None,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "DebuggingSession":
+        report = state.get("execution_report")
+        return cls(
+            state["id"], state["tenant"], CodeInput.model_validate(state["code_input"]),
+            outputs=state["outputs"], evidence=state["evidence"], turns=[Turn(**turn) for turn in state["turns"]],
+            execution_report=HarnessReport([CaseResult(**case) for case in report]) if report is not None else None,
+            revision=state["revision"],
+        )
+
+    def stages_for(self, message: dict) -> Tuple[List[str], Optional[List[int]]]:
+        """
+        The stages a message needs, and the bugs to focus on:
+
+        - `start`: the whole pipeline;
+        - `fix`: the fix stage, after fix suggestions for the requested `bug_ids`
+          if the session has none for them yet;
+        - `plan`: fix suggestions, optionally for `bug_ids`;
+        - `evidence` (a new stack trace, error message, observed behaviour or note)
+          and `update_code`: bug finding and root-cause analysis again, starting
+          from the previous findings.
+        """
+        kind = message.get("type")
+        bug_ids = message.get("bug_ids")
+        if bug_ids is not None and not (isinstance(bug_ids, list) and all(isinstance(bug_id, int) for bug_id in bug_ids)):
+            raise SessionError("`bug_ids` must be a list of integers")
+        if kind == "start":
+            stages = list(STAGES)
+        elif kind in ("evidence", "update_code"):
+            stages = ["find", "analyze"]
+        elif kind == "plan":
+            stages = ["plan"]
+        elif kind == "fix":
+            suggested = {suggestion.get("bug_id") for suggestion in self.outputs.get("plan", {}).get("suggestions", [])}
+            stages = ["fix"] if "plan" in self.outputs and set(bug_ids or []) <= suggested else ["plan", "fix"]
+        else:
+            raise SessionError(f"Unknown message type '{kind}'")
+        # Without findings there is nothing to plan or fix from
+        if "find" not in self.outputs and "find" not in stages:
+            stages = list(STAGES[:STAGES.index(stages[-1]) + 1])
+        return stages, bug_ids
+
+    def apply(self, message: dict):
+        """Takes in the new code or evidence a message carries."""
+        kind = message.get("type")
+        if kind == "evidence":
+            items = [f"{label}: {message[key]}" for key, label in EVIDENCE_FIELDS if message.get(key)]
+            if not items:
+                raise SessionError("An evidence message needs at least one of " + ", ".join(key for key, _ in EVIDENCE_FIELDS))
+            self.evidence.extend(items)
+            # The latest error decides which code the analyzer, planner and fixer see (see slicing.py)
+            symptom = {key: str(message[key]) for key in ("stack_trace", "error_message", "actual_behavior") if message.get(key)}
+            self.code_input = self.code_input.model_copy(update=symptom)
+        elif kind == "update_code":
+            if not isinstance(message.get("code_snippet"), str):
+                raise SessionError("An update_code message needs the new `code_snippet`")
+            self.code_input = self.code_input.model_copy(update={"code_snippet": message["code_snippet"]})
+            self.execution_report = None
+
+    def record(self, stages: List[str], outputs: Dict[str, Any]):
+        """Keeps the new outputs and drops those of later stages, which were built on the old ones."""
+        self.outputs.update(outputs)
+        for stage in STAGES[STAGES.index(stages[-1]) + 1:]:
+            self.outputs.pop(stage, None)
+
+    def session_context(self, stages: List[str], bug_ids: Optional[List[int]]) -> str:
+        """Earlier results, new evidence and focus, added to the context every task of the run sees."""
+        sections = []
+        if self.code_input.context:
+            sections.append(self.code_input.context)
+        for stage in STAGES:
+            if stage in self.outputs:
+                label = "previous, may be outdated; update it" if stage in stages else "still valid; build on it"
+                sections.append(f"{STAGE_TITLES[stage]} from earlier in this session ({label}):\n{json.dumps(self.outputs[stage], indent=2)}")
+        if self.evidence:
+            sections.append("New information from the developer, most recent last:\n" + "\n".join(f"- {item}" for item in self.evidence))
+        if bug_ids:
+            sections.append(f"Only address the bugs with IDs {bug_ids}; leave the rest of the code as it is.")
+        return "\n\n".join(sections)
+
+    def stage_input(self, stages: List[str], bug_ids: Optional[List[int]]) -> CodeInput:
+        return self.code_input.model_copy(update={"context": self.session_context(stages, bug_ids) or None})
+
+def run_turn(session: DebuggingSession, message: dict) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Serves one follow-up message: applies it, runs the stages it needs with the
+    session's earlier results as context, and records the new outputs. Blocking;
+    returns the stages run and their outputs.
+    """
+    if not session.busy.acquire(blocking=False):
+        raise SessionError("The session is already running a request")
+    try:
+        session.apply(message)
+        stages, bug_ids = session.stages_for(message)
+        if sandbox_enabled(session.code_input) and "find" in stages and session.execution_report is None:
+            session.execution_report = run_harness(session.code_input.code_snippet, session.code_input)
+        report = session.execution_report.prompt() if session.execution_report else None
+        outputs = run_debugging_stages(session.stage_input(stages, bug_ids), stages, report)
+        fixed = outputs.get("fix")
+        if session.execution_report is not None and isinstance(fixed, dict) and isinstance(fixed.get("code_snippet"), str):
+            fixed.update(verification(session.execution_report, run_harness(fixed["code_snippet"], session.code_input)))
+        session.record(stages, outputs)
+        session.turns.append(Turn(message.get("type"), stages))
+        return stages, outputs
+    finally:
+        session.busy.release()
+
+class SessionStore:
+    """
+    Debugging sessions of this worker, least recently used first.
+
+    With a `shared` store (the work queue's, see app/api/work_queue.py), every save
+    also goes to its cache, so any worker, on any instance, can resume a session.
+    A worker serves its own copy while that is the latest revision, and loads the
+    shared one otherwise. Without it, sessions live in this worker alone.
+
+    Sessions expire after `ttl_seconds` without use. Each session is held to
+    `session_budget_bytes` of serialized state: the oldest turns and evidence are
+    dropped first, and a session whose code and outputs alone are over budget is
+    closed. When the store holds more than `max_sessions` sessions or
+    `total_budget_bytes`, the least recently used sessions are evicted.
+    """
+
+    def __init__(self, max_sessions: int, ttl_seconds: float, session_budget_bytes: int, total_budget_bytes: int,
+                 shared: Optional[JobStore] = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.session_budget_bytes = session_budget_bytes
+        self.total_budget_bytes = total_budget_bytes
+        self.shared = shared
+        self._sessions: "OrderedDict[str, DebuggingSession]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.expired = 0
+        self.loaded = 0
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.ttl_seconds:
+                break
+            self._remove(session.id)
+            self.expired += 1
+
+    def _remove(self, session_id: str):
+        self._sessions.pop(session_id, None)
+        self._bytes -= self._sizes.pop(session_id, 0)
+
+    @staticmethod
+    def _shared_key(session_id: str) -> str:
+        return f"debug-session:{session_id}"
+
+    def _keep(self, session: DebuggingSession, size: int):
+        """Holds the session as the most recently used, evicting others to fit. Called with the lock held."""
+        session.last_used = time.monotonic()
+        self._bytes += size - self._sizes.get(session.id, 0)
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        self._sizes[session.id] = size
+        self._expire()
+        while len(self._sessions) > self.max_sessions or self._bytes > self.total_budget_bytes:
+            oldest = next(iter(self._sessions))
+            if oldest == session.id:
+                break
+            self._remove(oldest)
+            self.evicted += 1
+            logger.info(f"Evicted debugging session {oldest}")
+
+    def _load(self, session_id: str):
+        """Syncs this worker's copy with the shared one: dropped once closed or expired, replaced once another worker saved a newer one."""
+        state = self.shared.cache_get(self._shared_key(session_id))
+        if state is None:
+            with self._lock:
+                self._remove(session_id)
+            return
+        # A resume counts as use there too
+        self.shared.cache_put(self._shared_key(session_id), state, self.ttl_seconds)
+        with self._lock:
+            local = self._sessions.get(session_id)
+            if local is not None and local.revision == state["revision"]:
+                return
+        session = DebuggingSession.from_state(state)
+        with self._lock:
+            self._keep(session, session.size_bytes())
+            self.loaded += 1
+
+    def create(self, tenant: str, code_input: CodeInput) -> DebuggingSession:
+        session = DebuggingSession(uuid.uuid4().hex, tenant, code_input)
+        self.save(session)
+        return session
+
+    def get(self, session_id: str, tenant: str) -> DebuggingSession:
+        if self.shared is not None:
+            self._load(session_id)
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None or session.tenant != tenant:
+                raise SessionError(f"Unknown or expired session '{session_id}'")
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def save(self, session: DebuggingSession):
+        """Stores the session after a change, trimming it to its budget and evicting others to fit."""
+        size = session.size_bytes()
+        while size > self.session_budget_bytes and (session.turns or session.evidence):
+            if session.turns:
+                session.turns.pop(0)
+            else:
+                session.evidence.pop(0)
+            size = session.size_bytes()
+        if size > self.session_budget_bytes:
+            self.close(session.id)
+            raise SessionError(f"Session state is {size // 1024} KB, over the limit of {self.session_budget_bytes // 1024} KB; the session was closed")
+        session.revision += 1
+        if self.shared is not None:
+            self.shared.cache_put(self._shared_key(session.id), session.to_state(), self.ttl_seconds)
+        with self._lock:
+            self._keep(session, size)
+
+    def close(self, session_id: str):
+        with self._lock:
+            self._remove(session_id)
+        if self.shared is not None:
+            self.shared.cache_put(self._shared_key(session_id), None, 1)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "loaded": self.loaded,
+            "shared": self.shared is not None,
+        }
+
+sessions = SessionStore(
+    max_sessions=int(os.environ.get("DEBUG_SESSION_MAX_SESSIONS", 200)),
+    ttl_seconds=float(os.environ.get("DEBUG_SESSION_TTL_SECONDS", 1800)),
+    session_budget_bytes=int(os.environ.get("DEBUG_SESSION_MAX_KB", 512)) * 1024,
+    total_budget_bytes=int(os.environ.get("DEBUG_SESSION_STORE_MB", 64)) * 1024 * 1024,
+    shared=work_queue.store,
+)
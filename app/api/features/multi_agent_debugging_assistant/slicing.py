@@ -0,0 +1,295 @@
+import ast
+import math
+import os
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from app.api.schemas.multi_agent_debugging_assistant_schema import CodeInput
+from app.api.logger import setup_logger
+from app.api.metrics import counters
+
+logger = setup_logger(__name__)
+
+# Cuts a large Python snippet down to the parts a reported symptom points at, for the
+# agents after the bug finder. The code is indexed by function, method and class, and
+# the units named in the stack trace or most similar to the error message, actual
+# behavior and stack trace (BM25 over identifier words) are kept with their callers,
+# callees, class headers, imports and the module-level names they use. The rest of
+# the file is left out of the analyzer, planner and fixer prompts.
+
+def slicing_enabled(code_input: CodeInput) -> bool:
+    return (
+        os.environ.get("DEBUG_CODE_SLICING", "true").lower() == "true"
+        and code_input.language.lower() in ("python", "py")
+        and any((code_input.error_message, code_input.stack_trace, code_input.actual_behavior))
+    )
+
+MIN_LINES = int(os.environ.get("DEBUG_SLICE_MIN_LINES", 300))
+# A slice keeping more than this share of the file is not worth the missing context
+MAX_SHARE = float(os.environ.get("DEBUG_SLICE_MAX_SHARE", 0.6))
+# Units picked by similarity alone, and callers or callees kept per picked unit
+SEEDS = int(os.environ.get("DEBUG_SLICE_SEEDS", 3))
+NEIGHBOURS = int(os.environ.get("DEBUG_SLICE_NEIGHBOURS", 5))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Similarity picks are kept down to this share of the best score
+RELATIVE_SCORE = 0.5
+
+FRAME = re.compile(r'File "([^"]*)", line (\d+), in (\S+)')
+LINE = re.compile(r"\bline (\d+)\b")
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+WORD = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+# Frames in installed packages and the standard library are not the snippet's
+LIBRARY_PATH = re.compile(r"[/\\](site-packages|dist-packages|lib[/\\]python[0-9.]*)[/\\]")
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "call", "called", "file", "for", "from", "has", "have",
+    "in", "is", "it", "last", "line", "most", "none", "not", "of", "on", "or", "recent", "self", "that", "the",
+    "this", "to", "traceback", "was", "when", "with",
+}
+
+@dataclass
+class Unit:
+    name: str
+    kind: str
+    ranges: List[Tuple[int, int]]
+    words: Counter = field(default_factory=Counter, repr=False)
+    calls: Set[str] = field(default_factory=set, repr=False)
+    uses: Set[str] = field(default_factory=set, repr=False)
+    defines: Set[str] = field(default_factory=set, repr=False)
+    parent: Optional[str] = None
+
+    @property
+    def short_name(self) -> str:
+        return self.name.rsplit(".", 1)[-1]
+
+    def contains(self, line: int) -> bool:
+        return any(start <= line <= end for start, end in self.ranges)
+
+@dataclass
+class CodeSlice:
+    lines: List[str] = field(repr=False)
+    ranges: List[Tuple[int, int]]
+    seeds: List[str]
+    units: List[str]
+    seconds: float
+
+    @property
+    def total_lines(self) -> int:
+        return len(self.lines)
+
+    @property
+    def kept_lines(self) -> int:
+        return sum(end - start + 1 for start, end in self.ranges)
+
+    def numbered(self) -> str:
+        """The kept lines, numbered as in the full snippet, with a marker where lines are left out."""
+        width = len(str(len(self.lines)))
+        out, previous = [], 0
+        for start, end in [*self.ranges, (len(self.lines) + 1, len(self.lines))]:
+            if start == previous + 2:
+                out.append(f"{'':>{width}} | ... (line {previous + 1} not shown)")
+            elif start > previous + 2:
+                out.append(f"{'':>{width}} | ... (lines {previous + 1}-{start - 1} not shown)")
+            out += [f"{number:>{width}} | {self.lines[number - 1]}" for number in range(start, end + 1)]
+            previous = end
+        return "\n".join(out)
+
+    def summary(self) -> str:
+        return (f"{self.kept_lines} of {self.total_lines} lines: {', '.join(self.seeds)}, which the reported error points at, "
+                f"with their callers, callees, imports and the module-level names they use. Other lines are not shown; "
+                f"line numbers are those of the full code.")
+
+def _words(identifier: str) -> List[str]:
+    words = [word.lower() for word in WORD.findall(identifier)]
+    return words + [identifier.lower()] if len(words) > 1 else words or [identifier.lower()]
+
+def _text_words(text: str) -> List[str]:
+    return [word for identifier in IDENTIFIER.findall(text) for word in _words(identifier) if word not in STOP_WORDS]
+
+def _span(node: ast.AST) -> Tuple[int, int]:
+    start = min([node.lineno, *(decorator.lineno for decorator in getattr(node, "decorator_list", []))])
+    return start, node.end_lineno or node.lineno
+
+def _index_body(unit: Unit, nodes: List[ast.AST]):
+    for node in nodes:
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name):
+                unit.words.update(_words(child.id))
+                unit.uses.add(child.id)
+            elif isinstance(child, ast.Attribute):
+                unit.words.update(_words(child.attr))
+            elif isinstance(child, ast.arg):
+                unit.words.update(_words(child.arg))
+            elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                unit.words.update(_words(child.name))
+            elif isinstance(child, ast.Constant) and isinstance(child.value, str) and len(child.value) < 200:
+                # Error messages raised by the code often match the reported one
+                unit.words.update(_text_words(child.value))
+            if isinstance(child, ast.Call):
+                if isinstance(child.func, ast.Name):
+                    unit.calls.add(child.func.id)
+                elif isinstance(child.func, ast.Attribute):
+                    unit.calls.add(child.func.attr)
+
+def _defined_names(node: ast.AST) -> Set[str]:
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return {(alias.asname or alias.name).split(".")[0] for alias in node.names}
+    targets = node.targets if isinstance(node, ast.Assign) else [getattr(node, "target", None)]
+    return {child.id for target in targets if target is not None for child in ast.walk(target) if isinstance(child, ast.Name)}
+
+def index_units(tree: ast.Module) -> List[Unit]:
+    """Functions, methods, class headers and module-level statements, each with the words and calls in it."""
+    units: List[Unit] = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            unit = Unit(node.name, "function", [_span(node)])
+            unit.words.update(_words(node.name))
+            _index_body(unit, [node])
+            units.append(unit)
+        elif isinstance(node, ast.ClassDef):
+            start, _ = _span(node)
+            header = Unit(node.name, "class", [(start, max(node.lineno, node.body[0].lineno - 1))])
+            header.words.update(_words(node.name))
+            _index_body(header, [*node.bases, *node.keywords, *node.decorator_list])
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    method = Unit(f"{node.name}.{child.name}", "method", [_span(child)], parent=node.name)
+                    method.words.update(_words(child.name))
+                    _index_body(method, [child])
+                    units.append(method)
+                else:
+                    header.ranges.append(_span(child))
+                    _index_body(header, [child])
+            units.append(header)
+        else:
+            kind = "import" if isinstance(node, (ast.Import, ast.ImportFrom)) else "statement"
+            unit = Unit(f"line {node.lineno}", kind, [_span(node)], defines=_defined_names(node))
+            _index_body(unit, [node])
+            units.append(unit)
+    return units
+
+class _BM25:
+    def __init__(self, units: List[Unit]):
+        self.units = units
+        self.lengths = [sum(unit.words.values()) for unit in units]
+        self.average = sum(self.lengths) / max(1, len(units))
+        frequency = Counter(word for unit in units for word in unit.words)
+        self.idf = {word: math.log(1 + (len(units) - count + 0.5) / (count + 0.5)) for word, count in frequency.items()}
+
+    def scores(self, query: List[str]) -> List[float]:
+        terms = Counter(query)
+        scores = []
+        for unit, length in zip(self.units, self.lengths):
+            score = 0.0
+            for word in terms:
+                tf = unit.words.get(word, 0)
+                if tf:
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / max(1.0, self.average))
+                    score += self.idf[word] * tf * (BM25_K1 + 1) / norm
+            scores.append(score)
+        return scores
+
+def _trace_seeds(units: List[Unit], text: str) -> Iterator[Unit]:
+    """Units named by the stack trace's frames in the snippet, or holding a line the error names."""
+    functions = [unit for unit in units if unit.kind in ("function", "method")]
+    frames = [(path, int(line), name) for path, line, name in FRAME.findall(text) if not LIBRARY_PATH.search(path)]
+    # The snippet's file is the one whose frames name its functions, at their lines if any frame still matches
+    located = {path for path, line, name in frames if any(unit.short_name == name and unit.contains(line) for unit in functions)}
+    paths = located or {path for path, line, name in frames if any(unit.short_name == name for unit in functions)}
+    for path, line, name in frames:
+        if path not in paths:
+            continue
+        if name == "<module>":
+            yield from (unit for unit in units if unit.contains(line))
+            continue
+        named = [unit for unit in functions if unit.short_name == name]
+        # A name defined more than once is settled by the line, when it still matches
+        yield from [unit for unit in named if unit.contains(line)] or named
+    for line in LINE.findall(FRAME.sub("", text)):
+        yield from (unit for unit in functions if unit.contains(int(line)))
+
+def _merge(ranges: List[Tuple[int, int]], lines: List[str]) -> List[Tuple[int, int]]:
+    """Sorted, non-overlapping ranges, joined across gaps of blank lines."""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and all(not line.strip() for line in lines[merged[-1][1]:start - 1]):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def slice_code(code_input: CodeInput) -> Optional[CodeSlice]:
+    """
+    The part of the snippet relevant to its reported symptom, or None when the
+    snippet is small, does not parse, the symptom matches nothing, or the slice
+    would keep most of the file anyway.
+    """
+    code = code_input.code_snippet
+    lines = code.splitlines()
+    if len(lines) < MIN_LINES:
+        return None
+    started = time.perf_counter()
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        return None
+    units = index_units(tree)
+    trace = "\n".join(text for text in (code_input.stack_trace, code_input.error_message) if text)
+    symptom = "\n".join(text for text in (code_input.error_message, code_input.actual_behavior, code_input.stack_trace) if text)
+
+    scores = dict(zip((unit.name for unit in units), _BM25(units).scores(_text_words(FRAME.sub(r"\3", symptom)))))
+    code_units = [unit for unit in units if unit.kind in ("function", "method", "class")]
+    seeds: Dict[str, Unit] = {unit.name: unit for unit in _trace_seeds(units, trace)}
+    ranked = sorted(code_units, key=lambda unit: scores[unit.name], reverse=True)
+    best = scores[ranked[0].name] if ranked else 0.0
+    for unit in ranked[:SEEDS]:
+        if scores[unit.name] > 0 and scores[unit.name] >= RELATIVE_SCORE * best:
+            seeds.setdefault(unit.name, unit)
+    if not seeds:
+        return None
+
+    by_short_name: Dict[str, List[Unit]] = {}
+    for unit in code_units:
+        by_short_name.setdefault(unit.short_name, []).append(unit)
+    kept = dict(seeds)
+    for seed in seeds.values():
+        # Callees, then callers, the most similar first, up to NEIGHBOURS each
+        callees = [unit for name in seed.calls for unit in by_short_name.get(name, []) if unit.name != seed.name]
+        if seed.kind == "class":
+            callees += [unit for unit in code_units if unit.parent == seed.name and unit.short_name == "__init__"]
+        callers = [unit for unit in code_units if unit.name != seed.name and
+                   (seed.short_name in unit.calls or seed.kind == "method" and seed.short_name == "__init__" and seed.parent in unit.calls)]
+        for neighbours in (callees, callers):
+            for unit in sorted(neighbours, key=lambda unit: scores[unit.name], reverse=True)[:NEIGHBOURS]:
+                kept.setdefault(unit.name, unit)
+    for unit in list(kept.values()):
+        if unit.parent is not None:
+            parent = next((other for other in code_units if other.kind == "class" and other.name == unit.parent), None)
+            if parent is not None:
+                kept.setdefault(parent.name, parent)
+    used = set().union(*(unit.uses for unit in kept.values()))
+    for unit in units:
+        if unit.kind == "import" or unit.kind == "statement" and unit.defines & used:
+            kept.setdefault(unit.name, unit)
+
+    ranges = _merge([span for unit in kept.values() for span in unit.ranges], lines)
+    code_slice = CodeSlice(lines, ranges, sorted(seeds), sorted(name for name, unit in kept.items() if unit.kind in ("function", "method", "class")),
+                           time.perf_counter() - started)
+    if code_slice.kept_lines > MAX_SHARE * len(lines):
+        logger.info(f"Code slice would keep {code_slice.kept_lines} of {len(lines)} lines; sending the whole snippet")
+        return None
+    return code_slice
+
+def record_slice(code_slice: Optional[CodeSlice]):
+    if code_slice is None:
+        counters.inc("debug_slices", sliced="no")
+        return
+    counters.inc("debug_slices", sliced="yes")
+    counters.inc("debug_slice_lines_kept", code_slice.kept_lines)
+    counters.inc("debug_slice_lines_dropped", code_slice.total_lines - code_slice.kept_lines)
+    counters.inc("debug_slice_seconds", code_slice.seconds)
+    logger.info(f"Code slice: {code_slice.kept_lines} of {code_slice.total_lines} lines around {code_slice.seeds} "
+                f"in {code_slice.seconds * 1000:.1f} ms")
@@ -0,0 +1,419 @@
+import ast
+import builtins
+import json
+import os
+import symtable
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+from app.api.schemas.multi_agent_debugging_assistant_schema import CodeInput
+from app.api.logger import setup_logger
+from app.api.metrics import counters
+
+logger = setup_logger(__name__)
+
+# Reports what a local analyzer can prove about a Python snippet without running it,
+# as `BugDetail` records for the bug finder: syntax errors, undefined names, unused
+# variables, unreachable code and misuse of literals that always fails at runtime.
+# Everything here is certain, so the finder is told to take the findings as given
+# and spend its turns on logical and behavioral bugs.
+
+def static_analysis_enabled(code_input: CodeInput) -> bool:
+    return os.environ.get("DEBUG_STATIC_ANALYSIS", "true").lower() == "true" and code_input.language.lower() in ("python", "py")
+
+SEVERITIES = {
+    "syntax_error": "critical",
+    "undefined_name": "high",
+    "type_misuse": "high",
+    "unreachable_code": "medium",
+    "unused_variable": "low",
+}
+
+KNOWN_GLOBALS = set(dir(builtins)) | {"__file__", "__builtins__", "__annotations__", "__path__", "__cached__", "WindowsError"}
+
+SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+COMPREHENSION_NAMES = {ast.ListComp: "listcomp", ast.SetComp: "setcomp", ast.DictComp: "dictcomp", ast.GeneratorExp: "genexpr"}
+TERMINAL_STATEMENTS = (ast.Return, ast.Raise, ast.Continue, ast.Break)
+NUMBERS = (int, float, complex)
+TEXT = (str, bytes)
+
+@dataclass
+class Finding:
+    kind: str
+    line: int
+    message: str
+    function: Optional[str] = None
+    names: Optional[List[str]] = None
+    error: Optional[str] = None
+
+@dataclass
+class StaticReport:
+    findings: List[Finding]
+    seconds: float
+    lines: List[str] = field(default_factory=list, repr=False)
+    compiles: bool = True
+
+    def bugs(self) -> List[dict]:
+        """The findings as `BugDetail` records, numbered from 1 in line order."""
+        bugs = []
+        for bug_id, finding in enumerate(sorted(self.findings, key=lambda finding: finding.line), start=1):
+            line = self.lines[finding.line - 1].strip() if 0 < finding.line <= len(self.lines) else None
+            bugs.append({
+                "bug_id": bug_id,
+                "description": finding.message,
+                "line_number": finding.line,
+                "severity": SEVERITIES[finding.kind],
+                "error_message": finding.error,
+                "stack_trace": None,
+                "variables_at_fault": finding.names,
+                "conditions": f"Reported by static analysis ({finding.kind.replace('_', ' ')})",
+                "frequency": "always" if finding.kind in ("syntax_error", "type_misuse") else None,
+                "module": None,
+                "function": finding.function,
+                "code_snippet": line,
+                "replication_steps": None,
+                "logs": None,
+                "environment": None,
+                "timestamp": None,
+            })
+        return bugs
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for finding in self.findings:
+            counts[finding.kind] = counts.get(finding.kind, 0) + 1
+        return counts
+
+    def prompt(self) -> str:
+        bugs = self.bugs()
+        lines = [
+            f"A static analyzer found {len(bugs)} problem(s) before this task. They are certain: include each one in `bugs` "
+            f"as given, keeping its `bug_id`, and number the bugs you find from {len(bugs) + 1}. Do not use tools to confirm "
+            "them; spend your effort on logical and behavioral bugs the analyzer cannot see.",
+        ]
+        if not self.compiles:
+            lines.append("The code does not compile, so running it would only reproduce the syntax error.")
+        # One record per line, without the fields that are null
+        lines += [json.dumps({key: value for key, value in bug.items() if value is not None}) for bug in bugs]
+        return "\n".join(lines)
+
+# Scopes
+
+def _scope_name(node: ast.AST) -> str:
+    if isinstance(node, ast.Lambda):
+        return "lambda"
+    return COMPREHENSION_NAMES.get(type(node)) or node.name
+
+def _arguments(args: ast.arguments) -> List[ast.AST]:
+    return [*args.posonlyargs, *args.args, *([args.vararg] if args.vararg else []), *args.kwonlyargs, *([args.kwarg] if args.kwarg else [])]
+
+def _scope_parts(node: ast.AST) -> Tuple[List[ast.AST], List[ast.AST]]:
+    """The parts of a scope-creating node evaluated in the enclosing scope, and those evaluated in its own."""
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        annotations = [arg.annotation for arg in _arguments(node.args) if arg.annotation] + ([node.returns] if node.returns else [])
+        outer = [*node.decorator_list, *node.args.defaults, *[d for d in node.args.kw_defaults if d], *annotations]
+        return outer, list(node.body)
+    if isinstance(node, ast.Lambda):
+        return [*node.args.defaults, *[d for d in node.args.kw_defaults if d]], [node.body]
+    if isinstance(node, ast.ClassDef):
+        return [*node.decorator_list, *node.bases, *node.keywords], list(node.body)
+    first, *rest = node.generators
+    elements = [node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt]
+    return [first.iter], [*elements, first.target, *first.ifs, *rest]
+
+@dataclass
+class Scope:
+    table: symtable.SymbolTable
+    node: Optional[ast.AST]
+    function: Optional[str]
+    roots: List[ast.AST] = field(default_factory=list)
+    nodes: List[ast.AST] = field(default_factory=list)
+
+def _direct_nodes(roots: List[ast.AST], nested: List[ast.AST]) -> Iterator[ast.AST]:
+    """Every node of `roots` that belongs to their own scope; nested scope nodes go to `nested`."""
+    stack = list(reversed(roots))
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, SCOPE_NODES):
+            nested.append(node)
+            outer, _ = _scope_parts(node)
+            stack.extend(reversed(outer))
+            continue
+        stack.extend(reversed(list(ast.iter_child_nodes(node))))
+
+def _scopes(tree: ast.Module, table: symtable.SymbolTable) -> List[Scope]:
+    """Pairs each symbol table with the AST nodes of its scope, matching tables by name and line."""
+    scopes = []
+    pending = [Scope(table, None, None)]
+    while pending:
+        scope = pending.pop()
+        nested: List[ast.AST] = []
+        scope.roots = tree.body if scope.node is None else _scope_parts(scope.node)[1]
+        scope.nodes = list(_direct_nodes(scope.roots, nested))
+        scopes.append(scope)
+        children: Dict[Tuple[str, int], List[symtable.SymbolTable]] = {}
+        for child in scope.table.get_children():
+            children.setdefault((child.get_name(), child.get_lineno()), []).append(child)
+        for node in sorted(nested, key=lambda node: (node.lineno, node.col_offset)):
+            candidates = children.get((_scope_name(node), node.lineno))
+            if not candidates:
+                continue
+            function = scope.function
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                function = f"{scope.function}.{node.name}" if scope.function else node.name
+            pending.append(Scope(candidates.pop(0), node, function))
+    return scopes
+
+# Checks; each takes the scopes, whose nodes cover the tree once
+
+def _defined_globals(scopes: List[Scope]) -> set:
+    defined = set()
+    for scope in scopes:
+        for symbol in scope.table.get_symbols():
+            module_level = scope.table.get_type() == "module"
+            if (module_level or symbol.is_declared_global()) and (symbol.is_assigned() or symbol.is_imported()):
+                defined.add(symbol.get_name())
+    return defined
+
+def _dynamic_globals(scopes: List[Scope]) -> bool:
+    """Whether module globals may be created at runtime, by a star import, `globals()`, `exec` or a call given `__name__`."""
+    for scope in scopes:
+        for node in scope.nodes:
+            if isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names):
+                return True
+            if isinstance(node, ast.Name) and node.id in ("globals", "exec"):
+                return True
+            if isinstance(node, ast.Call) and any(isinstance(arg, ast.Name) and arg.id == "__name__" for arg in node.args):
+                return True
+    return False
+
+def _undefined_names(scopes: List[Scope]) -> Iterator[Finding]:
+    if _dynamic_globals(scopes):
+        return
+    defined = _defined_globals(scopes) | KNOWN_GLOBALS
+    for scope in scopes:
+        reported = set()
+        for node in scope.nodes:
+            if not isinstance(node, ast.Name) or not isinstance(node.ctx, ast.Load) or node.id in defined or node.id in reported:
+                continue
+            try:
+                symbol = scope.table.lookup(node.id)
+            except KeyError:
+                continue
+            # Not `is_global()`: symtable takes any scope named "top" for the module
+            if not symbol.is_local() and not symbol.is_free():
+                reported.add(node.id)
+                yield Finding("undefined_name", node.lineno, f"Name '{node.id}' is not defined; using it raises NameError", scope.function,
+                              [node.id], f"NameError: name '{node.id}' is not defined")
+
+def _free_in_children(table: symtable.SymbolTable) -> set:
+    free = set()
+    for child in table.get_children():
+        free |= {symbol.get_name() for symbol in child.get_symbols() if symbol.is_free()}
+        free |= _free_in_children(child)
+    return free
+
+def _plain_bindings(nodes: List[ast.AST]) -> Dict[str, int]:
+    """Names bound on their own, by assignment, walrus, import or `except ... as`; tuple unpacking and loop targets are left out."""
+    bindings: Dict[str, int] = {}
+    for node in nodes:
+        names = []
+        if isinstance(node, ast.Assign):
+            names = [target.id for target in node.targets if isinstance(target, ast.Name)]
+        elif isinstance(node, (ast.AnnAssign, ast.NamedExpr)) and isinstance(node.target, ast.Name) and node.value is not None:
+            names = [node.target.id]
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names = [node.name]
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names = [(alias.asname or alias.name).split(".")[0] for alias in node.names]
+        for name in names:
+            bindings.setdefault(name, node.lineno)
+    return bindings
+
+def _unused_variables(scopes: List[Scope]) -> Iterator[Finding]:
+    for scope in scopes:
+        if not isinstance(scope.node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        if any(isinstance(node, ast.Name) and node.id in ("locals", "vars") for node in scope.nodes):
+            # The locals may be read by name
+            continue
+        captured = _free_in_children(scope.table)
+        for name, line in _plain_bindings(scope.nodes).items():
+            try:
+                symbol = scope.table.lookup(name)
+            except KeyError:
+                continue
+            if name.startswith("_") or symbol.is_referenced() or symbol.is_parameter() or not symbol.is_local() or name in captured:
+                continue
+            kind = "imported" if symbol.is_imported() else "assigned"
+            yield Finding("unused_variable", line, f"Local variable '{name}' is {kind} but never used", scope.function, [name])
+
+def _unreachable_code(statements: List[ast.stmt], function: Optional[str]) -> Iterator[Finding]:
+    for statement, following in zip(statements, statements[1:]):
+        if isinstance(statement, TERMINAL_STATEMENTS):
+            keyword = type(statement).__name__.lower()
+            yield Finding("unreachable_code", following.lineno, f"Code after `{keyword}` on line {statement.lineno} never runs", function)
+            return
+
+def _constant_type(node: ast.AST) -> Optional[type]:
+    if isinstance(node, ast.Constant):
+        return type(node.value)
+    if isinstance(node, ast.JoinedStr):
+        return str
+    return None
+
+def _literal_kind(node: ast.AST) -> Optional[str]:
+    """The type name of a literal that is never callable, e.g. 'int' for `1`."""
+    if isinstance(node, ast.Constant) and node.value is not ...:
+        return type(node.value).__name__
+    return LITERAL_KINDS.get(type(node))
+
+LITERAL_KINDS = {ast.Tuple: "tuple", ast.List: "list", ast.Dict: "dict", ast.Set: "set", ast.JoinedStr: "str",
+                 ast.ListComp: "list", ast.SetComp: "set", ast.DictComp: "dict", ast.GeneratorExp: "generator"}
+UNSUBSCRIPTABLE = ("int", "float", "complex", "bool", "NoneType", "set", "generator")
+
+def _identity_literal(node: ast.AST) -> bool:
+    if isinstance(node, ast.Constant):
+        return not (node.value is None or isinstance(node.value, bool) or node.value is ...)
+    return isinstance(node, (ast.Tuple, ast.List, ast.Dict, ast.Set, ast.JoinedStr))
+
+def _incompatible(left: type, op: ast.operator, right: type) -> bool:
+    if left in TEXT and right in TEXT:
+        return left is not right and not isinstance(op, ast.Mod)
+    if left in TEXT and right in NUMBERS:
+        # "%d" % 1 formats, "ab" * 2 repeats
+        return not isinstance(op, ast.Mod) and not (isinstance(op, ast.Mult) and right is int)
+    if left in NUMBERS and right in TEXT:
+        return not (isinstance(op, ast.Mult) and left is int)
+    return False
+
+def _type_misuse(node: ast.AST) -> Optional[str]:
+    if isinstance(node, ast.BinOp):
+        left, right = _constant_type(node.left), _constant_type(node.right)
+        if left and right and _incompatible(left, node.op, right):
+            return f"Unsupported operand types for {type(node.op).__name__}: '{left.__name__}' and '{right.__name__}'; raises TypeError"
+    elif isinstance(node, ast.Call) and _literal_kind(node.func):
+        return f"'{_literal_kind(node.func)}' object is not callable; perhaps a comma is missing"
+    elif isinstance(node, ast.Subscript) and _literal_kind(node.value) in UNSUBSCRIPTABLE:
+        return f"'{_literal_kind(node.value)}' object is not subscriptable"
+    elif isinstance(node, ast.Compare):
+        operands = [node.left, *node.comparators]
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            if isinstance(op, (ast.Is, ast.IsNot)) and (_identity_literal(left) or _identity_literal(right)):
+                return "`is` compares identity, not value, and is unreliable with a literal; use `==`"
+    elif isinstance(node, ast.Assert) and isinstance(node.test, ast.Tuple) and node.test.elts:
+        return "Assertion on a non-empty tuple is always true; remove the parentheses around the condition and message"
+    elif isinstance(node, ast.Raise) and node.exc is not None:
+        raised = node.exc.func if isinstance(node.exc, ast.Call) else node.exc
+        if isinstance(raised, ast.Name) and raised.id == "NotImplemented":
+            return "`NotImplemented` is not an exception; raising it raises TypeError. Use `NotImplementedError`"
+    return None
+
+def _loose_jumps(statements: List[ast.stmt], in_loop: bool, function: Optional[str]) -> Iterator[Finding]:
+    """`break` and `continue` outside a loop, which the parser accepts and the compiler rejects."""
+    for statement in statements:
+        if isinstance(statement, (ast.Break, ast.Continue)) and not in_loop:
+            message = f"SyntaxError: '{type(statement).__name__.lower()}' outside loop"
+            yield Finding("syntax_error", statement.lineno, message, function, error=message)
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        for name in ("body", "orelse", "finalbody", "handlers", "cases"):
+            block = getattr(statement, name, None) or []
+            loop_body = name == "body" and isinstance(statement, (ast.For, ast.AsyncFor, ast.While))
+            for item in block:
+                body = item.body if isinstance(item, (ast.ExceptHandler, ast.match_case)) else [item]
+                yield from _loose_jumps(body, in_loop or loop_body, function)
+
+# Checks by node type, so the common nodes (names, attributes, constants) cost one set lookup
+BLOCK_TYPES = {ast.If, ast.For, ast.AsyncFor, ast.While, ast.With, ast.AsyncWith, ast.Try, getattr(ast, "TryStar", ast.Try), ast.ExceptHandler, ast.match_case}
+MISUSE_TYPES = {ast.BinOp, ast.Call, ast.Subscript, ast.Compare, ast.Assert, ast.Raise}
+FUNCTION_ONLY_TYPES = {ast.Return, ast.Yield, ast.YieldFrom}
+
+def _scope_findings(scope: Scope) -> Iterator[Finding]:
+    in_function = scope.table.get_type() == "function"
+    for node in scope.nodes:
+        node_type = type(node)
+        if node_type in BLOCK_TYPES:
+            # A nested scope's body is checked with that scope
+            for name in ("body", "orelse", "finalbody"):
+                block = getattr(node, name, None)
+                if block:
+                    yield from _unreachable_code(block, scope.function)
+        elif node_type in MISUSE_TYPES:
+            message = _type_misuse(node)
+            if message:
+                yield Finding("type_misuse", node.lineno, message, scope.function)
+        if node_type in FUNCTION_ONLY_TYPES and not in_function:
+            keyword = "return" if node_type is ast.Return else "yield"
+            message = f"SyntaxError: '{keyword}' outside function"
+            yield Finding("syntax_error", node.lineno, message, scope.function, error=message)
+    if scope.node is None or isinstance(scope.node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        # The other scopes are expressions
+        yield from _unreachable_code(scope.roots, scope.function)
+        yield from _loose_jumps(scope.roots, False, scope.function)
+
+def analyze_code(code: str, language: str = "python") -> Optional[StaticReport]:
+    """Runs every check on a Python snippet; None for other languages."""
+    if language.lower() not in ("python", "py"):
+        return None
+    started = time.perf_counter()
+    lines = code.splitlines()
+    try:
+        tree = ast.parse(code)
+        table = symtable.symtable(code, "<snippet>", "exec")
+    except SyntaxError as e:
+        finding = Finding("syntax_error", e.lineno or 1, f"{type(e).__name__}: {e.msg}", error=f"{type(e).__name__}: {e.msg}")
+        return StaticReport([finding], time.perf_counter() - started, lines, compiles=False)
+    except (ValueError, RecursionError, MemoryError) as e:
+        # Null bytes, or nesting too deep to parse; the finder works without the report
+        logger.warning(f"Static analysis could not parse the snippet: {e}")
+        return None
+    findings: List[Finding] = []
+    try:
+        scopes = _scopes(tree, table)
+        for scope in scopes:
+            findings += _scope_findings(scope)
+        findings += _undefined_names(scopes)
+        findings += _unused_variables(scopes)
+    except RecursionError:
+        logger.warning("Static analysis stopped early: the snippet is nested too deeply")
+    compiles = not any(finding.kind == "syntax_error" for finding in findings)
+    return StaticReport(findings, time.perf_counter() - started, lines, compiles)
+
+class ToolCallBaseline:
+    """
+    Moving average of the Bug Finder's tool calls on runs that had a REPL and no
+    static findings. A seeded run's saving is estimated as the baseline minus the
+    calls it made; the snippets differ, so this is an estimate, not a measurement.
+    """
+
+    def __init__(self, alpha: float = 0.1, prior: float = 2.0):
+        self.alpha = alpha
+        self.calls = prior
+        self._lock = threading.Lock()
+
+    def record(self, seeded: bool, tool_calls: int, had_repl: bool) -> float:
+        """Counts one Bug Finder run and returns the tool calls it is estimated to have saved."""
+        counters.inc("bug_finder_runs", seeded="yes" if seeded else "no")
+        counters.inc("bug_finder_tool_calls", tool_calls, seeded="yes" if seeded else "no")
+        with self._lock:
+            if not seeded:
+                if had_repl:
+                    self.calls += self.alpha * (tool_calls - self.calls)
+                return 0.0
+            saved = max(0.0, self.calls - tool_calls)
+        counters.inc("static_analysis_tool_calls_saved", saved)
+        return saved
+
+tool_call_baseline = ToolCallBaseline()
+
+def record_report(report: Optional[StaticReport]):
+    if report is None:
+        return
+    counters.inc("static_analysis_runs")
+    counters.inc("static_analysis_seconds", report.seconds)
+    for kind, count in report.counts().items():
+        counters.inc("static_analysis_findings", count, kind=kind)
+    logger.info(f"Static analysis: {len(report.findings)} finding(s) in {report.seconds * 1000:.1f} ms")
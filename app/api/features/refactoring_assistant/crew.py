@@ -4,92 +4,76 @@ from app.api.schemas.refactoring_assistant_schema import (
     CodeInput,
     RefactoredCode,
     RefactoringOpportunities,
-    RefactoringSuggestions
+    RefactoringSuggestions,
+    RefactoredCodePatch
 )
 from crewai import (
     Crew,
-    Task, 
-    Agent
+    Task
 )
 from textwrap import dedent
 import json
-from langchain_openai import ChatOpenAI
-from langchain_experimental.tools import PythonREPLTool
-from langchain_community.tools import WikipediaQueryRun
-from langchain_community.utilities import WikipediaAPIWrapper
-from langchain_community.tools.wikidata.tool import WikidataAPIWrapper, WikidataQueryRun
-from langchain_community.utilities import ArxivAPIWrapper
-from langchain.tools import Tool
+from typing import Sequence
+from app.api.agent_templates import AgentTemplate
+from app.api.depth import VERIFIER_AGENT, depth_instructions, quick_overrides, verification_task
+from app.api.fingerprint import starting_point_prompt
+from app.api.patching import DIFF_INSTRUCTIONS, number_lines, patched_output
+from app.api.logger import crew_verbose
+from app.api.request_context import stage_completed
+from app.api.tools import arxiv_tool, python_repl_tool, wikidata_query_tool, wikipedia_query_tool
 from langchain_core.output_parsers import JsonOutputParser
 
+RESEARCH_TOOLS = (wikipedia_query_tool, wikidata_query_tool, arxiv_tool)
+
+# Agent 1: Code Analysis Expert
+ANALYSIS_AGENT = AgentTemplate(
+    role="Code Analysis Expert",
+    backstory=dedent("""You are an expert in analyzing code to detect issues, bugs, code smells, and provide complexity metrics."""),
+    goal=dedent("""Analyze the provided code and identify any issues, potential bugs, or code smells. Also, provide complexity metrics such as cyclomatic complexity, maintainability index, and technical debt."""),
+    model="gpt-4o-mini",
+    tools=(python_repl_tool,),
+)
+
+# Agent 2: Refactoring Opportunity Identifier
+OPPORTUNITY_AGENT = AgentTemplate(
+    role="Refactoring Opportunity Identifier",
+    backstory=dedent("""You specialize in identifying specific opportunities for code refactoring based on analysis results."""),
+    goal=dedent("""Identify specific refactoring opportunities based on the analysis output, relating them to the identified issues, and assign a priority level."""),
+    model="gpt-4o",
+    tools=RESEARCH_TOOLS,
+    hedged=True,
+)
+
+# Agent 3: Refactoring Suggestions Expert
+SUGGESTION_AGENT = AgentTemplate(
+    role="Refactoring Suggestions Expert",
+    backstory=dedent("""You provide detailed suggestions on how to implement the identified refactoring opportunities, including estimated effort and affected dependencies."""),
+    goal=dedent("""Generate detailed suggestions for implementing the refactoring opportunities, including estimated effort in hours and any affected dependencies."""),
+    model="gpt-4o-mini",
+    tools=RESEARCH_TOOLS,
+)
+
+# Agent 4: Code Refactoring Specialist
+REFACTORING_AGENT = AgentTemplate(
+    role="Code Refactoring Specialist",
+    backstory=dedent("""You apply refactoring suggestions to the code and produce the refactored code along with a summary of changes made and any new dependencies."""),
+    goal=dedent("""Apply the refactoring suggestions to the code and produce the refactored code along with a summary of the changes made and any new dependencies introduced."""),
+    model="gpt-4o",
+    tools=(python_repl_tool,),
+)
+
 class CustomAgents:
-    def __init__(self):
-        self.OpenAIGPT4Mini = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-        self.OpenAIGPT4 = ChatOpenAI(model="gpt-4o", temperature=0)
-
-    def analysis_agent(self):
-        # Agent 1: Code Analysis Expert
-        tools = [PythonREPLTool()]
-        return Agent(
-            role="Code Analysis Expert",
-            backstory=dedent("""You are an expert in analyzing code to detect issues, bugs, code smells, and provide complexity metrics."""),
-            goal=dedent("""Analyze the provided code and identify any issues, potential bugs, or code smells. Also, provide complexity metrics such as cyclomatic complexity, maintainability index, and technical debt."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4Mini,
-        )
+    def analysis_agent(self, **overrides):
+        return ANALYSIS_AGENT.bind(**overrides)
 
-    def opportunity_agent(self):
-        # Agent 2: Refactoring Opportunity Identifier
-        tools = [WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper()),
-                 WikidataQueryRun(api_wrapper=WikidataAPIWrapper()),
-                 Tool( # Wrap ArxivAPIWrapper as a Tool
-                     name="Arxiv",
-                     func=ArxivAPIWrapper().run,
-                     description="A wrapper around Arxiv. Useful for when you need to access academic papers."
-                 )]
-        return Agent(
-            role="Refactoring Opportunity Identifier",
-            backstory=dedent("""You specialize in identifying specific opportunities for code refactoring based on analysis results."""),
-            goal=dedent("""Identify specific refactoring opportunities based on the analysis output, relating them to the identified issues, and assign a priority level."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4,
-        )
+    def opportunity_agent(self, **overrides):
+        return OPPORTUNITY_AGENT.bind(**overrides)
 
-    def suggestion_agent(self):
-        # Agent 3: Refactoring Suggestions Expert
-        tools = [WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper()),
-                 WikidataQueryRun(api_wrapper=WikidataAPIWrapper()),
-                 Tool( # Wrap ArxivAPIWrapper as a Tool
-                     name="Arxiv",
-                     func=ArxivAPIWrapper().run,
-                     description="A wrapper around Arxiv. Useful for when you need to access academic papers."
-                 )]
-        return Agent(
-            role="Refactoring Suggestions Expert",
-            backstory=dedent("""You provide detailed suggestions on how to implement the identified refactoring opportunities, including estimated effort and affected dependencies."""),
-            goal=dedent("""Generate detailed suggestions for implementing the refactoring opportunities, including estimated effort in hours and any affected dependencies."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4Mini,
-        )
+    def suggestion_agent(self, **overrides):
+        return SUGGESTION_AGENT.bind(**overrides)
 
-    def refactoring_agent(self):
-        # Agent 4: Code Refactoring Specialist
-        tools = [PythonREPLTool()]
-        return Agent(
-            role="Code Refactoring Specialist",
-            backstory=dedent("""You apply refactoring suggestions to the code and produce the refactored code along with a summary of changes made and any new dependencies."""),
-            goal=dedent("""Apply the refactoring suggestions to the code and produce the refactored code along with a summary of the changes made and any new dependencies introduced."""),
-            tools=tools,
-            allow_delegation=False,
-            verbose=True,
-            llm=self.OpenAIGPT4,
-        )
+    def refactoring_agent(self, **overrides):
+        return REFACTORING_AGENT.bind(**overrides)
 
 class CustomTasks:
     def __init__(self):
@@ -176,6 +160,7 @@ class CustomTasks:
             description=dedent(f"""
                 Apply refactoring suggestions to the following code.
                 Ensure the code remains functional and follows best practices.
+                {depth_instructions(code_input.depth)}
                 Provide the refactored code and a summary of changes made in **JSON format** matching the **RefactoredCode** schema.
 
                 **Format**:
@@ -190,52 +175,123 @@ class CustomTasks:
 
                 **Additional Context**:
                 {code_input.context if code_input.context else 'N/A'}
+
+                {starting_point_prompt()}
             """),
             agent=agent,
             expected_output=f"The refactored code in JSON format matching the schema: {refactored_code_schema}",
         )
 
+    def code_refactoring_patch_task(self, agent, code_input: CodeInput):
+        patch_schema = RefactoredCodePatch.schema_json(indent=2)
+        return Task(
+            description=dedent(f"""
+                Apply refactoring suggestions to the following code.
+                Ensure the code remains functional and follows best practices.
+                {depth_instructions(code_input.depth)}
+                {DIFF_INSTRUCTIONS}
+                Provide the edits and a summary of changes made in **JSON format** matching the **RefactoredCodePatch** schema.
+
+                **Format**:
+                ```json
+                {patch_schema}
+                ```
+
+                **Original Code** (with line numbers):
+                ```{code_input.language}
+{number_lines(code_input.code_snippet)}
+                ```
+
+                **Additional Context**:
+                {code_input.context if code_input.context else 'N/A'}
+
+                {starting_point_prompt()}
+            """),
+            agent=agent,
+            expected_output=f"The edits in JSON format matching the schema: {patch_schema}",
+        )
+
+VERIFICATION_CHECKS = dedent("""
+    Check that the refactored code is complete, preserves the behaviour of the original code, is valid
+    code in the same language, and that `changes_made` describes every change and nothing else.""")
+
+# The pipeline's stages in order
+STAGES = ("analyze", "opportunities", "suggestions", "refactor")
+
 class CodeRefactoringCrew:
-    def __init__(self, code_snippet, language="python", context=None):
-        self.code_input = CodeInput(code_snippet=code_snippet, language=language, context=context)
+    def __init__(self, code_snippet, language="python", context=None, output_mode="full", depth="standard", stages=STAGES):
+        self.code_input = CodeInput(code_snippet=code_snippet, language=language, context=context, output_mode=output_mode, depth=depth)
+        self.stages = stages
         self.agents = CustomAgents()
         self.tasks = CustomTasks()
 
+    def refactoring_task(self, agent):
+        if self.code_input.output_mode == "diff":
+            return self.tasks.code_refactoring_patch_task(agent, self.code_input)
+        return self.tasks.code_refactoring_task(agent, self.code_input)
+
     def run(self):
-        # Define agents
-        analysis_agent = self.agents.analysis_agent()
-        opportunity_agent = self.agents.opportunity_agent()
-        suggestion_agent = self.agents.suggestion_agent()
-        refactoring_agent = self.agents.refactoring_agent()
-
-        # Define tasks
-        analysis_task = self.tasks.code_analysis_task(analysis_agent, self.code_input)
-        opportunity_task = self.tasks.refactoring_opportunity_task(opportunity_agent, self.code_input)
-        suggestion_task = self.tasks.refactoring_suggestion_task(suggestion_agent, self.code_input)
-        refactoring_task = self.tasks.code_refactoring_task(refactoring_agent, self.code_input)
+        if self.code_input.depth == "quick":
+            # The refactoring specialist alone, on the fast model
+            refactoring_agent = self.agents.refactoring_agent(**quick_overrides())
+            agents = [refactoring_agent]
+            tasks = [self.refactoring_task(refactoring_agent)]
+        else:
+            # Define agents
+            analysis_agent = self.agents.analysis_agent()
+            opportunity_agent = self.agents.opportunity_agent()
+            suggestion_agent = self.agents.suggestion_agent()
+            refactoring_agent = self.agents.refactoring_agent()
 
-        # Create the crew
-        crew = Crew(
-            agents=[
+            # Define tasks
+            analysis_task = self.tasks.code_analysis_task(analysis_agent, self.code_input)
+            opportunity_task = self.tasks.refactoring_opportunity_task(opportunity_agent, self.code_input)
+            suggestion_task = self.tasks.refactoring_suggestion_task(suggestion_agent, self.code_input)
+            refactoring_task = self.refactoring_task(refactoring_agent)
+
+            agents = [
                 analysis_agent,
                 opportunity_agent,
                 suggestion_agent,
                 refactoring_agent,
-            ],
-            tasks=[
+            ]
+            tasks = [
                 analysis_task,
                 opportunity_task,
                 suggestion_task,
                 refactoring_task,
-            ],
-            verbose=True,
+            ]
+            if tuple(self.stages) != STAGES:
+                # A full review starts after the analysis it shares (see full_review/crew.py)
+                selected = [i for i, stage in enumerate(STAGES) if stage in self.stages]
+                agents = [agents[i] for i in selected]
+                tasks = [tasks[i] for i in selected]
+
+        if self.code_input.depth == "deep":
+            verifier_agent = VERIFIER_AGENT.bind()
+            schema, original = RefactoredCode, self.code_input.model_dump_json(indent=2, exclude={"output_mode", "depth"})
+            if self.code_input.output_mode == "diff":
+                # Edits refer to line numbers, so the verifier needs them too
+                schema, original = RefactoredCodePatch, number_lines(self.code_input.code_snippet)
+            agents.append(verifier_agent)
+            tasks.append(verification_task(verifier_agent, schema, VERIFICATION_CHECKS, original))
+
+        # Create the crew
+        crew = Crew(
+            agents=agents,
+            tasks=tasks,
+            verbose=crew_verbose(),
+            task_callback=stage_completed,
         )
 
         result = crew.kickoff()
         return result
     
-def run_refactoring_assistant_crew(args: CodeInput):
-    parser = JsonOutputParser(pydantic_object=RefactoredCode)
-    crew = CodeRefactoringCrew(args.code_snippet, args.language, args.context)
+def run_refactoring_assistant_crew(args: CodeInput, stages: Sequence[str] = STAGES):
+    crew = CodeRefactoringCrew(args.code_snippet, args.language, args.context, args.output_mode, args.depth, stages)
     results = crew.run()
-    return parser.parse(results.raw)
\ No newline at end of file
+    if args.output_mode == "diff":
+        parser = JsonOutputParser(pydantic_object=RefactoredCodePatch)
+        return patched_output(args.code_snippet, args.language, parser.parse(results.raw))
+    parser = JsonOutputParser(pydantic_object=RefactoredCode)
+    return parser.parse(results.raw)
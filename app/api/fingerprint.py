@@ -0,0 +1,302 @@
+import ast
+import builtins
+import hashlib
+import io
+import json
+import keyword
+import os
+import re
+import threading
+import time
+import tokenize
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from pydantic import BaseModel
+from app.api.logger import setup_logger
+from app.api.request_context import get_starting_point
+
+logger = setup_logger(__name__)
+
+FINGERPRINT_ENDPOINTS = {"/refactoring-assistant", "/multi-agent-debugging-assistant"}
+
+NUM_PERMUTATIONS = 128
+BANDS = 16  # 16 bands of 8 rows: pairs above ~0.7 Jaccard share a bucket with high probability
+ROWS = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = 5
+_PRIME = (1 << 31) - 1
+_random = np.random.RandomState(20240901)
+_A = _random.randint(1, _PRIME, NUM_PERMUTATIONS).astype(np.uint64)
+_B = _random.randint(0, _PRIME, NUM_PERMUTATIONS).astype(np.uint64)
+
+# Identifiers that keep their name when other code is canonicalized
+_GENERIC_KEYWORDS = set(keyword.kwlist) | {
+    "function", "var", "let", "const", "new", "this", "null", "undefined", "true", "false", "void", "public",
+    "private", "protected", "static", "final", "int", "long", "float", "double", "char", "string", "bool",
+    "boolean", "struct", "enum", "interface", "extends", "implements", "package", "switch", "case", "default",
+    "do", "goto", "typeof", "instanceof", "fn", "func", "impl", "mut", "pub", "use", "mod", "match", "go",
+    "select", "chan", "defer", "map", "type", "template", "typename", "namespace", "using", "throw", "throws",
+}
+_C_COMMENTS = r"//[^\n]*|/\*.*?\*/"
+_HASH_COMMENTS = r"\#[^\n]*"
+# Comment syntax by language. Code in a language not listed keeps its comments, so
+# a `#` directive or a `--` operator is never mistaken for one.
+_COMMENTS = {
+    **dict.fromkeys(("c", "cpp", "c++", "csharp", "c#", "java", "javascript", "js", "typescript", "ts", "go",
+                     "golang", "rust", "kotlin", "swift", "scala", "dart", "objective-c"), _C_COMMENTS),
+    **dict.fromkeys(("python", "py", "ruby", "rb", "shell", "sh", "bash", "zsh", "perl", "r", "elixir",
+                     "powershell", "yaml", "yml", "toml"), _HASH_COMMENTS),
+    "php": f"{_C_COMMENTS}|{_HASH_COMMENTS}",
+    "sql": r"--[^\n]*|/\*.*?\*/",
+    "lua": r"--\[\[.*?\]\]|--[^\n]*",
+}
+# Languages where indentation is syntax: the lexer drops it, so their exact key is the code as written
+_INDENTED = {"python", "py", "yaml", "yml", "haskell", "hs", "fsharp", "f#", "coffeescript", "nim"}
+_LEXERS: Dict[str, re.Pattern] = {}
+
+def _lexer(language: str) -> re.Pattern:
+    lexer = _LEXERS.get(language)
+    if lexer is None:
+        lexer = _LEXERS[language] = re.compile(r"""
+            (?P<comment>%s)
+          | (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`)
+          | (?P<name>[A-Za-z_$][A-Za-z0-9_$]*)
+          | (?P<number>\d[\w.]*)
+          | (?P<newline>\n)
+          | (?P<op>\S)
+        """ % _COMMENTS.get(language, r"(?!)"), re.VERBOSE | re.DOTALL)
+    return lexer
+
+# Response fields that quote the caller's code: rewritten code, or a diff against it
+SOURCE_FIELDS = ("code_snippet", "patch")
+
+def quotes_source(result: Any) -> bool:
+    return not isinstance(result, dict) or any(field in result for field in SOURCE_FIELDS)
+
+@dataclass
+class Fingerprint:
+    exact_key: str
+    source_key: str
+    language: str
+    signature: np.ndarray
+
+    def key_for(self, result: Any) -> str:
+        """
+        A result that quotes the code is only reused for the same text, since its
+        code and diff carry the comments and layout of the code it was made for;
+        other results are reused for the same tokens.
+        """
+        return self.source_key if quotes_source(result) else self.exact_key
+
+@dataclass
+class FingerprintMatch:
+    exact: bool
+    similarity: float
+    result: Any
+
+_SCOPES = (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+def _bound_names(node) -> List[str]:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [node.name]
+    if isinstance(node, ast.arg):
+        return [node.arg]
+    if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+        return [node.id]
+    if isinstance(node, ast.ExceptHandler) and node.name:
+        return [node.name]
+    return []
+
+def _canonicalize(tree: ast.AST) -> ast.AST:
+    """Strips docstrings and renames every name the snippet binds to v0, v1, ... in order of appearance, in place."""
+    nodes = list(ast.walk(tree))
+    names: Dict[str, str] = {}
+    for node in nodes:
+        for name in _bound_names(node):
+            if name not in names and not hasattr(builtins, name):
+                names[name] = f"v{len(names)}"
+    for node in nodes:
+        if isinstance(node, _SCOPES):
+            body = node.body
+            if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+                node.body = body[1:] or [ast.Pass()]
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            node.name = names.get(node.name, node.name)
+        elif isinstance(node, ast.arg):
+            node.arg = names.get(node.arg, node.arg)
+        elif isinstance(node, ast.Name):
+            node.id = names.get(node.id, node.id)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            node.name = names.get(node.name, node.name)
+    return tree
+
+def _python_tokens(source: str) -> List[str]:
+    skip = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER}
+    return [token.string if token.type not in (tokenize.INDENT, tokenize.DEDENT, tokenize.NEWLINE) else tokenize.tok_name[token.type]
+            for token in tokenize.generate_tokens(io.StringIO(source).readline) if token.type not in skip]
+
+def _generic_tokens(source: str, language: str, canonical: bool) -> List[str]:
+    """Line breaks are kept in exact tokens (one per run of them), since automatic
+    semicolons and preprocessor lines depend on them."""
+    tokens, names = [], {}
+    for match in _lexer(language).finditer(source):
+        kind, text = match.lastgroup, match.group()
+        if kind == "comment":
+            continue
+        if kind == "newline":
+            if not canonical and tokens and tokens[-1] != "\n":
+                tokens.append(text)
+            continue
+        if canonical and kind == "name" and text not in _GENERIC_KEYWORDS:
+            text = names.setdefault(text, f"v{len(names)}")
+        tokens.append(text)
+    return tokens
+
+def normalize(code: str, language: str) -> Tuple[Optional[List[str]], List[str]]:
+    """
+    Returns (exact tokens, canonical tokens). Exact tokens ignore comments and
+    whitespace that does not change the program, and are None when the code cannot
+    be tokenized without losing some, e.g. Python that does not parse. Canonical
+    tokens also drop docstrings and rename bound identifiers, for Python through
+    the AST and for other languages lexically.
+    """
+    language = language.lower()
+    if language in ("python", "py"):
+        try:
+            exact = _python_tokens(code)
+            tree = ast.parse(code)
+            canonical = _python_tokens(ast.unparse(_canonicalize(tree)))
+            return exact, canonical
+        except (SyntaxError, tokenize.TokenError, ValueError, RecursionError):
+            pass
+    exact = None if language in _INDENTED else _generic_tokens(code, language, canonical=False)
+    return exact, _generic_tokens(code, language, canonical=True)
+
+def minhash(tokens: List[str]) -> np.ndarray:
+    shingles = {"\x1f".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    return ((np.outer(_A, hashes) + _B[:, None]) % _PRIME).min(axis=1)
+
+def fingerprint(payload: BaseModel) -> Fingerprint:
+    """Fingerprints a payload with a `code_snippet`; every other field must match exactly for reuse."""
+    language = getattr(payload, "language", None) or "python"
+    exact, canonical = normalize(payload.code_snippet, language)
+    rest = payload.model_dump(exclude={"code_snippet"})
+    source_key = hashlib.sha256(json.dumps([payload.code_snippet, rest], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    # Code that normalization would lose information from only matches itself, as written
+    if exact is None:
+        exact_key = source_key
+    else:
+        exact_key = hashlib.sha256(json.dumps([exact, rest], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return Fingerprint(exact_key, source_key, language.lower(), minhash(canonical))
+
+def starting_point_prompt() -> str:
+    """Prompt section with the previous result for near-identical code, if the run has one."""
+    previous = get_starting_point()
+    if previous is None:
+        return ""
+    return (
+        "**Previous Result for Near-Identical Code** (the same code up to formatting, comments and names; "
+        "adapt it to this snippet and its names instead of starting over):\n"
+        + json.dumps(previous, indent=2, default=str)
+    )
+
+class _Entry:
+    def __init__(self, endpoint: str, fp: Fingerprint, result: Any):
+        self.endpoint = endpoint
+        self.fingerprint = fp
+        self.result = result
+        self.created = time.monotonic()
+
+class FingerprintIndex:
+    """
+    Results of recent crew runs, found again by code fingerprint.
+
+    A snippet whose exact tokens (and other fields) match a previous request reuses
+    that result outright, unless the result quotes the code: then only the same
+    text does. A snippet that only matches after normalization, with an
+    estimated Jaccard similarity of at least `near_threshold` between MinHash
+    signatures, gets the previous result as a starting point for its crew. Candidates
+    come from an LSH index over the signatures, so lookups do not scan the entries.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, near_threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.near_threshold = near_threshold
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, bytes], Set[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _bands(endpoint: str, signature: np.ndarray):
+        for band in range(BANDS):
+            yield (endpoint, band, signature[band * ROWS:(band + 1) * ROWS].tobytes())
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for bucket in self._bands(entry.endpoint, entry.fingerprint.signature):
+            keys = self._buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bucket]
+
+    def _expired(self, entry: _Entry) -> bool:
+        return time.monotonic() - entry.created > self.ttl_seconds
+
+    def lookup(self, endpoint: str, fp: Fingerprint) -> Optional[FingerprintMatch]:
+        with self._lock:
+            for key in dict.fromkeys(((endpoint, fp.source_key), (endpoint, fp.exact_key))):
+                entry = self._entries.get(key)
+                if entry is not None and not self._expired(entry):
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    return FingerprintMatch(True, 1.0, entry.result)
+
+            best, best_similarity = None, 0.0
+            candidates = set()
+            for bucket in self._bands(endpoint, fp.signature):
+                candidates |= self._buckets.get(bucket, set())
+            for candidate in candidates:
+                entry = self._entries[candidate]
+                if entry.fingerprint.language != fp.language or self._expired(entry):
+                    continue
+                similarity = float(np.mean(entry.fingerprint.signature == fp.signature))
+                if similarity > best_similarity:
+                    best, best_similarity = entry, similarity
+            if best is not None and best_similarity >= self.near_threshold:
+                self.near_hits += 1
+                return FingerprintMatch(False, best_similarity, best.result)
+            self.misses += 1
+            return None
+
+    def add(self, endpoint: str, fp: Fingerprint, result: Any):
+        with self._lock:
+            key = (endpoint, fp.key_for(result))
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(endpoint, fp, result)
+            for bucket in self._bands(endpoint, fp.signature):
+                self._buckets.setdefault(bucket, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+        }
+
+fingerprints = FingerprintIndex(
+    max_entries=int(os.environ.get("FINGERPRINT_CACHE_SIZE", 512)),
+    ttl_seconds=float(os.environ.get("FINGERPRINT_TTL_SECONDS", 86400)),
+    near_threshold=float(os.environ.get("FINGERPRINT_NEAR_THRESHOLD", 0.85)),
+)
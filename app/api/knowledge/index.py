@@ -0,0 +1,202 @@
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from glob import glob
+from typing import Dict, List, Optional, Tuple
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+# The package directory may be read-only (App Engine), so the index lives in the temp directory
+INDEX_PATH = os.environ.get("KNOWLEDGE_INDEX_PATH") or os.path.join(tempfile.gettempdir(), "knowledge_index.idx")
+
+MAGIC = b"KBM25v1\0"
+_HEADER_LENGTH = struct.Struct("<I")
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "in", "into",
+    "is", "it", "its", "not", "of", "on", "or", "so", "that", "the", "their", "them", "then", "this", "to",
+    "use", "used", "what", "when", "which", "with", "without", "you", "your",
+}
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("ies"):
+            token = token[:-3] + "y"
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+@dataclass
+class Document:
+    title: str
+    source: str
+    text: str
+
+@dataclass
+class SearchHit:
+    title: str
+    source: str
+    text: str
+    score: float
+
+def load_corpus(corpus_dir: str = CORPUS_DIR) -> List[Document]:
+    """Every '## Title' section of the corpus markdown files is one document."""
+    documents = []
+    for path in sorted(glob(os.path.join(corpus_dir, "*.md"))):
+        source = os.path.splitext(os.path.basename(path))[0]
+        with open(path, encoding="utf-8") as f:
+            sections = re.split(r"^## ", f.read(), flags=re.MULTILINE)[1:]
+        for section in sections:
+            title, _, text = section.partition("\n")
+            documents.append(Document(title.strip(), source, text.strip()))
+    return documents
+
+def corpus_fingerprint(corpus_dir: str = CORPUS_DIR) -> str:
+    digest = hashlib.sha256()
+    for path in sorted(glob(os.path.join(corpus_dir, "*.md"))):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def build_index(documents: List[Document], path: str, fingerprint: str = "", k1: float = 1.5, b: float = 0.75):
+    """
+    Writes a BM25 index as one file: magic, a JSON header (documents, term dictionary
+    with precomputed IDF), then the postings as uint32 (document, term frequency) pairs
+    and the document texts, both read through mmap at query time.
+    """
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    lengths = []
+    for doc_id, document in enumerate(documents):
+        # Titles count twice: a match on "Extract Method" should beat a passing mention
+        tokens = tokenize(document.title) * 2 + tokenize(document.text)
+        lengths.append(len(tokens))
+        for term, frequency in Counter(tokens).items():
+            postings.setdefault(term, []).append((doc_id, frequency))
+
+    postings_blob = array("I")
+    terms = {}
+    for term in sorted(postings):
+        entries = postings[term]
+        idf = math.log(1 + (len(documents) - len(entries) + 0.5) / (len(entries) + 0.5))
+        terms[term] = [len(postings_blob) // 2, len(entries), idf]
+        for doc_id, frequency in entries:
+            postings_blob.extend((doc_id, frequency))
+
+    texts = [document.text.encode("utf-8") for document in documents]
+    docs, offset = [], 0
+    for document, text, length in zip(documents, texts, lengths):
+        docs.append([document.title, document.source, offset, len(text), length])
+        offset += len(text)
+
+    header = json.dumps({
+        "fingerprint": fingerprint,
+        "byteorder": sys.byteorder,
+        "k1": k1,
+        "b": b,
+        "avgdl": sum(lengths) / max(1, len(lengths)),
+        "docs": docs,
+        "terms": terms,
+    }).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + _HEADER_LENGTH.size + len(header)) % 4)  # align the postings
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # Written aside and renamed, so workers building concurrently never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        f.write(postings_blob.tobytes())
+        f.write(b"".join(texts))
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+class KnowledgeIndex:
+    """Read-only BM25 index over a memory-mapped index file."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a knowledge index")
+        (header_length,) = _HEADER_LENGTH.unpack_from(self._mmap, len(MAGIC))
+        start = len(MAGIC) + _HEADER_LENGTH.size
+        header = json.loads(self._mmap[start:start + header_length])
+        self.fingerprint = header["fingerprint"]
+        self.byteorder = header["byteorder"]
+        self.k1 = header["k1"]
+        self.b = header["b"]
+        self.avgdl = header["avgdl"]
+        self.docs = header["docs"]
+        self.terms = header["terms"]
+        postings_start = start + header_length
+        postings_count = sum(count for _, count, _ in self.terms.values())
+        self._postings = memoryview(self._mmap)[postings_start:postings_start + postings_count * 8].cast("I")
+        self._texts_start = postings_start + postings_count * 8
+
+    def __len__(self):
+        return len(self.docs)
+
+    def text(self, doc_id: int) -> str:
+        _, _, offset, length, _ = self.docs[doc_id]
+        start = self._texts_start + offset
+        return self._mmap[start:start + length].decode("utf-8")
+
+    def search(self, query: str, top_k: int = 3) -> List[SearchHit]:
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            offset, count, idf = entry
+            for i in range(offset * 2, (offset + count) * 2, 2):
+                doc_id, frequency = self._postings[i], self._postings[i + 1]
+                norm = self.k1 * (1 - self.b + self.b * self.docs[doc_id][4] / self.avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [SearchHit(self.docs[doc_id][0], self.docs[doc_id][1], self.text(doc_id), score) for doc_id, score in best]
+
+_index: Optional[KnowledgeIndex] = None
+_index_lock = threading.Lock()
+
+def get_knowledge_index(path: str = INDEX_PATH) -> KnowledgeIndex:
+    """Opens the index, (re)building it first when it is missing or older than the corpus."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            fingerprint = corpus_fingerprint()
+            try:
+                index = KnowledgeIndex(path)
+                if index.fingerprint != fingerprint or index.byteorder != sys.byteorder:
+                    index = None
+            except (OSError, ValueError):
+                index = None
+            if index is None:
+                logger.info(f"Building knowledge index at {path}")
+                build_index(load_corpus(), path, fingerprint)
+                index = KnowledgeIndex(path)
+            _index = index
+        return _index
+
+if __name__ == "__main__":
+    documents = load_corpus()
+    build_index(documents, INDEX_PATH, corpus_fingerprint())
+    print(f"Indexed {len(documents)} documents into {INDEX_PATH}")
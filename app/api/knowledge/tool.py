@@ -0,0 +1,58 @@
+import json
+import os
+from functools import lru_cache
+from typing import Any, Callable, Optional
+from langchain_core.tools import BaseTool
+from app.api.knowledge.index import get_knowledge_index
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+MODES = ("local", "remote", "local_first")
+NO_RESULT = "No good Knowledge Base Result was found"
+
+def tool_mode(source: str) -> str:
+    """
+    Where a research tool looks things up. KNOWLEDGE_TOOL_MODE sets the default and
+    KNOWLEDGE_TOOL_MODES overrides it per tool, e.g. '{"wikidata": "local", "arxiv": "local_first"}'.
+    """
+    modes = json.loads(os.environ.get("KNOWLEDGE_TOOL_MODES") or "{}")
+    mode = modes.get(source, os.environ.get("KNOWLEDGE_TOOL_MODE", "remote"))
+    if mode not in MODES:
+        raise ValueError(f"Unknown knowledge tool mode '{mode}' for {source}; expected one of {MODES}")
+    return mode
+
+class KnowledgeTool(BaseTool):
+    """
+    Answers from the local knowledge index under the name and description of the
+    remote tool it stands in for, in the same 'Page: / Summary:' format.
+
+    In `local_first` mode, queries the index cannot answer with a score of at least
+    `min_score` go to the remote tool, and local results are still returned if the
+    remote tool fails.
+    """
+    mode: str = "local"
+    remote: Optional[Callable[[], Any]] = None
+    top_k: int = 3
+    min_score: float = float(os.environ.get("KNOWLEDGE_MIN_SCORE", 5.0))
+
+    def _local(self, query: str):
+        return get_knowledge_index().search(query, self.top_k)
+
+    def _run(self, query: str, run_manager=None) -> str:
+        hits = self._local(query)
+        if self.mode == "local_first" and (not hits or hits[0].score < self.min_score):
+            try:
+                return self.remote().run(query)
+            except Exception as e:
+                logger.warning(f"Remote {self.name} lookup failed, answering locally: {e}")
+        if not hits:
+            return NO_RESULT
+        return "\n\n".join(f"Page: {hit.title}\nSummary: {hit.text}" for hit in hits)
+
+def knowledge_backed(source: str, name: str, description: str, remote: Callable[[], Any]):
+    """The remote tool itself in `remote` mode, otherwise a KnowledgeTool that builds it only when needed."""
+    mode = tool_mode(source)
+    if mode == "remote":
+        return remote()
+    return KnowledgeTool(name=name, description=description, mode=mode, remote=lru_cache(maxsize=None)(remote))
@@ -0,0 +1,218 @@
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from typing import List, Optional
+import openai
+from langchain_openai import ChatOpenAI
+from app.api.batching import BatchRounds, current_batch_rounds
+from app.api.deadlines import current_deadline
+from app.api.llm_backends import Backend, backends
+from app.api.metrics import counters
+from app.api.rate_limiter import get_rate_limiter
+from app.api.request_context import report_usage, resolve_model
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Room reserved in the tokens-per-minute bucket for the completion when the
+# model has no explicit max_tokens.
+DEFAULT_COMPLETION_TOKENS = 1024
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+class CallAbandoned(Exception):
+    """A hedged call that lost its race before it was sent."""
+
+# Hedged calls and the primary calls they race run here, off the crew's thread
+_calls = ThreadPoolExecutor(max_workers=int(os.environ.get("LLM_HEDGE_THREADS", 64)), thread_name_prefix="llm-call")
+
+def estimate_message_tokens(messages) -> int:
+    """Cheap upper-bound estimate (~4 characters per token) used to reserve budget before a call."""
+    return sum(len(str(message.content)) for message in messages) // 4 + 4 * len(messages)
+
+class ManagedChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI whose calls go to the configured backends (see app/api/llm_backends.py)
+    through the shared rate limiter of each backend and model.
+
+    A retryable error fails over to the next backend right away. When every backend
+    failed, the call is retried with jittered backoff, only while the global retry
+    budget allows; the OpenAI client's own retries are disabled.
+
+    Models of a hedged role (`hedge_key`, set by the agent template) hedge against
+    slow completions: once the primary call has taken longer than the role's
+    LLM_HEDGE_PERCENTILE latency, a duplicate goes to the next backend and the first
+    response wins. Hedges never queue for a rate limiter permit and are capped by
+    their own budget. A losing call that was not sent yet is cancelled; one already
+    sent runs to completion and its tokens are counted.
+
+    Under a request deadline (see app/api/deadlines.py), no call or retry starts
+    once the request is cancelled or out of time, and each HTTP call times out
+    when the deadline passes.
+
+    A model routed to one backend (`backend_name`, see app/api/model_config.py)
+    calls that backend alone, without hedging or failover.
+
+    In a bulk run (see app/api/batching.py) calls go to the batch interface of the
+    primary or routed backend instead, without hedging, failover or the rate limiter.
+    """
+    hedge_key: Optional[str] = None
+    backend_name: Optional[str] = None
+
+    def _routed_backend(self) -> Optional[Backend]:
+        if self.backend_name is None:
+            return None
+        backend = backends.get(self.backend_name)
+        if backend is None:
+            logger.warning(f"Backend '{self.backend_name}' is no longer configured; using LLM_BACKENDS")
+        return backend
+
+    def _call(self, backend: Backend, messages, stop, estimated: int, kwargs: dict, timeout: Optional[float],
+              permit_timeout: Optional[float] = None, abandoned: Optional[threading.Event] = None):
+        limiter = get_rate_limiter(backend.limiter_key(self.model_name))
+        with limiter.permit(estimated, timeout=timeout if permit_timeout is None else permit_timeout) as permit:
+            if abandoned is not None and abandoned.is_set():
+                # The race was won while this call waited for its permit
+                counters.inc("llm_hedge_calls_avoided")
+                raise CallAbandoned()
+            started = time.monotonic()
+            try:
+                result = backends.chat_model(backend, self.model_name, self.temperature, self.max_tokens)._generate(
+                    messages, stop=stop, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, openai.RateLimitError):
+                    permit.throttled()
+                backends.failed(backend, e)
+                raise
+            usage = (result.llm_output or {}).get("token_usage") or {}
+            permit.completed(usage.get("total_tokens"))
+            report_usage(usage)
+            backends.succeeded(backend, self.model_name, self.hedge_key, time.monotonic() - started)
+            return result
+
+    def _race(self, primary: Future, call, order: List[Backend], abandoned: threading.Event):
+        """Hedges a slow primary call and returns the first successful response."""
+        target = backends.hedge_target(order)
+        if not backends.hedge_budget.try_spend():
+            counters.inc("llm_hedges_skipped", role=self.hedge_key)
+            return primary.result()
+        counters.inc("llm_hedges_fired", role=self.hedge_key, backend=target.name)
+        hedge = _calls.submit(contextvars.copy_context().run, call, target, permit_timeout=0.0)
+        names = {primary: "primary", hedge: "hedge"}
+        errors = {}
+        pending = set(names)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    errors[names[future]] = future.exception()
+                    continue
+                counters.inc("llm_hedges_won" if future is hedge else "llm_hedges_lost", role=self.hedge_key)
+                abandoned.set()
+                for loser in pending:
+                    # Cancelled if it has not started; otherwise it is abandoned before it is sent, or counted
+                    if not loser.cancel():
+                        loser.add_done_callback(_count_wasted_tokens)
+                return future.result()
+        raise errors.get("primary") or errors["hedge"]
+
+    def _attempt(self, messages, stop, estimated: int, kwargs: dict, timeout: Optional[float]):
+        """One attempt over the backends: hedged on the first one when its role has a latency target, then failing over."""
+        call = functools.partial(self._call, messages=messages, stop=stop, estimated=estimated, kwargs=kwargs, timeout=timeout)
+        routed = self._routed_backend()
+        if routed is not None:
+            return call(routed)
+        order = backends.available()
+        delay = backends.hedge_delay(order[0], self.model_name, self.hedge_key) if self.hedge_key else None
+        if delay is not None and (timeout is None or delay < timeout):
+            abandoned = threading.Event()
+            call = functools.partial(call, abandoned=abandoned)
+            primary = _calls.submit(contextvars.copy_context().run, call, order[0])
+            try:
+                return primary.result(timeout=delay)
+            except FutureTimeoutError:
+                return self._race(primary, call, order, abandoned)
+            except RETRYABLE_ERRORS as e:
+                if len(order) == 1:
+                    raise
+                self._failing_over(order[0], order[1], e)
+                order = order[1:]
+        for i, backend in enumerate(order):
+            try:
+                return call(backend)
+            except RETRYABLE_ERRORS as e:
+                if i == len(order) - 1:
+                    raise
+                self._failing_over(backend, order[i + 1], e)
+
+    def _failing_over(self, source: Backend, target: Backend, error: Exception):
+        counters.inc("llm_failovers", source=source.name, target=target.name)
+        logger.warning(f"Failing over '{self.model_name}' from '{source.name}' to '{target.name}' after {type(error).__name__}")
+
+    def _generate_batched(self, rounds: BatchRounds, messages, stop, kwargs: dict):
+        backend = self._routed_backend() or backends.backends[0]
+        body = self._get_request_payload(messages, stop=stop, **kwargs)
+        body["model"] = backend.model_for(self.model_name)
+        response = rounds.call(backend, body)
+        report_usage(response.get("usage") or {})
+        return self._create_chat_result(response)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        rounds = current_batch_rounds()
+        if rounds is not None:
+            return self._generate_batched(rounds, messages, stop, kwargs)
+        estimated = estimate_message_tokens(messages) + (self.max_tokens or DEFAULT_COMPLETION_TOKENS)
+        deadline = current_deadline()
+        attempt = 0
+        while True:
+            remaining = None
+            if deadline is not None:
+                deadline.check()
+                remaining = max(1.0, deadline.remaining())
+                kwargs["timeout"] = remaining
+            try:
+                return self._attempt(messages, stop, estimated, kwargs, remaining)
+            except RETRYABLE_ERRORS as e:
+                if not get_rate_limiter(self.model_name).retry_budget.try_spend():
+                    logger.error(f"Retry budget exhausted, giving up on '{self.model_name}': {e}")
+                    raise
+                attempt += 1
+                error = e
+            delay = min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+            logger.warning(f"Retrying '{self.model_name}' in {delay:.1f}s after {type(error).__name__}")
+            if deadline is not None:
+                deadline.sleep(delay)
+            else:
+                time.sleep(delay)
+
+def _count_wasted_tokens(future: Future):
+    if future.exception() is None:
+        usage = (future.result().llm_output or {}).get("token_usage") or {}
+        counters.inc("llm_hedge_tokens_wasted", usage.get("total_tokens", 0))
+
+_chat_models = {}
+_chat_models_lock = threading.Lock()
+
+def get_chat_model(model: str, temperature: float = 0, hedge_key: Optional[str] = None,
+                   backend: Optional[str] = None) -> ChatOpenAI:
+    """
+    Managed chat model for `model`, after any per-request override (see admission
+    downgrades), hedged with the latencies of `hedge_key` if given, on `backend`
+    alone if given. Clients are stateless and thread-safe, so one per model,
+    temperature, hedge key and backend is shared by every agent in the process.
+    """
+    key = (resolve_model(model), temperature, hedge_key, backend)
+    with _chat_models_lock:
+        if key not in _chat_models:
+            _chat_models[key] = ManagedChatOpenAI(model=key[0], temperature=temperature, max_retries=0,
+                                                  hedge_key=hedge_key, backend_name=backend)
+        return _chat_models[key]
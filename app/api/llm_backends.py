@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+from langchain_openai import ChatOpenAI
+from app.api.rate_limiter import RetryBudget, get_shared_store
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# OpenAI-compatible endpoints, in order of preference. The first one is the primary;
+# the others take failover and hedged calls. `models` renames models on an endpoint,
+# so an entry can also stand for a backup model, e.g.
+# '[{"name": "openai"}, {"name": "backup", "base_url": "http://localhost:9002/v1", "api_key_env": "BACKUP_OPENAI_API_KEY"}]'
+# Backends defined in the model config file (see app/api/model_config.py) are not in
+# this order: only the roles routed to them call them.
+DEFAULT_BACKENDS = [{"name": "openai"}]
+
+@dataclass
+class Backend:
+    name: str
+    base_url: Optional[str] = None
+    api_key_env: str = "OPENAI_API_KEY"
+    models: Dict[str, str] = field(default_factory=dict)
+    primary: bool = False
+    cooling_until: float = 0.0
+    calls: int = 0
+    failures: int = 0
+
+    def model_for(self, model: str) -> str:
+        return self.models.get(model, model)
+
+    def limiter_key(self, model: str) -> str:
+        """The primary shares the plain per-model buckets; other backends have their own."""
+        served = self.model_for(model)
+        return served if self.primary else f"{self.name}/{served}"
+
+class LatencyWindow:
+    """The most recent latencies of one kind of call, for percentiles."""
+
+    def __init__(self, size: int):
+        self._values: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._values.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        values = sorted(self._values)
+        if len(values) < max(1, min_samples):
+            return None
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    def __len__(self):
+        return len(self._values)
+
+class LLMBackends:
+    """
+    The endpoints chat models call, and what calls learn about them.
+
+    A backend that fails with a retryable error cools down for `cooldown_seconds`,
+    during which it is tried last. Successful calls of a hedged role record their
+    latency per backend and model; once `hedge_min_samples` are in, the role's
+    `hedge_percentile` latency (at least `hedge_min_delay` seconds) is how long a
+    call waits before a duplicate is sent to the next backend.
+    """
+
+    def __init__(self, backends: List[Backend], cooldown_seconds: float, hedge_percentile: float,
+                 hedge_min_samples: int, hedge_min_delay: float, window: int):
+        if not backends:
+            raise ValueError("At least one LLM backend is required")
+        backends[0].primary = True
+        self.backends = backends
+        self.routed: Dict[str, Backend] = {}
+        self.cooldown_seconds = cooldown_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.window = window
+        self._models: Dict[Tuple[str, Optional[str], str, str, float, Optional[int]], ChatOpenAI] = {}
+        self._latencies: Dict[Tuple[str, str, str], LatencyWindow] = {}
+        self._hedge_budget: Optional[RetryBudget] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "LLMBackends":
+        configured = json.loads(os.environ["LLM_BACKENDS"]) if os.environ.get("LLM_BACKENDS") else DEFAULT_BACKENDS
+        return cls(
+            [Backend(**entry) for entry in configured],
+            cooldown_seconds=float(os.environ.get("LLM_BACKEND_COOLDOWN_SECONDS", 30)),
+            hedge_percentile=float(os.environ.get("LLM_HEDGE_PERCENTILE", 95)),
+            hedge_min_samples=int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", 20)),
+            hedge_min_delay=float(os.environ.get("LLM_HEDGE_MIN_DELAY_SECONDS", 2)),
+            window=int(os.environ.get("LLM_HEDGE_WINDOW", 200)),
+        )
+
+    @property
+    def hedge_budget(self) -> RetryBudget:
+        """Instance-wide cap on hedges: each hedged-role call deposits LLM_HEDGE_RATIO of a hedge."""
+        with self._lock:
+            if self._hedge_budget is None:
+                self._hedge_budget = RetryBudget(
+                    get_shared_store(),
+                    per_minute=float(os.environ.get("LLM_HEDGE_BUDGET_PER_MINUTE", 10)),
+                    ratio=float(os.environ.get("LLM_HEDGE_RATIO", 0.1)),
+                    key="hedge-budget",
+                )
+            return self._hedge_budget
+
+    def available(self) -> List[Backend]:
+        """Backends in order of preference, those cooling down after a failure last."""
+        now = time.monotonic()
+        return sorted(self.backends, key=lambda backend: backend.cooling_until > now)
+
+    def set_routed(self, routed: List[Backend]):
+        """Replaces the model config file's backends, keeping the call counts of those it still defines."""
+        for backend in routed:
+            previous = self.routed.get(backend.name)
+            if previous is not None:
+                backend.calls, backend.failures = previous.calls, previous.failures
+        self.routed = {backend.name: backend for backend in routed}
+
+    def get(self, name: str) -> Optional[Backend]:
+        return self.routed.get(name) or next((backend for backend in self.backends if backend.name == name), None)
+
+    def hedge_target(self, order: List[Backend]) -> Backend:
+        return order[1] if len(order) > 1 else order[0]
+
+    def chat_model(self, backend: Backend, model: str, temperature: float, max_tokens: Optional[int]) -> ChatOpenAI:
+        # Reloaded backends may point elsewhere under the same name
+        key = (backend.name, backend.base_url, backend.api_key_env, model, temperature, max_tokens)
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = ChatOpenAI(
+                    model=backend.model_for(model), temperature=temperature, max_tokens=max_tokens,
+                    base_url=backend.base_url, api_key=os.environ.get(backend.api_key_env), max_retries=0,
+                )
+            return self._models[key]
+
+    def _window(self, backend: Backend, model: str, role: str) -> LatencyWindow:
+        key = (backend.name, backend.model_for(model), role)
+        with self._lock:
+            if key not in self._latencies:
+                self._latencies[key] = LatencyWindow(self.window)
+            return self._latencies[key]
+
+    def succeeded(self, backend: Backend, model: str, role: Optional[str], seconds: float):
+        backend.calls += 1
+        backend.cooling_until = 0.0
+        if role is not None:
+            self._window(backend, model, role).add(seconds)
+            self.hedge_budget.deposit()
+
+    def failed(self, backend: Backend, error: Exception):
+        backend.calls += 1
+        backend.failures += 1
+        backend.cooling_until = time.monotonic() + self.cooldown_seconds
+        logger.warning(f"LLM backend '{backend.name}' failed with {type(error).__name__}, deprioritized for {self.cooldown_seconds:.0f}s")
+
+    def hedge_delay(self, backend: Backend, model: str, role: str) -> Optional[float]:
+        latency = self._window(backend, model, role).percentile(self.hedge_percentile, self.hedge_min_samples)
+        return None if latency is None else max(self.hedge_min_delay, latency)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            latencies = dict(self._latencies)
+        return {
+            "backends": [{
+                "name": backend.name,
+                "base_url": backend.base_url,
+                "calls": backend.calls,
+                "failures": backend.failures,
+                "cooling_down": backend.cooling_until > now,
+                "routed": backend.name in self.routed,
+            } for backend in [*self.backends, *self.routed.values()]],
+            "latencies": [{
+                "backend": name,
+                "model": model,
+                "role": role,
+                "samples": len(window),
+                "p50_seconds": window.percentile(50),
+                f"p{self.hedge_percentile:g}_seconds": window.percentile(self.hedge_percentile),
+            } for (name, model, role), window in sorted(latencies.items())],
+        }
+
+backends = LLMBackends.from_env()
@@ -1,15 +1,76 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
 
 # Global variable to track logger configuration state
 logger_configured = False
 
+# Records are handed to a background thread through this queue, so the request
+# path never waits on stdout.
+_log_queue = queue.SimpleQueue()
+_listener = None
+
+_STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the `severity` and `message` keys that Cloud
+    Logging recognizes. Values passed through `extra=` become top-level fields.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def _start_listener():
+    global _listener, logger_configured
+    handler = logging.StreamHandler()
+    if os.environ.get("LOG_FORMAT", "json") == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    _listener = logging.handlers.QueueListener(_log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    logger_configured = True
+
+def _restart_listener_after_fork():
+    # Threads do not survive fork; preloaded gunicorn workers need their own listener
+    global _listener
+    if _listener is not None:
+        # Records still queued at fork time belong to the parent, which writes them
+        while not _log_queue.empty():
+            _log_queue.get_nowait()
+        _listener = logging.handlers.QueueListener(_log_queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
 def setup_logger(name=__name__):
     """
     Sets up a logger based on the environment.
 
-    If the environment variable ENV_TYPE is set to 'sandbox' or 'production', it configures
-    Google Cloud Logging. Otherwise, it uses the standard logging.
+    Records are queued and written to stdout by a background listener thread,
+    formatted as JSON (LOG_FORMAT=json, the default) or plain text (LOG_FORMAT=text),
+    at the level given by LOG_LEVEL (INFO by default).
 
     Parameters:
     name (str): The name of the logger.
@@ -17,20 +78,51 @@ def setup_logger(name=__name__):
     Returns:
     logging.Logger: Configured logger.
     """
-    global logger_configured
     env_type = os.environ.get('ENV_TYPE', 'undefined')
     project = os.environ.get('PROJECT_ID', 'undefined')
 
     # Obtain a reference to the logger
     logger = logging.getLogger(name)
-    
+
     # Check if the logger is already configured
     if not logger.handlers:
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        logger.setLevel(logging.DEBUG)
-        logger.propagate = True
-
-    return logger
\ No newline at end of file
+        if not logger_configured:
+            _start_listener()
+        logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+        logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+        # The listener already writes every record; propagating would write it again, synchronously
+        logger.propagate = False
+
+    return logger
+
+_crew_trace: ContextVar[bool] = ContextVar("crew_trace", default=False)
+
+def sample_crew_trace(requested: Optional[str] = None) -> bool:
+    """
+    Decides whether a request gets full CrewAI verbose traces.
+
+    A request of an admin tenant can ask explicitly with the X-Crew-Trace header
+    ("1"/"0"), which the caller passes as `requested`. Otherwise
+    CREW_VERBOSE decides: "always", "never" or "sampled" (the default), which
+    traces a CREW_TRACE_SAMPLE_RATE fraction of requests (1% by default).
+    """
+    if requested is not None:
+        return requested.lower() in ("1", "true", "yes")
+    mode = os.environ.get("CREW_VERBOSE", "sampled")
+    if mode == "always":
+        return True
+    if mode == "never":
+        return False
+    return random.random() < float(os.environ.get("CREW_TRACE_SAMPLE_RATE", 0.01))
+
+@contextmanager
+def crew_trace(enabled: bool):
+    token = _crew_trace.set(enabled)
+    try:
+        yield
+    finally:
+        _crew_trace.reset(token)
+
+def crew_verbose() -> bool:
+    """Verbosity for agents and crews built in the current request."""
+    return _crew_trace.get()
@@ -0,0 +1,27 @@
+import threading
+from collections import defaultdict
+from typing import Dict
+
+class Counters:
+    """Process-wide counters, keyed by name and labels, e.g. `tokens_saved{endpoint=/refactoring-assistant}`."""
+
+    def __init__(self):
+        self._values: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, str]) -> str:
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{label}={value}" for label, value in sorted(labels.items())) + "}"
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] += value
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {key: round(value, 6) for key, value in sorted(self._values.items())}
+
+counters = Counters()
@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from app.api.llm_backends import Backend, backends
+from app.api.metrics import counters
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Which model, on which backend, each agent role uses, by endpoint. LLM_MODEL_CONFIG
+# names a JSON file, e.g.
+# {
+#   "backends": [{"name": "local", "base_url": "http://localhost:8080/v1", "api_key_env": "LOCAL_LLM_API_KEY"}],
+#   "roles": {"Code Parser": {"model": "qwen2.5-coder-7b-instruct", "backend": "local"}},
+#   "endpoints": {"/full-review": {"Documentation Writer": {"model": "gpt-4o-mini"}}}
+# }
+# An endpoint's entry wins over the role's, which wins over the agent template. A route
+# without a backend uses LLM_BACKENDS in order; one with a backend, from the file or
+# from LLM_BACKENDS by name, calls it alone. The file is read again when it changes.
+
+@dataclass(frozen=True)
+class Route:
+    model: Optional[str] = None
+    backend: Optional[str] = None
+
+@dataclass(frozen=True)
+class ModelConfig:
+    roles: Dict[str, Route]
+    endpoints: Dict[str, Dict[str, Route]]
+    backends: List[Backend]
+
+    @classmethod
+    def parse(cls, raw: dict) -> "ModelConfig":
+        """Raises ValueError on anything it cannot route, so a bad edit never replaces a working file."""
+        if not isinstance(raw, dict):
+            raise ValueError(f"Expected an object, got {type(raw).__name__}")
+        unknown = set(raw) - {"backends", "roles", "endpoints"}
+        if unknown:
+            raise ValueError(f"Unknown keys {sorted(unknown)}")
+        def expect(where: str, value, kind: type):
+            if not isinstance(value, kind):
+                raise ValueError(f"{where} must be an {'array' if kind is list else 'object'}, got {type(value).__name__}")
+            return value
+
+        routed = [Backend(**expect("A backend", entry, dict)) for entry in expect("backends", raw.get("backends", []), list)]
+        names = [backend.name for backend in routed]
+        clashes = set(names) & {backend.name for backend in backends.backends}
+        if clashes or len(set(names)) != len(names):
+            raise ValueError(f"Backend names must be unique and not in LLM_BACKENDS: {sorted(clashes) or names}")
+        known = set(names) | {backend.name for backend in backends.backends}
+
+        def route(where: str, entry: dict) -> Route:
+            route = Route(**expect(where, entry, dict))
+            if route.backend is not None and route.backend not in known:
+                raise ValueError(f"{where} routes to unknown backend '{route.backend}'")
+            return route
+
+        return cls(
+            roles={role: route(role, entry) for role, entry in expect("roles", raw.get("roles", {}), dict).items()},
+            endpoints={
+                endpoint: {role: route(f"{endpoint} {role}", entry) for role, entry in expect(endpoint, roles, dict).items()}
+                for endpoint, roles in expect("endpoints", raw.get("endpoints", {}), dict).items()
+            },
+            backends=routed,
+        )
+
+    def route(self, endpoint: Optional[str], role: str) -> Optional[Route]:
+        return self.endpoints.get(endpoint, {}).get(role) or self.roles.get(role)
+
+EMPTY = ModelConfig(roles={}, endpoints={}, backends=[])
+
+class ModelRouting:
+    """
+    The routes in the LLM_MODEL_CONFIG file, reloaded when it changes.
+
+    Lookups check the file's modification time at most every `check_seconds`. A
+    file that does not parse or routes to an unknown backend is logged and the
+    previous routes stay in place. Agents pick their route when they are bound,
+    so a reload applies from the next crew run on.
+    """
+
+    def __init__(self, path: Optional[str], check_seconds: float):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.config = EMPTY
+        self.loaded_at: Optional[float] = None
+        self.reloads = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        if path:
+            self.reload()
+
+    @classmethod
+    def from_env(cls) -> "ModelRouting":
+        return cls(
+            path=os.environ.get("LLM_MODEL_CONFIG") or None,
+            check_seconds=float(os.environ.get("LLM_MODEL_CONFIG_CHECK_SECONDS", 5)),
+        )
+
+    def reload(self) -> bool:
+        """Reads the file if it changed since the last load; returns whether the routes changed."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if mtime == self._mtime:
+                    return False
+                with open(self.path) as f:
+                    config = ModelConfig.parse(json.load(f))
+            except (OSError, ValueError, TypeError) as e:
+                # TypeError: an entry with fields Route or Backend do not have
+                if self.last_error != str(e):
+                    logger.error(f"Could not load model config {self.path}, keeping the previous routes: {e}")
+                    counters.inc("model_config_errors")
+                    self.errors += 1
+                self.last_error = str(e)
+                return False
+            backends.set_routed(config.backends)
+            self.config = config
+            self._mtime = mtime
+            self.loaded_at = time.time()
+            self.last_error = None
+            self.reloads += 1
+            counters.inc("model_config_reloads")
+            logger.info(f"Loaded model config {self.path}: {len(config.roles)} role and "
+                        f"{sum(len(roles) for roles in config.endpoints.values())} endpoint routes, "
+                        f"{len(config.backends)} backends")
+            return True
+
+    def route(self, endpoint: Optional[str], role: str) -> Optional[Route]:
+        if self.path and time.monotonic() - self._checked_at >= self.check_seconds:
+            self.reload()
+        return self.config.route(endpoint, role)
+
+    def model_for(self, endpoint: Optional[str], role: str, default: str) -> str:
+        route = self.route(endpoint, role)
+        return route.model if route is not None and route.model else default
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "roles": {role: vars(route) for role, route in self.config.roles.items()},
+            "endpoints": {endpoint: {role: vars(route) for role, route in roles.items()}
+                          for endpoint, roles in self.config.endpoints.items()},
+        }
+
+model_routing = ModelRouting.from_env()
@@ -0,0 +1,123 @@
+import ast
+import difflib
+from typing import List, Optional, Tuple
+from pydantic import ValidationError
+from app.api.schemas.patch_schema import CodeEdit
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+DIFF_INSTRUCTIONS = """Do not rewrite the whole file. Return only the changes, as a list of `edits`.
+                Each edit replaces lines `start_line` to `end_line` (1-based and inclusive, as numbered in the code below)
+                whose current text is `original` with `replacement`, without the line number prefixes.
+                To insert lines without replacing any, set `end_line` to `start_line - 1` and `original` to an empty string.
+                Keep edits small and do not let them overlap."""
+
+def number_lines(code: str) -> str:
+    lines = code.splitlines()
+    width = len(str(len(lines)))
+    return "\n".join(f"{number:>{width}} | {line}" for number, line in enumerate(lines, start=1))
+
+def _same(a: List[str], b: List[str]) -> bool:
+    return [line.rstrip() for line in a] == [line.rstrip() for line in b]
+
+def _locate(lines: List[str], edit: CodeEdit) -> Tuple[int, int]:
+    """
+    Returns the 0-based [start, end) range the edit applies to. The stated line
+    numbers win when `original` matches there; otherwise `original` must occur
+    exactly once in the file, since models often miscount lines.
+    """
+    original = edit.original.splitlines()
+    start = edit.start_line - 1
+    if not original:
+        if edit.end_line != edit.start_line - 1 or not 0 <= start <= len(lines):
+            raise ValueError(f"insertion at line {edit.start_line} must have end_line {edit.start_line - 1}")
+        return start, start
+    end = edit.end_line
+    if 0 <= start < end <= len(lines) and _same(lines[start:end], original):
+        return start, end
+    matches = [i for i in range(len(lines) - len(original) + 1) if _same(lines[i:i + len(original)], original)]
+    if len(matches) != 1:
+        found = "not found" if not matches else f"found {len(matches)} times"
+        raise ValueError(f"lines {edit.start_line}-{edit.end_line} do not match `original`, which is {found} elsewhere")
+    return matches[0], matches[0] + len(original)
+
+def apply_edits(source: str, edits: List[CodeEdit], numbers: Optional[List[int]] = None) -> Tuple[str, List[str]]:
+    """
+    Applies the edits that verify against `source` and returns the patched code
+    and a description of each rejected edit, by its number in `numbers` (1, 2, ...
+    by default). Overlapping edits are rejected after the first, in order. An
+    insertion at the first line of a replaced range goes before the replacement,
+    whichever edit comes first.
+    """
+    lines = source.splitlines()
+    located, errors = [], []
+    for number, edit in zip(numbers or range(1, len(edits) + 1), edits):
+        try:
+            start, end = _locate(lines, edit)
+        except ValueError as e:
+            errors.append(f"Edit {number}: {e}")
+            continue
+        if any(start < other_end and other_start < end or start == end == other_start == other_end
+               for other_start, other_end, _ in located):
+            errors.append(f"Edit {number}: overlaps an earlier edit")
+            continue
+        located.append((start, end, edit))
+    # From the bottom up, so earlier line numbers stay valid; at the same line the replacement goes first
+    for start, end, edit in sorted(located, key=lambda item: (item[0], item[1]), reverse=True):
+        lines[start:end] = edit.replacement.splitlines()
+    patched = "\n".join(lines)
+    if source.endswith("\n"):
+        patched += "\n"
+    return patched, errors
+
+def unified_diff(before: str, after: str, name: str = "code") -> str:
+    return "".join(difflib.unified_diff(
+        before.splitlines(keepends=True), after.splitlines(keepends=True),
+        fromfile=f"a/{name}", tofile=f"b/{name}",
+    ))
+
+def _parses(code: str) -> bool:
+    try:
+        ast.parse(code)
+        return True
+    except (SyntaxError, ValueError):
+        return False
+
+def patched_output(source: str, language: str, output: dict) -> dict:
+    """
+    Turns a crew's diff-mode output into the full-mode response: `edits` are
+    verified and applied to `source`, and the response carries the full
+    `code_snippet`, a unified diff in `patch`, and `patch_errors` for edits that
+    could not be applied. Python that parsed before and no longer does after the
+    patch is returned unchanged, with the reason in `patch_errors`.
+    """
+    output = dict(output)
+    raw_edits = output.pop("edits", None) or []
+    edits, numbers, errors = [], [], []
+    if not isinstance(raw_edits, list):
+        errors.append(f"`edits` must be a list of edits, not {type(raw_edits).__name__}")
+        raw_edits = []
+    for number, raw in enumerate(raw_edits, start=1):
+        if not isinstance(raw, dict):
+            errors.append(f"Edit {number}: must be an object, not {type(raw).__name__}")
+            continue
+        try:
+            edits.append(CodeEdit.model_validate(raw))
+            numbers.append(number)
+        except ValidationError as e:
+            errors.append(f"Edit {number}: {e.errors()[0]['msg']}")
+    patched, rejected = apply_edits(source, edits, numbers)
+    errors.extend(rejected)
+    if language.lower() in ("python", "py") and _parses(source) and not _parses(patched):
+        errors.append("The patched code is not valid Python; no edits were applied")
+        patched = source
+    if errors:
+        logger.warning(f"Patch problems ({len(raw_edits)} edits): {errors}")
+    extension = {"python": "py", "javascript": "js", "typescript": "ts"}.get(language.lower(), language.lower())
+    return {
+        "code_snippet": patched,
+        **output,
+        "patch": unified_diff(source, patched, f"code.{extension}"),
+        "patch_errors": errors,
+    }
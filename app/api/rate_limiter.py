@@ -0,0 +1,339 @@
+import json
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Published provider ceilings per model. Override with LLM_RATE_LIMITS, e.g.
+# '{"gpt-4o": {"rpm": 5000, "tpm": 800000}}'
+DEFAULT_RATE_LIMITS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+}
+FALLBACK_RATE_LIMIT = {"rpm": 500, "tpm": 30000}
+
+class UpstreamCapacityError(Exception):
+    """
+    Raised when an LLM call could not get a permit before its queue timeout.
+    `retry_after` is when the limiter expects to have capacity again: when the
+    model's buckets refill, or one queue timeout when its concurrency slots ran out.
+    """
+
+    def __init__(self, model: str, waited: float, retry_after: float):
+        self.model = model
+        self.waited = waited
+        self.retry_after = retry_after
+        super().__init__(f"Upstream capacity for '{model}' exhausted after waiting {waited:.1f}s")
+
+    @property
+    def headers(self) -> dict:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+class SharedBucketStore:
+    """
+    Token buckets persisted in a local SQLite file so that every worker process
+    on the instance draws from the same budget.
+
+    Each bucket refills continuously at `rate` tokens per second up to `capacity`.
+    Connections are opened lazily per process and thread, so the store is safe to
+    create before the server forks its workers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _level(conn, key, capacity, rate, now):
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return capacity
+        tokens, updated = row
+        return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+    @staticmethod
+    def _store(conn, key, tokens, now):
+        conn.execute(
+            "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+            (key, tokens, now),
+        )
+
+    def try_consume(self, requests):
+        """
+        Atomically takes tokens from several buckets.
+
+        Parameters:
+        requests (list): (key, amount, capacity, rate) tuples.
+
+        Returns:
+        float: 0 when every bucket had enough tokens and all were debited, otherwise
+        the number of seconds until the emptiest bucket can cover its request.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            levels = {}
+            wait = 0.0
+            for key, amount, capacity, rate in requests:
+                level = self._level(conn, key, capacity, rate, now)
+                levels[key] = level
+                amount = min(amount, capacity)
+                if level < amount:
+                    wait = max(wait, (amount - level) / rate if rate > 0 else float("inf"))
+            if wait > 0:
+                return wait
+            for key, amount, capacity, _ in requests:
+                self._store(conn, key, levels[key] - min(amount, capacity), now)
+        return 0.0
+
+    def adjust(self, key, delta, capacity, rate):
+        """Credits (positive) or debits (negative) a bucket without blocking; debits may go negative."""
+        now = time.time()
+        with self._transaction() as conn:
+            level = self._level(conn, key, capacity, rate, now)
+            self._store(conn, key, min(capacity, level + delta), now)
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit for one model within a worker process.
+
+    Every call that finishes within `latency_factor` times the smoothed latency grows
+    the limit by 1/limit (roughly +1 per window); a throttled or unusually slow call
+    cuts it multiplicatively. Calls faster than `min_latency` seconds never count as slow.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=64, backoff=0.5, latency_factor=3.0, min_latency=1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.min_latency = min_latency
+        self._limit = float(initial)
+        self._in_flight = 0
+        self.waiting = 0
+        self._baseline_latency = None
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return max(self.minimum, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self._in_flight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self._in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def on_success(self, latency: float):
+        with self._cond:
+            baseline = self._baseline_latency
+            if baseline is not None and latency > max(self.min_latency, baseline * self.latency_factor):
+                self._limit = max(self.minimum, self._limit * (1 - (1 - self.backoff) / 2))
+            else:
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+            self._baseline_latency = latency if baseline is None else 0.9 * baseline + 0.1 * latency
+            self._cond.notify_all()
+
+    def on_throttle(self):
+        with self._cond:
+            self._limit = max(self.minimum, self._limit * self.backoff)
+
+class RetryBudget:
+    """
+    Global cap on retries shared by all workers.
+
+    The budget refills at `per_minute` retries per minute, and each successful call
+    deposits `ratio` of a retry, so retries stay a bounded fraction of traffic
+    instead of multiplying a burst. Hedged calls have a budget of their own under
+    another `key`.
+    """
+
+    def __init__(self, store: SharedBucketStore, per_minute=30.0, ratio=0.1, capacity=20.0, key="retry-budget"):
+        self.store = store
+        self.key = key
+        self.rate = per_minute / 60.0
+        self.ratio = ratio
+        self.capacity = capacity
+
+    def deposit(self):
+        self.store.adjust(self.key, self.ratio, self.capacity, self.rate)
+
+    def try_spend(self) -> bool:
+        return self.store.try_consume([(self.key, 1.0, self.capacity, self.rate)]) == 0.0
+
+class ModelRateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute buckets for one model, shared across
+    processes, in front of an adaptive per-process concurrency limit.
+    """
+
+    def __init__(self, model: str, rpm: float, tpm: float, store: SharedBucketStore,
+                 retry_budget: RetryBudget, queue_timeout: float = 30.0):
+        self.model = model
+        self.rpm = rpm
+        self.tpm = tpm
+        self.store = store
+        self.retry_budget = retry_budget
+        self.queue_timeout = queue_timeout
+        self.concurrency = AdaptiveConcurrencyLimiter()
+
+    def _buckets(self, tokens):
+        return [
+            (f"{self.model}:rpm", 1.0, self.rpm, self.rpm / 60.0),
+            (f"{self.model}:tpm", float(tokens), self.tpm, self.tpm / 60.0),
+        ]
+
+    @contextmanager
+    def permit(self, estimated_tokens: int, timeout: Optional[float] = None):
+        """
+        Blocks until the model has a concurrency slot and enough request and token
+        budget for `estimated_tokens`, queueing for at most `queue_timeout` seconds,
+        or `timeout` if that is shorter.
+        """
+        queue_timeout = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+        started = time.monotonic()
+        deadline = started + queue_timeout
+        if not self.concurrency.acquire(queue_timeout):
+            raise UpstreamCapacityError(self.model, time.monotonic() - started, self.queue_timeout)
+        try:
+            while True:
+                wait = self.store.try_consume(self._buckets(estimated_tokens))
+                if wait == 0:
+                    break
+                if time.monotonic() + wait > deadline:
+                    raise UpstreamCapacityError(self.model, time.monotonic() - started, wait)
+                time.sleep(min(wait, 1.0))
+            permit = _Permit(self, estimated_tokens)
+            yield permit
+        finally:
+            self.concurrency.release()
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Corrects the token bucket once the provider reports real usage."""
+        delta = estimated_tokens - actual_tokens
+        if delta:
+            self.store.adjust(f"{self.model}:tpm", delta, self.tpm, self.tpm / 60.0)
+
+class _Permit:
+    def __init__(self, limiter: ModelRateLimiter, estimated_tokens: int):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.started = time.monotonic()
+
+    def completed(self, actual_tokens=None):
+        self.limiter.concurrency.on_success(time.monotonic() - self.started)
+        self.limiter.retry_budget.deposit()
+        if actual_tokens is not None:
+            self.limiter.settle(self.estimated_tokens, actual_tokens)
+
+    def throttled(self):
+        self.limiter.concurrency.on_throttle()
+        logger.warning(f"Upstream throttled '{self.limiter.model}', concurrency limit now {self.limiter.concurrency.limit}")
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_store = None
+_retry_budget = None
+
+def _configured_limits():
+    limits = dict(DEFAULT_RATE_LIMITS)
+    raw = os.environ.get("LLM_RATE_LIMITS")
+    if raw:
+        limits.update(json.loads(raw))
+    return limits
+
+def get_shared_store() -> SharedBucketStore:
+    """The instance-wide bucket store (LLM_RATE_LIMIT_DB, a file in the temp directory by default)."""
+    global _store, _retry_budget
+    with _limiters_lock:
+        if _store is None:
+            path = os.environ.get("LLM_RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "llm_rate_limits.sqlite3"))
+            _store = SharedBucketStore(path)
+            _retry_budget = RetryBudget(
+                _store,
+                per_minute=float(os.environ.get("LLM_RETRY_BUDGET_PER_MINUTE", 30)),
+                ratio=float(os.environ.get("LLM_RETRY_BUDGET_RATIO", 0.1)),
+            )
+        return _store
+
+def get_rate_limiter(model: str) -> ModelRateLimiter:
+    """
+    Returns the process-wide limiter for `model`.
+
+    Limits are divided by LLM_RATE_LIMIT_INSTANCES so that several instances, each
+    with its own local store, stay under the provider ceiling together.
+    """
+    store = get_shared_store()
+    with _limiters_lock:
+        if model not in _limiters:
+            instances = max(1, int(os.environ.get("LLM_RATE_LIMIT_INSTANCES", 1)))
+            # Limiters of secondary backends are keyed "backend/model" and default to the model's limits
+            limits = _configured_limits()
+            limit = limits.get(model) or limits.get(model.rsplit("/", 1)[-1], FALLBACK_RATE_LIMIT)
+            _limiters[model] = ModelRateLimiter(
+                model,
+                rpm=limit["rpm"] / instances,
+                tpm=limit["tpm"] / instances,
+                store=store,
+                retry_budget=_retry_budget,
+                queue_timeout=float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", 30)),
+            )
+        return _limiters[model]
+
+def limiter_stats() -> dict:
+    """Concurrency limit, calls in flight and calls waiting for each model's limiter."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {
+        limiter.model: {"limit": limiter.concurrency.limit, "in_flight": limiter.concurrency.in_flight, "waiting": limiter.concurrency.waiting}
+        for limiter in limiters
+    }
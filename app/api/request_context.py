@@ -0,0 +1,148 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+
+class StageUsage:
+    """Usage of one crew task (stage), attributed to the agent role that ran it."""
+
+    def __init__(self):
+        self.role: Optional[str] = None
+        self.llm_calls = 0
+        self.tool_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.seconds = 0.0
+
+class UsageRecorder:
+    """Accumulates the LLM token usage of everything run inside a `record_usage()` block."""
+
+    def __init__(self):
+        self.llm_calls = 0
+        self.tool_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.stages: List[StageUsage] = [StageUsage()]
+        self._stage_started = time.monotonic()
+
+    def add(self, token_usage: dict):
+        self.llm_calls += 1
+        self.prompt_tokens += token_usage.get("prompt_tokens", 0)
+        self.completion_tokens += token_usage.get("completion_tokens", 0)
+        self.total_tokens += token_usage.get("total_tokens", 0)
+        stage = self.stages[-1]
+        stage.llm_calls += 1
+        stage.prompt_tokens += token_usage.get("prompt_tokens", 0)
+        stage.completion_tokens += token_usage.get("completion_tokens", 0)
+
+    def add_tool_call(self):
+        self.tool_calls += 1
+        self.stages[-1].tool_calls += 1
+
+    def complete_stage(self, role: str):
+        now = time.monotonic()
+        stage = self.stages[-1]
+        stage.role = role
+        stage.seconds = now - self._stage_started
+        self.stages.append(StageUsage())
+        self._stage_started = now
+
+    def merge(self, other: "UsageRecorder"):
+        """Adds the usage and completed stages of another recorder, e.g. of a branch run concurrently."""
+        self.llm_calls += other.llm_calls
+        self.tool_calls += other.tool_calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.total_tokens += other.total_tokens
+        self.stages[-1:-1] = other.completed_stages
+
+    @property
+    def completed_stages(self) -> List[StageUsage]:
+        return self.stages[:-1]
+
+_usage: ContextVar[Optional[UsageRecorder]] = ContextVar("usage", default=None)
+_model_overrides: ContextVar[Dict[str, str]] = ContextVar("model_overrides", default={})
+
+@contextmanager
+def record_usage():
+    """
+    Collects token usage reported by LLM calls made in this context, including calls
+    made from threads started with `asyncio.to_thread`, which copy the context.
+    """
+    recorder = UsageRecorder()
+    token = _usage.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _usage.reset(token)
+
+def report_usage(token_usage: dict):
+    recorder = _usage.get()
+    if recorder is not None:
+        recorder.add(token_usage)
+
+def current_usage() -> Optional[UsageRecorder]:
+    return _usage.get()
+
+class ToolUsageCallback(BaseCallbackHandler):
+    """Counts each tool call an agent makes against the current stage."""
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        recorder = _usage.get()
+        if recorder is not None:
+            recorder.add_tool_call()
+
+tool_usage_callback = ToolUsageCallback()
+
+def merge_usage(other: UsageRecorder):
+    recorder = _usage.get()
+    if recorder is not None:
+        recorder.merge(other)
+
+def stage_completed(task_output):
+    """Crew `task_callback`: closes the current stage so usage is attributed per agent."""
+    recorder = _usage.get()
+    if recorder is not None:
+        recorder.complete_stage(task_output.agent)
+
+@contextmanager
+def model_overrides(overrides: Dict[str, str]):
+    """Replaces models (e.g. {"gpt-4o": "gpt-4o-mini"}) for chat models built in this context."""
+    token = _model_overrides.set(overrides)
+    try:
+        yield
+    finally:
+        _model_overrides.reset(token)
+
+def resolve_model(model: str) -> str:
+    return _model_overrides.get().get(model, model)
+
+_endpoint: ContextVar[Optional[str]] = ContextVar("endpoint", default=None)
+
+@contextmanager
+def endpoint_scope(endpoint: str):
+    """Names the endpoint whose crew runs in this context, for its per-endpoint model routes."""
+    token = _endpoint.set(endpoint)
+    try:
+        yield
+    finally:
+        _endpoint.reset(token)
+
+def current_endpoint() -> Optional[str]:
+    return _endpoint.get()
+
+_starting_point: ContextVar[Optional[Any]] = ContextVar("starting_point", default=None)
+
+@contextmanager
+def starting_point(result: Optional[Any]):
+    """Offers a previous result for near-identical input to the crew run in this context."""
+    token = _starting_point.set(result)
+    try:
+        yield
+    finally:
+        _starting_point.reset(token)
+
+def get_starting_point() -> Optional[Any]:
+    return _starting_point.get()
@@ -0,0 +1,131 @@
+import gzip
+from typing import Any, Dict
+import msgpack
+import orjson
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+COMPRESSIBLE_MEDIA_TYPES = ("application/json", "application/msgpack", "text/")
+
+class FastJSONResponse(Response):
+    """JSON rendered with orjson, several times faster than the standard library encoder on large strings."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+class MessagePackResponse(Response):
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+def _qualities(value: str) -> Dict[str, float]:
+    """The media types or codings of an Accept or Accept-Encoding header by q-value; a malformed q-value refuses."""
+    qualities = {}
+    for part in value.lower().split(","):
+        name, *parameters = [piece.strip() for piece in part.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            key, _, number = parameter.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities
+
+def negotiated_response(request: Request, content: Any) -> Response:
+    """
+    MessagePack when the client's Accept header prefers it at least as much as
+    JSON, orjson-encoded JSON otherwise. Content goes through FastAPI's
+    jsonable_encoder first, as a returned value would.
+    """
+    content = jsonable_encoder(content)
+    accept = _qualities(request.headers.get("accept", ""))
+    msgpack_quality = max(accept.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+    if msgpack_quality > 0 and msgpack_quality >= accept.get("application/json", 0.0):
+        return MessagePackResponse(content)
+    return FastJSONResponse(content)
+
+def _accepted_encodings(headers) -> set:
+    """The codings this middleware can produce that the request accepts, with `*` standing for unlisted ones."""
+    for name, value in headers:
+        if name == b"accept-encoding":
+            qualities = _qualities(value.decode("latin-1"))
+            return {coding for coding in ("br", "gzip") if qualities.get(coding, qualities.get("*", 0.0)) > 0}
+    return set()
+
+class CompressionMiddleware:
+    """
+    Compresses complete (non-streaming) responses of at least `minimum_size` bytes
+    with brotli or gzip, following the request's Accept-Encoding. Brotli is used only
+    when the `brotli` package is installed. Streaming responses pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accepted = _accepted_encodings(scope["headers"])
+        if brotli is not None and "br" in accepted:
+            encoding = "br"
+        elif "gzip" in accepted:
+            encoding = "gzip"
+        else:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if start_message is None:
+                return await send(message)
+
+            start, start_message = start_message, None
+            headers = start["headers"]
+            names = {name.lower() for name, _ in headers}
+            content_type = next((value for name, value in headers if name.lower() == b"content-type"), b"")
+            body = message.get("body", b"")
+            if (
+                message.get("more_body")
+                or b"content-encoding" in names
+                or len(body) < self.minimum_size
+                or not content_type.decode("latin-1").startswith(COMPRESSIBLE_MEDIA_TYPES)
+            ):
+                await send(start)
+                return await send(message)
+
+            if encoding == "br":
+                body = brotli.compress(body, quality=self.brotli_quality)
+            else:
+                body = gzip.compress(body, compresslevel=self.gzip_level)
+            headers = [(name, value) for name, value in headers if name.lower() != b"content-length"]
+            headers += [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
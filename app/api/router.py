@@ -1,48 +1,382 @@
+import asyncio
+import json
+import os
+import time
+from typing import Optional
 from app.api.features.doc_generator_assistant.crew import run_documentation_generator_crew
+from app.api.features.full_review.crew import run_full_review_crew
 from app.api.features.llm_app_development_assistant.crew import run_llm_development_assistant_crew
-from app.api.features.multi_agent_debugging_assistant.crew import run_multi_agent_debugging_crew
+from app.api.features.multi_agent_debugging_assistant.crew import STAGES, run_multi_agent_debugging_crew
+from app.api.features.multi_agent_debugging_assistant.sessions import DebuggingSession, SessionError, run_turn, sessions
 from app.api.features.refactoring_assistant.crew import run_refactoring_assistant_crew
 from app.api.schemas.llm_app_development_assistant_schema import ApplicationIdea
 from app.api.schemas.refactoring_assistant_schema import CodeInput
-from fastapi import APIRouter, Depends
-from app.api.logger import setup_logger
+from app.api.schemas.multi_agent_debugging_assistant_schema import CodeInput as DebuggingCodeInput
+from app.api.schemas.doc_generator_assistant_schema import CodeInput as DocumentationCodeInput
+from app.api.schemas.full_review_schema import CodeInput as FullReviewCodeInput
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from app.api.logger import crew_trace, sample_crew_trace, setup_logger
 from app.api.auth.auth import key_check
+from app.api.auth.tenants import Tenant
+from app.api.coalescing import coalescer, request_key
+from app.api.responses import negotiated_response
+from app.api.request_context import endpoint_scope, model_overrides, record_usage, starting_point
+from app.api.fingerprint import FINGERPRINT_ENDPOINTS, FingerprintMatch, fingerprint, fingerprints
+from app.api.admission import AdmissionEstimate, admission
+from app.api.deadlines import Deadline, RequestCancelled, deadline_scope
+from app.api.metrics import counters
+from app.api.llm_backends import backends
+from app.api.model_config import model_routing
+from app.api.scheduler import scheduler
+from app.api.rate_limiter import UpstreamCapacityError, limiter_stats
+from app.api.runtime_monitor import monitor
+from app.api.work_queue import Job, work_queue
 
 logger = setup_logger(__name__)
 router = APIRouter()
 
+DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", 1.0))
+
+def record_cancellation(endpoint: str, estimate: AdmissionEstimate, usage, reason: str):
+    """Counts a crew stopped early, and the estimated work of the stages it never started."""
+    completed = len(usage.completed_stages) if usage is not None else 0
+    # A stage cut off midway saved an unknown share of its cost, so only later stages count
+    tokens, cost, seconds = estimate.remaining(completed + 1 if usage is not None else 0)
+    counters.inc("crews_cancelled", endpoint=endpoint, reason=reason)
+    counters.inc("stages_skipped", len(estimate.stages) - completed - (1 if usage is not None else 0), endpoint=endpoint)
+    counters.inc("estimated_tokens_saved", tokens, endpoint=endpoint)
+    counters.inc("estimated_cost_saved_usd", cost, endpoint=endpoint)
+    counters.inc("estimated_crew_seconds_saved", seconds, endpoint=endpoint)
+    counters.inc("tokens_spent_on_cancelled", usage.total_tokens if usage is not None else 0, endpoint=endpoint)
+    logger.info("Crew cancelled", extra={
+        "endpoint": endpoint,
+        "reason": reason,
+        "completed_stages": completed,
+        "tokens_spent": usage.total_tokens if usage is not None else 0,
+        "estimated_tokens_saved": tokens,
+    })
+
+async def until_deadline_or_disconnect(request: Request, deadline: Deadline, awaitable):
+    """
+    Awaits `awaitable`, checking every DISCONNECT_POLL_SECONDS whether the client
+    is still connected. When the deadline passes (504) or the client goes away
+    (499), the wait is cancelled with `deadline.reason` set accordingly.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=max(0.0, min(DISCONNECT_POLL_SECONDS, deadline.remaining())))
+            if task.done():
+                break
+            if deadline.remaining() <= 0:
+                deadline.cancel("deadline")
+            elif await request.is_disconnected():
+                deadline.cancel("disconnect")
+            else:
+                continue
+            task.cancel()
+            await asyncio.wait({task})
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+    if task.cancelled() or isinstance(task.exception(), RequestCancelled):
+        if deadline.reason == "disconnect":
+            raise HTTPException(status_code=499, detail="Client closed the request")
+        raise HTTPException(status_code=504, detail="The request did not complete before its deadline")
+    return task.result()
+
+async def execute_crew(endpoint: str, data, tenant: Tenant, crew_func, estimate: AdmissionEstimate, traced: bool,
+                       match: Optional[FingerprintMatch], run_deadline: Deadline):
+    """Runs `crew_func(data)` on this worker, in a scheduler slot for `tenant`, until it finishes or `run_deadline` cancels it."""
+    usage = None
+    try:
+        async with scheduler.slot(tenant):
+            run_deadline.check()
+            started = time.monotonic()
+            with record_usage() as usage, crew_trace(traced), model_overrides(estimate.model_overrides), \
+                    starting_point(match.result if match is not None else None), deadline_scope(run_deadline), \
+                    endpoint_scope(endpoint):
+                crew = asyncio.ensure_future(asyncio.to_thread(crew_func, data))
+                try:
+                    results = await asyncio.shield(crew)
+                except asyncio.CancelledError:
+                    # The thread cannot be interrupted: it stops at its next LLM or tool call, and keeps its slot until then
+                    await asyncio.wait({crew})
+                    crew.exception()  # retrieved, so the RequestCancelled it most likely raised is not logged as unhandled
+                    raise
+            scheduler.record_tokens(tenant, usage.total_tokens)
+            admission.record(estimate, usage)
+    except (asyncio.CancelledError, RequestCancelled):
+        if usage is not None:
+            scheduler.record_tokens(tenant, usage.total_tokens)
+        record_cancellation(endpoint, estimate, usage, run_deadline.reason or "deadline")
+        raise
+    logger.info("Crew finished", extra={
+        "endpoint": endpoint,
+        "tenant": tenant.name,
+        "depth": estimate.depth,
+        "duration_seconds": round(time.monotonic() - started, 3),
+        "llm_calls": usage.llm_calls,
+        "total_tokens": usage.total_tokens,
+        "estimated_cost_usd": round(estimate.cost_usd, 4),
+        "traced": traced,
+        "near_duplicate_similarity": round(match.similarity, 3) if match is not None else None,
+    })
+    return results
+
+async def run_crew(request: Request, endpoint: str, data, tenant: Tenant, crew_func):
+    """
+    Runs `crew_func(data)` in a scheduler slot for `tenant`, sharing the run with
+    the tenant's identical requests, until it finishes, its deadline passes or
+    every client waiting for it has disconnected. With a work queue the crew runs
+    on whichever worker claims it, on any instance.
+    """
+    deadline = Deadline.for_request(endpoint, request.headers.get("x-request-deadline"), getattr(data, "depth", "standard"))
+    # Verbose traces are costly to log, so only admins may ask for them
+    traced = sample_crew_trace(request.headers.get("x-crew-trace") if tenant.admin else None)
+
+    # Identical code reuses a result outright (up to comments and whitespace unless the result quotes the code);
+    # near-identical code seeds the crew
+    code_fingerprint = match = None
+    if endpoint in FINGERPRINT_ENDPOINTS:
+        code_fingerprint = await asyncio.to_thread(fingerprint, data)
+        match = fingerprints.lookup(endpoint, code_fingerprint)
+        if (match is None or not match.exact) and work_queue.enabled:
+            shared = None
+            for key in dict.fromkeys((code_fingerprint.source_key, code_fingerprint.exact_key)):
+                shared = await asyncio.to_thread(work_queue.store.cache_get, f"fingerprint:v3:{endpoint}:{key}")
+                if shared is not None:
+                    break
+            if shared is not None:
+                fingerprints.add(endpoint, code_fingerprint, shared)
+                match = FingerprintMatch(True, 1.0, shared)
+        if match is not None and match.exact:
+            logger.info("Reusing the result of an identical snippet", extra={"endpoint": endpoint, "tenant": tenant.name})
+            return match.result
+
+    estimate = await asyncio.to_thread(
+        admission.admit, endpoint, data,
+        queue_depth=work_queue.queued if work_queue.enabled else scheduler.queue_depth(),
+        shareable=coalescer.is_in_flight(endpoint, data, tenant.name),
+    )
+    async def execute(run_deadline: Deadline):
+        if not work_queue.enabled:
+            return await execute_crew(endpoint, data, tenant, crew_func, estimate, traced, match, run_deadline)
+        job = Job(
+            id=request_key(endpoint, data, tenant.name),
+            endpoint=endpoint,
+            payload=data.model_dump(),
+            tenant=tenant.model_dump(),
+            options={"model_overrides": estimate.model_overrides, "traced": traced,
+                     "near_duplicate": {"similarity": match.similarity, "result": match.result} if match is not None else None},
+        )
+        return await work_queue.submit(job, run_deadline)
+
+    results = await until_deadline_or_disconnect(request, deadline, coalescer.run(endpoint, data, tenant.name, execute, deadline))
+    if code_fingerprint is not None:
+        fingerprints.add(endpoint, code_fingerprint, results)
+        if work_queue.enabled:
+            await asyncio.to_thread(work_queue.store.cache_put, f"fingerprint:v3:{endpoint}:{code_fingerprint.key_for(results)}",
+                                    results, fingerprints.ttl_seconds)
+    return results
+
 @router.get("/")
 def read_root():
     return {"Hello": "World"}
 
+@router.get("/usage")
+def usage(tenant: Tenant = Depends(key_check)):
+    return scheduler.usage(None if tenant.admin else tenant)
+
+@router.get("/metrics")
+def metrics(tenant: Tenant = Depends(key_check)):
+    if not tenant.admin:
+        raise HTTPException(status_code=403, detail="Metrics are only available to admin tenants")
+    return {
+        "counters": counters.snapshot(),
+        "coalescing": coalescer.stats(),
+        "admission": admission.stats(),
+        "fingerprints": fingerprints.stats(),
+        "debugging_sessions": sessions.stats(),
+        "work_queue": work_queue.stats(),
+        "llm_backends": backends.stats(),
+        "model_config": model_routing.stats(),
+    }
+
+@router.get("/diagnostics")
+async def diagnostics(tenant: Tenant = Depends(key_check)):
+    # Async, so it does not queue for the to_thread pool the crews may have saturated
+    if not tenant.admin:
+        raise HTTPException(status_code=403, detail="Diagnostics are only available to admin tenants")
+    return {**monitor.snapshot(), "llm_limiters": limiter_stats()}
+
 @router.post("/refactoring-assistant")
-async def refactoring_assistance( data: CodeInput, _ = Depends(key_check)):
+async def refactoring_assistance(request: Request, data: CodeInput, tenant: Tenant = Depends(key_check)):
     logger.info("Generating the refactoring assistance")
-    results = run_refactoring_assistant_crew(data)
+    results = await run_crew(request, "/refactoring-assistant", data, tenant, run_refactoring_assistant_crew)
     logger.info("The refactoring assistance has been successfully generated")
 
-    return results
+    return negotiated_response(request, results)
 
 @router.post("/doc-generator-assistant")
-async def doc_generator_assistance( data: CodeInput, _ = Depends(key_check)):
+async def doc_generator_assistance(request: Request, data: DocumentationCodeInput, tenant: Tenant = Depends(key_check)):
     logger.info("Generating the documentation generator assistance")
-    results = run_documentation_generator_crew(data)
+    results = await run_crew(request, "/doc-generator-assistant", data, tenant, run_documentation_generator_crew)
     logger.info("The documentation generator assistance has been successfully generated")
 
-    return results
+    return negotiated_response(request, results)
 
 @router.post("/multi-agent-debugging-assistant")
-async def multi_agent_debugging_assistance( data: CodeInput, _ = Depends(key_check)):
+async def multi_agent_debugging_assistance(request: Request, data: DebuggingCodeInput, tenant: Tenant = Depends(key_check)):
     logger.info("Generating the multi-agent debugging assistance")
-    results = run_multi_agent_debugging_crew(data)
+    results = await run_crew(request, "/multi-agent-debugging-assistant", data, tenant, run_multi_agent_debugging_crew)
     logger.info("The documentation generator assistance has been successfully generated")
 
-    return results
+    return negotiated_response(request, results)
 
 @router.post("/llm-app-development-assistant")
-async def llm_app_development_assistance( data: ApplicationIdea, _ = Depends(key_check)):
+async def llm_app_development_assistance(request: Request, data: ApplicationIdea, tenant: Tenant = Depends(key_check)):
     logger.info("Generating the llm app. development assistance")
-    results = run_llm_development_assistant_crew(data)
+    results = await run_crew(request, "/llm-app-development-assistant", data, tenant, run_llm_development_assistant_crew)
     logger.info("The llm app. development assistance has been successfully generated")
 
-    return results
\ No newline at end of file
+    return negotiated_response(request, results)
+
+@router.post("/full-review")
+async def full_review(request: Request, data: FullReviewCodeInput, tenant: Tenant = Depends(key_check)):
+    logger.info("Generating the full review")
+    results = await run_crew(request, "/full-review", data, tenant, run_full_review_crew)
+    logger.info("The full review has been successfully generated")
+
+    return negotiated_response(request, results)
+
+# What a work queue consumer needs to run a job of each endpoint
+CREW_ENDPOINTS = {
+    "/refactoring-assistant": (CodeInput, run_refactoring_assistant_crew),
+    "/doc-generator-assistant": (DocumentationCodeInput, run_documentation_generator_crew),
+    "/multi-agent-debugging-assistant": (DebuggingCodeInput, run_multi_agent_debugging_crew),
+    "/llm-app-development-assistant": (ApplicationIdea, run_llm_development_assistant_crew),
+    "/full-review": (FullReviewCodeInput, run_full_review_crew),
+}
+
+async def run_job(job: Job, deadline: Deadline):
+    """Runs a job claimed from the work queue, as the worker that received the request would have."""
+    schema, crew_func = CREW_ENDPOINTS[job.endpoint]
+    data = schema(**job.payload)
+    near_duplicate = job.options.get("near_duplicate")
+    match = FingerprintMatch(False, near_duplicate["similarity"], near_duplicate["result"]) if near_duplicate else None
+    estimate = await asyncio.to_thread(admission.estimate, job.endpoint, data, job.options.get("model_overrides"))
+    return await execute_crew(job.endpoint, data, Tenant(**job.tenant), crew_func, estimate,
+                              job.options.get("traced", False), match, deadline)
+
+SESSION_ENDPOINT = "/multi-agent-debugging-assistant/session"
+
+def session_state(session: DebuggingSession) -> dict:
+    return {
+        "type": "state",
+        "session_id": session.id,
+        "outputs": session.outputs,
+        "evidence": session.evidence,
+        "turns": [vars(turn) for turn in session.turns],
+    }
+
+@router.websocket(SESSION_ENDPOINT)
+async def multi_agent_debugging_session(websocket: WebSocket):
+    """
+    Iterative debugging over one connection. The session keeps the code, each
+    stage's latest output and the evidence so far, so follow-ups run only the
+    stages they need. See the README for the message types.
+    """
+    try:
+        tenant = key_check(websocket.headers.get("api-key"))
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+    await websocket.accept()
+
+    inbox: asyncio.Queue = asyncio.Queue()
+    running = None
+
+    async def read():
+        try:
+            while True:
+                await inbox.put(await websocket.receive_text())
+        except WebSocketDisconnect:
+            if running is not None:
+                running.cancel("disconnect")
+        finally:
+            await inbox.put(None)
+
+    reader = asyncio.create_task(read())
+    session = None
+    try:
+        while (text := await inbox.get()) is not None:
+            try:
+                message = json.loads(text)
+                if not isinstance(message, dict):
+                    raise SessionError("Messages must be JSON objects")
+                kind = message.get("type")
+                if kind == "resume":
+                    session = await asyncio.to_thread(sessions.get, str(message.get("session_id")), tenant.name)
+                    await websocket.send_json(session_state(session))
+                    continue
+                if kind == "start":
+                    code_input = DebuggingCodeInput.model_validate(message.get("input") or {})
+                    await asyncio.to_thread(admission.admit, "/multi-agent-debugging-assistant", code_input,
+                                            queue_depth=scheduler.queue_depth())
+                    session = await asyncio.to_thread(sessions.create, tenant.name, code_input)
+                elif session is None:
+                    raise SessionError("Send a `start` or `resume` message first")
+                elif kind == "state":
+                    await websocket.send_json(session_state(session))
+                    continue
+                elif kind == "close":
+                    await asyncio.to_thread(sessions.close, session.id)
+                    break
+                elif kind == "update_code":
+                    updated = session.code_input.model_copy(update={"code_snippet": str(message.get("code_snippet"))})
+                    await asyncio.to_thread(admission.admit, "/multi-agent-debugging-assistant", updated,
+                                            queue_depth=scheduler.queue_depth())
+
+                running = Deadline.for_request(SESSION_ENDPOINT, websocket.headers.get("x-request-deadline"))
+                async with scheduler.slot(tenant):
+                    # Sessions run the debugging pipeline's agents, on its routes
+                    with record_usage() as usage, deadline_scope(running), endpoint_scope("/multi-agent-debugging-assistant"):
+                        stages, outputs = await asyncio.to_thread(run_turn, session, message)
+                    scheduler.record_tokens(tenant, usage.total_tokens)
+                running = None
+                await asyncio.to_thread(sessions.save, session)
+                counters.inc("session_stages_run", len(stages))
+                counters.inc("session_stages_reused", len(STAGES) - len(stages))
+                logger.info("Debugging session turn finished", extra={
+                    "tenant": tenant.name,
+                    "session": session.id,
+                    "message_type": kind,
+                    "stages": stages,
+                    "llm_calls": usage.llm_calls,
+                    "total_tokens": usage.total_tokens,
+                })
+                await websocket.send_json({
+                    "type": "result",
+                    "session_id": session.id,
+                    "stages": stages,
+                    "outputs": outputs,
+                    "total_tokens": usage.total_tokens,
+                })
+            except (SessionError, ValidationError, json.JSONDecodeError) as e:
+                await websocket.send_json({"type": "error", "message": str(e)})
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "status": e.status_code, "message": e.detail})
+            except UpstreamCapacityError as e:
+                await websocket.send_json({"type": "error", "status": 503, "message": str(e)})
+            except RequestCancelled as e:
+                counters.inc("crews_cancelled", endpoint=SESSION_ENDPOINT, reason=e.reason)
+                if e.reason == "disconnect":
+                    break
+                await websocket.send_json({"type": "error", "status": 504, "message": "The request did not complete before its deadline"})
+            finally:
+                running = None
+    finally:
+        reader.cancel()
@@ -0,0 +1,237 @@
+import asyncio
+import gc
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Optional
+import anyio.to_thread
+from app.api.logger import setup_logger
+from app.api.worker_recycling import current_rss_mb
+
+logger = setup_logger(__name__)
+
+SAMPLE_INTERVAL_SECONDS = float(os.environ.get("RUNTIME_SAMPLE_INTERVAL_SECONDS", 0.5))
+LOOP_LAG_WARNING_MS = float(os.environ.get("LOOP_LAG_WARNING_MS", 200))
+# Samples kept for percentiles: 10 minutes at the default interval
+SAMPLE_WINDOW = int(os.environ.get("RUNTIME_SAMPLE_WINDOW", 1200))
+# Same default as asyncio's own executor
+THREAD_POOL_SIZE = int(os.environ.get("RUNTIME_THREAD_POOL_SIZE") or min(32, (os.cpu_count() or 1) + 4))
+MAX_TRACKED_PATHS = 64
+STACK_FRAMES = 12
+
+class MonitoredThreadPoolExecutor(ThreadPoolExecutor):
+    """The loop's default executor, behind `asyncio.to_thread`, counting the calls running and waiting for a thread."""
+
+    def __init__(self, max_workers: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix="to-thread")
+        self.size = max_workers
+        self.submitted = 0
+        self.running = 0
+        self.completed = 0
+        self._counts = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            with self._counts:
+                self.running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counts:
+                    self.running -= 1
+                    self.completed += 1
+
+        with self._counts:
+            self.submitted += 1
+        return super().submit(run)
+
+    @property
+    def queued(self) -> int:
+        return self.submitted - self.completed - self.running
+
+class _PathMemory:
+    def __init__(self):
+        self.requests = 0
+        self.rss_growth_mb = 0.0
+        self.max_rss_growth_mb = 0.0
+
+    def add(self, growth_mb: float):
+        self.requests += 1
+        self.rss_growth_mb += growth_mb
+        self.max_rss_growth_mb = max(self.max_rss_growth_mb, growth_mb)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "mean_rss_growth_mb": round(self.rss_growth_mb / self.requests, 3) if self.requests else 0.0,
+            "max_rss_growth_mb": round(self.max_rss_growth_mb, 3),
+            "total_rss_growth_mb": round(self.rss_growth_mb, 3),
+        }
+
+def _percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+class RuntimeMonitor:
+    """
+    Samples the serving process every `interval` seconds: event loop lag, the
+    thread pools crews and sync endpoints run on, registered queue depths and RSS.
+
+    Lag is how late a sleep on the loop wakes up, so it measures how long something
+    held the loop without yielding. A watchdog thread captures the loop thread's
+    stack while it is blocked past `lag_warning_ms`, and the warning logged once the
+    loop is back includes it, pointing at the blocking call.
+    """
+
+    def __init__(self, interval: float, lag_warning_ms: float, window: int):
+        self.interval = interval
+        self.lag_warning_ms = lag_warning_ms
+        self.samples: Deque[dict] = deque(maxlen=window)
+        self.stalls: Deque[dict] = deque(maxlen=20)
+        self.lag_warnings = 0
+        self.executor: Optional[MonitoredThreadPoolExecutor] = None
+        self.baseline_rss_mb: Optional[float] = None
+        self.peak_rss_mb = 0.0
+        self.in_flight_requests = 0
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._paths: Dict[str, _PathMemory] = {}
+        self._started = time.monotonic()
+        self._heartbeat = time.monotonic()
+        self._stall_stack: Optional[str] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        """Adds a value sampled with the others, e.g. a queue depth."""
+        self._gauges[name] = read
+
+    def start(self, thread_pool_size: int):
+        """Installs the monitored default executor and starts sampling; call from the event loop."""
+        loop = asyncio.get_running_loop()
+        self.executor = MonitoredThreadPoolExecutor(thread_pool_size)
+        loop.set_default_executor(self.executor)
+        self._loop_thread = threading.get_ident()
+        self.baseline_rss_mb = current_rss_mb()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = loop.create_task(self._sample())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def _watch(self):
+        threshold = self.interval + self.lag_warning_ms / 1000
+        reported = None
+        while not self._stopped.wait(self.interval / 2):
+            heartbeat = self._heartbeat
+            if heartbeat != reported and time.monotonic() - heartbeat > threshold:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._stall_stack = "".join(traceback.format_stack(frame)[-STACK_FRAMES:])
+                reported = heartbeat
+
+    def _thread_pools(self) -> dict:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        pools = {"sync_endpoints": {"size": int(limiter.total_tokens), "running": int(limiter.borrowed_tokens),
+                                    "queued": limiter.statistics().tasks_waiting}}
+        if self.executor is not None:
+            pools["to_thread"] = {"size": self.executor.size, "running": self.executor.running, "queued": self.executor.queued}
+        return pools
+
+    async def _sample(self):
+        while True:
+            slept = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag_ms = max(0.0, (now - slept - self.interval) * 1000)
+            rss = current_rss_mb()
+            self.peak_rss_mb = max(self.peak_rss_mb, rss)
+            sample = {
+                "at": round(time.time(), 3),
+                "loop_lag_ms": round(lag_ms, 1),
+                "rss_mb": round(rss, 1),
+                "thread_pools": self._thread_pools(),
+                "queues": {name: read() for name, read in self._gauges.items()},
+                "tasks": len(asyncio.all_tasks()),
+                "in_flight_requests": self.in_flight_requests,
+            }
+            self.samples.append(sample)
+            if lag_ms > self.lag_warning_ms:
+                self.lag_warnings += 1
+                stack, self._stall_stack = self._stall_stack, None
+                self.stalls.append({"at": sample["at"], "loop_lag_ms": sample["loop_lag_ms"], "stack": stack})
+                logger.warning(f"Event loop blocked for {lag_ms:.0f} ms", extra={"loop_lag_ms": sample["loop_lag_ms"], "blocking_stack": stack})
+
+    def record_request(self, path: str, growth_mb: float):
+        if path not in self._paths and len(self._paths) >= MAX_TRACKED_PATHS:
+            path = "other"
+        self._paths.setdefault(path, _PathMemory()).add(growth_mb)
+
+    def snapshot(self) -> dict:
+        samples = list(self.samples)
+        lags = sorted(sample["loop_lag_ms"] for sample in samples)
+        saturated = sum(1 for sample in samples if sample["thread_pools"].get("to_thread", {}).get("queued"))
+        rss = current_rss_mb()
+        return {
+            "uptime_seconds": round(time.monotonic() - self._started, 1),
+            "sample_interval_seconds": self.interval,
+            "samples": len(samples),
+            "loop": {
+                "lag_ms": {"last": samples[-1]["loop_lag_ms"] if samples else 0.0, "p50": _percentile(lags, 50),
+                           "p99": _percentile(lags, 99), "max": lags[-1] if lags else 0.0},
+                "warning_threshold_ms": self.lag_warning_ms,
+                "warnings": self.lag_warnings,
+                "recent_stalls": list(self.stalls),
+            },
+            "thread_pools": self._thread_pools(),
+            "thread_pool_saturated_pct": round(100 * saturated / len(samples), 1) if samples else 0.0,
+            "queues": {name: read() for name, read in self._gauges.items()},
+            "memory": {
+                "rss_mb": round(rss, 1),
+                "baseline_rss_mb": round(self.baseline_rss_mb or rss, 1),
+                "growth_mb": round(rss - (self.baseline_rss_mb or rss), 1),
+                "peak_rss_mb": round(max(self.peak_rss_mb, rss), 1),
+                "gc_counts": gc.get_count(),
+                "gc_collections": [generation["collections"] for generation in gc.get_stats()],
+            },
+            "requests": {"in_flight": self.in_flight_requests,
+                         "by_path": {path: stats.as_dict() for path, stats in sorted(self._paths.items())}},
+            "recent": samples[-10:],
+        }
+
+class RuntimeMonitorMiddleware:
+    """
+    Counts requests in flight and records each HTTP request's RSS growth by path.
+
+    Requests that overlap share the growth of the process, so per-path numbers are
+    exact only when requests run one at a time; under load, read them as a trend.
+    """
+
+    def __init__(self, app, monitor: "RuntimeMonitor"):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        before = current_rss_mb()
+        self.monitor.in_flight_requests += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.in_flight_requests -= 1
+            self.monitor.record_request(scope["path"], current_rss_mb() - before)
+
+monitor = RuntimeMonitor(SAMPLE_INTERVAL_SECONDS, LOOP_LAG_WARNING_MS, SAMPLE_WINDOW)
@@ -0,0 +1,175 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+from fastapi import HTTPException
+from app.api.auth.tenants import Tenant
+from app.api.rate_limiter import get_shared_store
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+PRIORITY_ORDER = ("interactive", "batch")
+
+class TenantUsage:
+    def __init__(self):
+        self.requests = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.tokens = 0
+        self.crew_seconds = 0.0
+        self.queue_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+class _TenantState:
+    def __init__(self, tenant: Tenant):
+        self.tenant = tenant
+        self.in_flight = 0
+        self.waiting: Deque[asyncio.Future] = deque()
+        self.virtual_time = 0.0
+        self.usage = TenantUsage()
+
+class FairCrewScheduler:
+    """
+    Admits crew runs into a fixed number of slots per worker.
+
+    Waiting interactive tenants are always served before batch tenants, and batch
+    tenants may never hold the last `interactive_reserved` slots, so a new IDE
+    request does not queue behind a nightly job. Within a priority class tenants are
+    served in weighted fair order: each dispatch advances the tenant's virtual time
+    by 1 / weight and the tenant with the smallest virtual time goes next. A tenant
+    never runs more than its `max_concurrent_crews` at once.
+    """
+
+    def __init__(self, capacity: int, interactive_reserved: int = 1):
+        self.capacity = capacity
+        self.interactive_reserved = min(interactive_reserved, capacity - 1)
+        self.in_flight = 0
+        self._virtual_clock = 0.0
+        self._tenants: Dict[str, _TenantState] = {}
+
+    def _state(self, tenant: Tenant) -> _TenantState:
+        state = self._tenants.get(tenant.name)
+        if state is None:
+            state = self._tenants[tenant.name] = _TenantState(tenant)
+        state.tenant = tenant
+        return state
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        return sum(
+            len(state.waiting) for state in self._tenants.values()
+            if priority is None or state.tenant.priority == priority
+        )
+
+    def _can_dispatch(self, state: _TenantState) -> bool:
+        if not state.waiting or state.in_flight >= state.tenant.max_concurrent_crews:
+            return False
+        if state.tenant.priority == "batch":
+            return self.in_flight < self.capacity - self.interactive_reserved
+        return self.in_flight < self.capacity
+
+    def _next(self) -> Optional[_TenantState]:
+        for priority in PRIORITY_ORDER:
+            ready = [
+                state for state in self._tenants.values()
+                if state.tenant.priority == priority and self._can_dispatch(state)
+            ]
+            if ready:
+                return min(ready, key=lambda state: state.virtual_time)
+        return None
+
+    def _dispatch(self):
+        while self.in_flight < self.capacity:
+            state = self._next()
+            if state is None:
+                return
+            waiter = state.waiting.popleft()
+            if waiter.done():
+                continue
+            state.in_flight += 1
+            self.in_flight += 1
+            state.virtual_time = max(state.virtual_time, self._virtual_clock) + 1 / state.tenant.weight
+            self._virtual_clock = min(s.virtual_time for s in self._tenants.values() if s.waiting or s.in_flight)
+            waiter.set_result(None)
+
+    def _check_token_quota(self, state: _TenantState):
+        quota = state.tenant.tokens_per_minute
+        wait = get_shared_store().try_consume([(f"tenant:{state.tenant.name}:tpm", 1.0, quota, quota / 60.0)]) if quota else 0
+        if wait > 0:
+            state.usage.rejected += 1
+            # The wait is until the tenant's bucket has refilled the token the check takes
+            raise HTTPException(status_code=429, headers={"Retry-After": str(max(1, math.ceil(wait)))},
+                                detail=f"Token quota of {quota} tokens per minute exhausted for tenant '{state.tenant.name}'")
+
+    def record_tokens(self, tenant: Tenant, tokens: int):
+        state = self._state(tenant)
+        state.usage.tokens += tokens
+        quota = tenant.tokens_per_minute
+        if quota and tokens:
+            # The admission check already took one token
+            get_shared_store().adjust(f"tenant:{tenant.name}:tpm", 1 - tokens, quota, quota / 60.0)
+
+    @asynccontextmanager
+    async def slot(self, tenant: Tenant):
+        """Waits for a crew slot for `tenant`; raises 429 when its token quota is spent."""
+        state = self._state(tenant)
+        self._check_token_quota(state)
+        state.usage.requests += 1
+
+        queued = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiting.append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as we were cancelled; hand it back
+                self._release(state)
+            else:
+                waiter.cancel()
+                # Unless a dispatch already skipped it, it still counts towards the queue depth
+                if waiter in state.waiting:
+                    state.waiting.remove(waiter)
+            raise
+        state.usage.queue_seconds += time.monotonic() - queued
+
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            state.usage.failed += 1
+            raise
+        else:
+            state.usage.completed += 1
+        finally:
+            state.usage.crew_seconds += time.monotonic() - started
+            self._release(state)
+
+    def _release(self, state: _TenantState):
+        state.in_flight -= 1
+        self.in_flight -= 1
+        self._dispatch()
+
+    def usage(self, tenant: Optional[Tenant] = None) -> dict:
+        states = self._tenants.values() if tenant is None else [self._state(tenant)]
+        return {
+            state.tenant.name: {
+                "priority": state.tenant.priority,
+                "in_flight": state.in_flight,
+                "queued": len(state.waiting),
+                **state.usage.as_dict(),
+            }
+            for state in states
+        }
+
+scheduler = FairCrewScheduler(
+    capacity=int(os.environ.get("CREW_CONCURRENCY", 4)),
+    interactive_reserved=int(os.environ.get("CREW_INTERACTIVE_RESERVED", 1)),
+)
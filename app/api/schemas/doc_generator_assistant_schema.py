@@ -1,10 +1,12 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Literal, Optional, Dict
 
 class CodeInput(BaseModel):
     code_snippet: str
     language: str = Field(default="python", description="Programming language of the code snippet")
     context: Optional[str] = Field(default=None, description="Additional context or comments about the code")
+    depth: Literal["quick", "standard", "deep"] = Field(default="standard", description="'quick' runs one agent on the fast model without tools; 'deep' adds a verification stage. The response schema is the same")
+    output_format: Literal["markdown", "rst", "html"] = Field(default="markdown", description="Markup the documentation is rendered in")
 
 class FunctionElement(BaseModel):
     name: str
@@ -43,5 +45,12 @@ class ModuleDocumentation(BaseModel):
     classes: List[ClassDocumentation]
     examples: Optional[List[str]]
 
+class ExampleElement(BaseModel):
+    element_name: str = Field(description="Function, class, `Class.method` or module the example shows")
+    example_code: str
+
+class ExamplesOutput(BaseModel):
+    examples: List[ExampleElement]
+
 class DocumentationOutput(BaseModel):
     documentation: str
\ No newline at end of file
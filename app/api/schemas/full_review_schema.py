@@ -0,0 +1,21 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Literal, Optional
+from app.api.schemas.doc_generator_assistant_schema import ParsingOutput
+from app.api.schemas.multi_agent_debugging_assistant_schema import AnalysisOutput as BugAnalysis, CodeInput as DebuggingCodeInput
+from app.api.schemas.refactoring_assistant_schema import AnalysisOutput as QualityAnalysis
+
+class CodeInput(DebuggingCodeInput):
+    """The debugging input, a superset of the refactoring and documentation inputs. `output_mode` applies to the refactored and fixed code."""
+    documentation_format: Literal["markdown", "rst", "html"] = Field(default="markdown", description="Markup the documentation is rendered in")
+
+class SharedAnalysis(BaseModel):
+    structure: ParsingOutput
+    quality: QualityAnalysis
+    bugs: BugAnalysis
+
+class FullReviewOutput(BaseModel):
+    analysis: Optional[SharedAnalysis]
+    refactoring: Optional[Dict[str, Any]]
+    debugging: Optional[Dict[str, Any]]
+    documentation: Optional[Dict[str, Any]]
+    errors: Dict[str, str]
@@ -1,9 +1,11 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Literal, Optional, Dict
 
 class ApplicationIdea(BaseModel):
     project_name: str
     description: str
+    prefetch_research: Optional[bool] = Field(default=None, description="Run all research before the crew starts instead of letting agents call tools; defaults to LLM_APP_PREFETCH_RESEARCH")
+    depth: Literal["quick", "standard", "deep"] = Field(default="standard", description="'quick' runs one agent on the fast model without tools; 'deep' adds a verification stage. The response schema is the same")
 
 class DevelopmentOutput(BaseModel):
     feasibility: Dict[str, str]
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Literal, Optional, Dict
+from app.api.schemas.patch_schema import CodeEdit
 
 class CodeInput(BaseModel):
     code_snippet: str
@@ -9,8 +10,12 @@ class CodeInput(BaseModel):
     environment: Optional[str] = Field(default=None, description="Execution environment details")
     expected_behavior: Optional[str] = Field(default=None, description="Description of the expected behavior of the code")
     actual_behavior: Optional[str] = Field(default=None, description="Description of the actual behavior observed")
+    error_message: Optional[str] = Field(default=None, description="The error the code raised, e.g. \"KeyError: 'user_id'\"")
+    stack_trace: Optional[str] = Field(default=None, description="The traceback of the error, as printed")
     inputs: Optional[List[str]] = Field(default=None, description="Expected inputs to the code")
     outputs: Optional[List[str]] = Field(default=None, description="Expected outputs from the code")
+    output_mode: Literal["full", "diff"] = Field(default="full", description="'diff' has the model return only edits, which the server applies; the response adds a unified diff in `patch`")
+    depth: Literal["quick", "standard", "deep"] = Field(default="standard", description="'quick' runs one agent on the fast model without tools; 'deep' adds a verification stage. The response schema is the same")
 
 class BugDetail(BaseModel):
     bug_id: int
@@ -88,4 +93,15 @@ class FixedCode(BaseModel):
     performance_improvements: Optional[Dict[str, float]]
     remaining_issues: Optional[List[str]]
     code_quality_metrics: Optional[Dict[str, float]]
-    documentation_updates: Optional[List[str]]
\ No newline at end of file
+    documentation_updates: Optional[List[str]]
+
+class FixedCodePatch(BaseModel):
+    edits: List[CodeEdit]
+    changes_made: Dict[str, str]
+    bugs_fixed: List[int]
+    new_dependencies: Optional[List[str]]
+    tests_performed: Optional[List[str]]
+    performance_improvements: Optional[Dict[str, float]]
+    remaining_issues: Optional[List[str]]
+    code_quality_metrics: Optional[Dict[str, float]]
+    documentation_updates: Optional[List[str]]
@@ -0,0 +1,7 @@
+from pydantic import BaseModel, Field
+
+class CodeEdit(BaseModel):
+    start_line: int = Field(description="First line replaced, 1-based as numbered in the original code")
+    end_line: int = Field(description="Last line replaced, inclusive; start_line - 1 to insert before start_line")
+    original: str = Field(description="The exact current text of lines start_line..end_line, empty for an insertion")
+    replacement: str = Field(description="The new text for those lines, empty to delete them")
@@ -1,10 +1,13 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Literal, Optional, Dict
+from app.api.schemas.patch_schema import CodeEdit
 
 class CodeInput(BaseModel):
     code_snippet: str
     language: str = Field(default="python", description="Programming language of the code snippet")
     context: Optional[str] = Field(default=None, description="Additional context or comments about the code")
+    output_mode: Literal["full", "diff"] = Field(default="full", description="'diff' has the model return only edits, which the server applies; the response adds a unified diff in `patch`")
+    depth: Literal["quick", "standard", "deep"] = Field(default="standard", description="'quick' runs one agent on the fast model without tools; 'deep' adds a verification stage. The response schema is the same")
 
 class IssueDetail(BaseModel):
     issue_id: int
@@ -41,4 +44,9 @@ class RefactoringSuggestions(BaseModel):
 class RefactoredCode(BaseModel):
     code_snippet: str
     changes_made: Dict[str, str]
-    new_dependencies: Optional[List[str]]
\ No newline at end of file
+    new_dependencies: Optional[List[str]]
+
+class RefactoredCodePatch(BaseModel):
+    edits: List[CodeEdit]
+    changes_made: Dict[str, str]
+    new_dependencies: Optional[List[str]]
@@ -0,0 +1,74 @@
+from functools import lru_cache
+from langchain.tools import Tool
+from langchain_community.tools import TavilySearchResults, WikipediaQueryRun
+from langchain_community.tools.wikidata.tool import WikidataAPIWrapper, WikidataQueryRun
+from langchain_community.utilities import ArxivAPIWrapper, WikipediaAPIWrapper
+from langchain_experimental.tools import PythonREPLTool
+from app.api.knowledge.index import get_knowledge_index
+from app.api.knowledge.tool import knowledge_backed
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Remote research tools hold no per-request state, so one instance of each is built
+# on first use and shared by every agent. Wikidata's wrapper fetches the language
+# list from the network when it is constructed, which is why this matters.
+# Each can be served from the local knowledge index instead (see app/api/knowledge).
+
+ARXIV_DESCRIPTION = "A wrapper around Arxiv. Useful for when you need to access academic papers."
+WIKIPEDIA_DESCRIPTION = "Access Wikipedia articles for information."
+
+@lru_cache(maxsize=None)
+def wikipedia_query_tool():
+    return knowledge_backed(
+        "wikipedia", "wikipedia", WikipediaQueryRun.__fields__["description"].default,
+        lambda: WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper()),
+    )
+
+@lru_cache(maxsize=None)
+def wikidata_query_tool():
+    return knowledge_backed(
+        "wikidata", "Wikidata", WikidataQueryRun.__fields__["description"].default,
+        lambda: WikidataQueryRun(api_wrapper=WikidataAPIWrapper()),
+    )
+
+@lru_cache(maxsize=None)
+def arxiv_tool():
+    return knowledge_backed(
+        "arxiv", "Arxiv", ARXIV_DESCRIPTION,
+        lambda: Tool(name="Arxiv", func=ArxivAPIWrapper().run, description=ARXIV_DESCRIPTION),
+    )
+
+@lru_cache(maxsize=None)
+def wikipedia_tool():
+    return knowledge_backed(
+        "wikipedia", "Wikipedia", WIKIPEDIA_DESCRIPTION,
+        lambda: Tool(name="Wikipedia", func=WikipediaAPIWrapper().run, description=WIKIPEDIA_DESCRIPTION),
+    )
+
+@lru_cache(maxsize=None)
+def tavily_search_tool():
+    return TavilySearchResults(
+        max_results=5,
+        search_depth="advanced",
+        include_answer=True,
+        include_raw_content=True,
+    )
+
+def python_repl_tool():
+    # The REPL keeps globals between calls, so every agent gets its own
+    return PythonREPLTool()
+
+SHARED_TOOLS = (wikipedia_query_tool, wikidata_query_tool, arxiv_tool, wikipedia_tool, tavily_search_tool)
+
+def warm_shared_tools():
+    """Builds the shared tools ahead of the first request; failures are retried lazily on use."""
+    try:
+        get_knowledge_index()
+    except Exception as e:
+        logger.warning(f"Could not open the knowledge index at startup: {e}")
+    for factory in SHARED_TOOLS:
+        try:
+            factory()
+        except Exception as e:
+            logger.warning(f"Could not build {factory.__name__} at startup: {e}")
@@ -0,0 +1,672 @@
+import abc
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from fastapi import HTTPException
+from app.api.deadlines import Deadline, RequestCancelled
+from app.api.rate_limiter import UpstreamCapacityError
+from app.api.scheduler import PRIORITY_ORDER
+from app.api.logger import setup_logger
+
+try:
+    import redis
+except ImportError:  # SQLite only
+    redis = None
+
+logger = setup_logger(__name__)
+
+@dataclass
+class Job:
+    """
+    One crew run in the shared queue. `id` is the request key, so identical
+    requests on any instance share a job. `deadline_at` is wall-clock time, the
+    only clock instances share.
+    """
+    id: str
+    endpoint: str
+    payload: dict
+    tenant: dict
+    options: dict = field(default_factory=dict)
+    deadline_at: float = 0.0
+    status: str = "queued"
+    attempts: int = 0
+    worker: Optional[str] = None
+    result: Any = None
+    error: Optional[dict] = None
+    cancel_reason: Optional[str] = None
+
+class JobStore(abc.ABC):
+    """
+    Where jobs, their results and shared cache entries live.
+
+    A job is `queued` until a worker claims it, then `running` under a lease the
+    worker renews. A job whose lease runs out (its worker crashed or hung) is
+    claimed again, up to `max_attempts` claims in all. Claims follow the crew
+    scheduler's order across every instance: interactive tenants before batch
+    ones, and within a priority the tenant with the smallest virtual time, which
+    each claim advances by 1 / weight, then the tenant's oldest job. Finished jobs
+    (`done`, `failed` or `cancelled`) are kept for `result_ttl` seconds; a submit
+    with the id of a queued, running or done job attaches to it instead.
+    """
+
+    @abc.abstractmethod
+    def submit(self, job: Job, result_ttl: float) -> bool:
+        """Adds `job`, or attaches another waiter to the job with its id; True when it was added."""
+
+    @abc.abstractmethod
+    def claim(self, worker: str, lease_seconds: float, max_attempts: int) -> Optional[Job]:
+        """Takes the next job under a lease; None when nothing is queued."""
+
+    @abc.abstractmethod
+    def renew(self, job_id: str, worker: str, lease_seconds: float) -> Optional[Tuple[float, Optional[str]]]:
+        """Extends the lease; returns the job's (deadline_at, cancel_reason), or None when the worker lost it."""
+
+    @abc.abstractmethod
+    def finish(self, job_id: str, worker: str, status: str, result: Any, error: Optional[dict], result_ttl: float) -> bool:
+        """Records the outcome, unless the worker no longer holds the lease."""
+
+    @abc.abstractmethod
+    def release(self, job_id: str, worker: str):
+        """Puts a running job back at the head of the queue, e.g. when its worker shuts down, or cancels it when nobody waits."""
+
+    @abc.abstractmethod
+    def leave(self, job_id: str, reason: str):
+        """A waiter gave up; once the last one leaves, the job is cancelled with `reason`."""
+
+    @abc.abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        """The job, or None once it expired."""
+
+    @abc.abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Jobs by status."""
+
+    @abc.abstractmethod
+    def cache_get(self, key: str) -> Any:
+        """A shared cache entry, or None when it is missing or expired."""
+
+    @abc.abstractmethod
+    def cache_put(self, key: str, value: Any, ttl: float):
+        """Stores a shared cache entry for `ttl` seconds."""
+
+class SQLiteJobStore(JobStore):
+    """
+    Jobs in a local SQLite file: shared by the workers of one host, for a single
+    instance and for tests. Connections are opened lazily per process and thread,
+    like the rate limiter's bucket store.
+    """
+
+    COLUMNS = ("id", "endpoint", "payload", "tenant", "options", "deadline_at", "status", "attempts",
+               "worker", "result", "error", "cancel_reason")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._purged = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, endpoint TEXT NOT NULL, payload TEXT NOT NULL, tenant TEXT NOT NULL, "
+                "options TEXT NOT NULL, deadline_at REAL NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL, "
+                "worker TEXT, lease_until REAL, waiters INTEGER NOT NULL, result TEXT, error TEXT, "
+                "cancel_reason TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created)")
+            conn.execute("CREATE TABLE IF NOT EXISTS tenants (name TEXT PRIMARY KEY, virtual_time REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _job(self, row) -> Job:
+        values = dict(zip(self.COLUMNS, row))
+        for name in ("payload", "tenant", "options", "result", "error"):
+            values[name] = json.loads(values[name]) if values[name] is not None else None
+        return Job(**values)
+
+    def submit(self, job: Job, result_ttl: float) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status, updated FROM jobs WHERE id = ?", (job.id,)).fetchone()
+            if row is not None and (row[0] in ("queued", "running") or (row[0] == "done" and row[1] > now - result_ttl)):
+                conn.execute(
+                    "UPDATE jobs SET waiters = waiters + 1, deadline_at = MAX(deadline_at, ?) WHERE id = ?",
+                    (job.deadline_at, job.id),
+                )
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, endpoint, payload, tenant, options, deadline_at, status, attempts, "
+                "waiters, created, updated) VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, 1, ?, ?)",
+                (job.id, job.endpoint, json.dumps(job.payload, default=str), json.dumps(job.tenant),
+                 json.dumps(job.options, default=str), job.deadline_at, now, now),
+            )
+        return True
+
+    def claim(self, worker: str, lease_seconds: float, max_attempts: int) -> Optional[Job]:
+        now = time.time()
+        with self._transaction() as conn:
+            # Nobody is waiting for a job past its deadline any more
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel_reason = 'deadline', updated = ? "
+                "WHERE deadline_at <= ? AND (status = 'queued' OR (status = 'running' AND lease_until <= ?))",
+                (now, now, now),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated = ? "
+                "WHERE status = 'running' AND lease_until <= ? AND attempts >= ?",
+                (json.dumps(abandoned_error(max_attempts)), now, now, max_attempts),
+            )
+            row = conn.execute(
+                "WITH ready AS (SELECT id, created, json_extract(tenant, '$.name') AS name, "
+                "COALESCE(json_extract(tenant, '$.weight'), 1) AS weight, "
+                "CASE json_extract(tenant, '$.priority') WHEN 'batch' THEN 1 ELSE 0 END AS rank "
+                "FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until <= ?)) "
+                "SELECT ready.id, ready.name, ready.weight, COALESCE(tenants.virtual_time, 0), "
+                "(SELECT MIN(COALESCE(t.virtual_time, 0)) FROM ready r LEFT JOIN tenants t ON t.name = r.name) "
+                "FROM ready LEFT JOIN tenants ON tenants.name = ready.name "
+                "ORDER BY ready.rank, COALESCE(tenants.virtual_time, 0), ready.created LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            # As in the crew scheduler, a tenant that was idle starts from the smallest virtual time waiting
+            job_id, tenant, weight, virtual_time, clock = row
+            conn.execute(
+                "INSERT INTO tenants (name, virtual_time) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET virtual_time = excluded.virtual_time",
+                (tenant, max(virtual_time, clock) + 1 / weight),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                (worker, now + lease_seconds, now, job_id),
+            )
+            return self._job(conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def renew(self, job_id: str, worker: str, lease_seconds: float) -> Optional[Tuple[float, Optional[str]]]:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT deadline_at, cancel_reason FROM jobs WHERE id = ? AND status = 'running' AND worker = ?",
+                (job_id, worker),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ?", (now + lease_seconds, now, job_id))
+            return row[0], row[1]
+
+    def finish(self, job_id: str, worker: str, status: str, result: Any, error: Optional[dict], result_ttl: float) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL, updated = ? "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (status, json.dumps(result, default=str), json.dumps(error) if error is not None else None, now, job_id, worker),
+            ).rowcount
+            if now - self._purged > 60:
+                self._purged = now
+                conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated < ?", (now - result_ttl,))
+                conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+        return updated == 1
+
+    def release(self, job_id: str, worker: str):
+        with self._transaction() as conn:
+            # Moved to the front of the queue: it has waited longest. Unless nobody waits for it any more
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN waiters > 0 THEN 'queued' ELSE 'cancelled' END, worker = NULL, "
+                "lease_until = NULL, attempts = attempts - 1, created = (SELECT MIN(created) FROM jobs) - 1, updated = ? "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time(), job_id, worker),
+            )
+
+    def leave(self, job_id: str, reason: str):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("UPDATE jobs SET waiters = waiters - 1 WHERE id = ?", (job_id,))
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel_reason = ?, updated = ? WHERE id = ? AND waiters <= 0 AND status = 'queued'",
+                (reason, now, job_id),
+            )
+            conn.execute(
+                "UPDATE jobs SET cancel_reason = ? WHERE id = ? AND waiters <= 0 AND status = 'running'",
+                (reason, job_id),
+            )
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._connection().execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def cache_get(self, key: str) -> Any:
+        row = self._connection().execute("SELECT value FROM cache WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def cache_put(self, key: str, value: Any, ttl: float):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value, default=str), time.time() + ttl),
+        )
+
+# Each script runs atomically on the Redis server. Jobs are hashes at <prefix>:job:<id>;
+# <prefix>:queued:<tenant> is a list of the tenant's ids (pushed on the left, claimed
+# from the right), <prefix>:ready:<priority> a sorted set of the tenants with queued
+# ids by virtual time, <prefix>:vtime a hash of every tenant's virtual time and
+# <prefix>:leases a sorted set of running ids by lease expiry.
+_READY = """
+-- A tenant that was idle joins at the smallest virtual time waiting, as in the crew scheduler
+local function ready(prefix, tenant, priority)
+    local tenants = prefix .. ':ready:' .. priority
+    if redis.call('ZSCORE', tenants, tenant) then
+        return
+    end
+    local virtual_time = tonumber(redis.call('HGET', prefix .. ':vtime', tenant) or '0')
+    local first = redis.call('ZRANGE', tenants, 0, 0, 'WITHSCORES')
+    if first[2] and tonumber(first[2]) > virtual_time then
+        virtual_time = tonumber(first[2])
+    end
+    redis.call('ZADD', tenants, virtual_time, tenant)
+end
+"""
+_SUBMIT = _READY + """
+local status = redis.call('HGET', KEYS[1], 'status')
+if status == 'queued' or status == 'running' or status == 'done' then
+    redis.call('HINCRBY', KEYS[1], 'waiters', 1)
+    if tonumber(ARGV[6]) > tonumber(redis.call('HGET', KEYS[1], 'deadline_at')) then
+        redis.call('HSET', KEYS[1], 'deadline_at', ARGV[6])
+    end
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'id', ARGV[1], 'endpoint', ARGV[2], 'payload', ARGV[3], 'tenant', ARGV[4], 'options', ARGV[5],
+    'deadline_at', ARGV[6], 'status', 'queued', 'attempts', 0, 'waiters', 1,
+    'tenant_name', ARGV[9], 'priority', ARGV[10], 'weight', ARGV[11])
+redis.call('EXPIREAT', KEYS[1], math.ceil(tonumber(ARGV[6]) + tonumber(ARGV[7])))
+redis.call('LPUSH', ARGV[8] .. ':queued:' .. ARGV[9], ARGV[1])
+ready(ARGV[8], ARGV[9], ARGV[10])
+return 1
+"""
+_CLAIM = """
+local now = tonumber(ARGV[1])
+local prefix = ARGV[5]
+while true do
+    -- Expired leases first, then the queue of the first tenant in priority and virtual time
+    -- order; a stale id (of a job since finished or resubmitted) is skipped
+    local expected = 'running'
+    local id = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 1)[1]
+    local tenants, tenant, virtual_time, queue
+    if id then
+        redis.call('ZREM', KEYS[1], id)
+    else
+        expected = 'queued'
+        for _, priority in ipairs({'interactive', 'batch'}) do
+            local first = redis.call('ZRANGE', prefix .. ':ready:' .. priority, 0, 0, 'WITHSCORES')
+            if first[1] then
+                tenants, tenant, virtual_time = prefix .. ':ready:' .. priority, first[1], tonumber(first[2])
+                break
+            end
+        end
+        if not tenant then
+            return false
+        end
+        queue = prefix .. ':queued:' .. tenant
+        id = redis.call('RPOP', queue)
+        if redis.call('LLEN', queue) == 0 then
+            redis.call('ZREM', tenants, tenant)
+        end
+    end
+    local key = prefix .. ':job:' .. (id or '')
+    local job = redis.call('HMGET', key, 'status', 'deadline_at', 'attempts', 'weight')
+    if id and job[1] == expected then
+        if tonumber(job[2]) <= now then
+            redis.call('HSET', key, 'status', 'cancelled', 'cancel_reason', 'deadline')
+        elseif tonumber(job[3]) >= tonumber(ARGV[4]) then
+            redis.call('HSET', key, 'status', 'failed', 'error', ARGV[6])
+        else
+            redis.call('HSET', key, 'status', 'running', 'worker', ARGV[2])
+            redis.call('HDEL', key, 'cancel_reason')
+            redis.call('HINCRBY', key, 'attempts', 1)
+            redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), id)
+            if tenant then
+                virtual_time = virtual_time + 1 / tonumber(job[4] or '1')
+                redis.call('HSET', prefix .. ':vtime', tenant, virtual_time)
+                if redis.call('LLEN', queue) > 0 then
+                    redis.call('ZADD', tenants, virtual_time, tenant)
+                end
+            end
+            return id
+        end
+    end
+end
+"""
+_RENEW = """
+local job = redis.call('HMGET', KEYS[1], 'status', 'worker', 'deadline_at', 'cancel_reason')
+if job[1] ~= 'running' or job[2] ~= ARGV[2] then
+    return false
+end
+redis.call('ZADD', KEYS[2], tonumber(ARGV[3]), ARGV[1])
+return {job[3], job[4] or ''}
+"""
+_FINISH = """
+local job = redis.call('HMGET', KEYS[1], 'status', 'worker')
+if job[1] ~= 'running' or job[2] ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HSET', KEYS[1], 'status', ARGV[3], 'result', ARGV[4], 'error', ARGV[5])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[6])))
+return 1
+"""
+_RELEASE = _READY + """
+local job = redis.call('HMGET', KEYS[1], 'status', 'worker', 'waiters', 'tenant_name', 'priority')
+if job[1] == 'running' and job[2] == ARGV[2] then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[1], 'worker')
+    redis.call('HINCRBY', KEYS[1], 'attempts', -1)
+    if tonumber(job[3]) > 0 then
+        redis.call('HSET', KEYS[1], 'status', 'queued')
+        redis.call('RPUSH', ARGV[3] .. ':queued:' .. job[4], ARGV[1])
+        ready(ARGV[3], job[4], job[5])
+    else
+        redis.call('HSET', KEYS[1], 'status', 'cancelled')
+    end
+end
+"""
+_LEAVE = """
+if not redis.call('HGET', KEYS[1], 'status') then
+    return
+end
+local waiters = redis.call('HINCRBY', KEYS[1], 'waiters', -1)
+local status = redis.call('HGET', KEYS[1], 'status')
+if waiters <= 0 and status == 'queued' then
+    redis.call('HSET', KEYS[1], 'status', 'cancelled', 'cancel_reason', ARGV[1])
+elseif waiters <= 0 and status == 'running' then
+    redis.call('HSET', KEYS[1], 'cancel_reason', ARGV[1])
+end
+"""
+
+class RedisJobStore(JobStore):
+    """
+    Jobs in Redis (or anything speaking its protocol), shared by every instance.
+    Lease expiry is judged by the claiming instance's clock, so instance clocks
+    must agree to well within the lease.
+    """
+
+    def __init__(self, url: str, prefix: str):
+        if redis is None:
+            raise RuntimeError("WORK_QUEUE_URL points at Redis, but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._scripts = {
+            name: self.client.register_script(script)
+            for name, script in (("submit", _SUBMIT), ("claim", _CLAIM), ("renew", _RENEW), ("finish", _FINISH),
+                                 ("release", _RELEASE), ("leave", _LEAVE))
+        }
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    @property
+    def _leases(self) -> str:
+        return f"{self.prefix}:leases"
+
+    def submit(self, job: Job, result_ttl: float) -> bool:
+        return bool(self._scripts["submit"](
+            keys=[self._key(job.id)],
+            args=[job.id, job.endpoint, json.dumps(job.payload, default=str), json.dumps(job.tenant),
+                  json.dumps(job.options, default=str), job.deadline_at, result_ttl, self.prefix,
+                  job.tenant["name"], job.tenant.get("priority", "interactive"), job.tenant.get("weight", 1.0)],
+        ))
+
+    def claim(self, worker: str, lease_seconds: float, max_attempts: int) -> Optional[Job]:
+        job_id = self._scripts["claim"](
+            keys=[self._leases],
+            args=[time.time(), worker, lease_seconds, max_attempts, self.prefix, json.dumps(abandoned_error(max_attempts))],
+        )
+        return self.get(job_id.decode()) if job_id else None
+
+    def renew(self, job_id: str, worker: str, lease_seconds: float) -> Optional[Tuple[float, Optional[str]]]:
+        state = self._scripts["renew"](keys=[self._key(job_id), self._leases], args=[job_id, worker, time.time() + lease_seconds])
+        if not state:
+            return None
+        return float(state[0]), state[1].decode() or None
+
+    def finish(self, job_id: str, worker: str, status: str, result: Any, error: Optional[dict], result_ttl: float) -> bool:
+        return bool(self._scripts["finish"](
+            keys=[self._key(job_id), self._leases],
+            args=[job_id, worker, status, json.dumps(result, default=str), json.dumps(error), result_ttl],
+        ))
+
+    def release(self, job_id: str, worker: str):
+        self._scripts["release"](keys=[self._key(job_id), self._leases], args=[job_id, worker, self.prefix])
+
+    def leave(self, job_id: str, reason: str):
+        self._scripts["leave"](keys=[self._key(job_id)], args=[reason])
+
+    def get(self, job_id: str) -> Optional[Job]:
+        values = {key.decode(): value.decode() for key, value in self.client.hgetall(self._key(job_id)).items()}
+        if not values:
+            return None
+        return Job(
+            id=values["id"],
+            endpoint=values["endpoint"],
+            payload=json.loads(values["payload"]),
+            tenant=json.loads(values["tenant"]),
+            options=json.loads(values["options"]),
+            deadline_at=float(values["deadline_at"]),
+            status=values["status"],
+            attempts=int(values["attempts"]),
+            worker=values.get("worker"),
+            result=json.loads(values["result"]) if "result" in values else None,
+            error=json.loads(values["error"]) if "error" in values else None,
+            cancel_reason=values.get("cancel_reason"),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        # Queued ids of cancelled jobs stay in the lists until a claim skips them, so this is an upper bound
+        tenants = {tenant.decode() for priority in PRIORITY_ORDER
+                   for tenant in self.client.zrange(f"{self.prefix}:ready:{priority}", 0, -1)}
+        pipeline = self.client.pipeline(transaction=False)
+        for tenant in tenants:
+            pipeline.llen(f"{self.prefix}:queued:{tenant}")
+        return {"queued": sum(pipeline.execute()), "running": self.client.zcard(self._leases)}
+
+    def cache_get(self, key: str) -> Any:
+        value = self.client.get(f"{self.prefix}:cache:{key}")
+        return json.loads(value) if value is not None else None
+
+    def cache_put(self, key: str, value: Any, ttl: float):
+        self.client.set(f"{self.prefix}:cache:{key}", json.dumps(value, default=str), ex=max(1, int(ttl)))
+
+def abandoned_error(max_attempts: int) -> dict:
+    return {"status_code": 500, "detail": f"The job was abandoned by {max_attempts} workers"}
+
+def error_detail(error: Exception) -> dict:
+    """How a failed job's exception is raised again, as an HTTPException, on the instance that received the request."""
+    if isinstance(error, HTTPException):
+        return {"status_code": error.status_code, "detail": error.detail, "headers": error.headers}
+    if isinstance(error, UpstreamCapacityError):
+        return {"status_code": 503, "detail": str(error), "headers": error.headers}
+    return {"status_code": 500, "detail": f"{type(error).__name__}: {error}"}
+
+def open_store(url: str) -> Optional[JobStore]:
+    """WORK_QUEUE_URL: empty (every worker runs its own requests), sqlite:///<path> or redis://..."""
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisJobStore(url, prefix=os.environ.get("WORK_QUEUE_PREFIX", "crews"))
+    return SQLiteJobStore(url[len("sqlite:///"):] if url.startswith("sqlite:///") else url)
+
+class WorkQueue:
+    """
+    Runs crews on whichever worker, on any instance, has a free consumer.
+
+    `submit` (on the worker that received the request) adds a job and waits for its
+    result. Each worker runs `concurrency` consumers that claim jobs, run them with
+    `run(job, deadline)` and renew their lease every third of `lease_seconds`. A
+    renewal hands the worker later deadlines of new waiters, and cancels the run
+    once every waiter has left. Jobs of a worker that shuts down are put back at
+    the head of the queue; those of a worker that crashed are claimed again when
+    their lease runs out.
+    """
+
+    def __init__(self, store: Optional[JobStore], concurrency: int, lease_seconds: float, max_attempts: int,
+                 poll_seconds: float, result_ttl: float):
+        self.store = store
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.result_ttl = result_ttl
+        self.worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.queued = 0
+        self._running: Dict[str, Deadline] = {}
+        self._consumers = []
+        self._stats = {"submitted": 0, "attached": 0, "claimed": 0, "reclaimed": 0, "completed": 0, "failed": 0,
+                       "cancelled": 0, "released": 0, "leases_lost": 0}
+
+    @classmethod
+    def from_env(cls) -> "WorkQueue":
+        return cls(
+            open_store(os.environ.get("WORK_QUEUE_URL", "")),
+            concurrency=int(os.environ.get("WORK_QUEUE_CONCURRENCY") or os.environ.get("CREW_CONCURRENCY", 4)),
+            lease_seconds=float(os.environ.get("WORK_QUEUE_LEASE_SECONDS", 30)),
+            max_attempts=int(os.environ.get("WORK_QUEUE_MAX_ATTEMPTS", 3)),
+            poll_seconds=float(os.environ.get("WORK_QUEUE_POLL_SECONDS", 0.25)),
+            result_ttl=float(os.environ.get("WORK_QUEUE_RESULT_TTL_SECONDS", 3600)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.store is not None
+
+    async def submit(self, job: Job, deadline: Deadline):
+        """Waits for the job's result; cancelling the wait leaves the job with `deadline.reason`."""
+        job.deadline_at = time.time() + deadline.remaining()
+        added = await asyncio.to_thread(self.store.submit, job, self.result_ttl)
+        self._stats["submitted" if added else "attached"] += 1
+        try:
+            while True:
+                current = await asyncio.to_thread(self.store.get, job.id)
+                if current is None:
+                    raise HTTPException(status_code=500, detail="The job was lost from the work queue")
+                if current.status == "done":
+                    return current.result
+                if current.status == "failed":
+                    raise HTTPException(**current.error)
+                if current.status == "cancelled":
+                    raise RequestCancelled(current.cancel_reason or "cancelled")
+                await asyncio.sleep(self.poll_seconds)
+        except asyncio.CancelledError:
+            await asyncio.shield(asyncio.to_thread(self.store.leave, job.id, deadline.reason or "abandoned"))
+            raise
+
+    def start(self, run: Callable[[Job, Deadline], Awaitable[Any]]):
+        loop = asyncio.get_running_loop()
+        self._consumers = [loop.create_task(self._consume(run)) for _ in range(self.concurrency)]
+        self._consumers.append(loop.create_task(self._count()))
+        logger.info(f"Work queue consumer {self.worker} started with {self.concurrency} consumers")
+
+    async def stop(self):
+        for deadline in self._running.values():
+            deadline.cancel("shutdown")
+        for task in self._consumers:
+            task.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+
+    async def _count(self):
+        while True:
+            try:
+                self.queued = (await asyncio.to_thread(self.store.counts)).get("queued", 0)
+            except Exception as e:
+                logger.warning(f"Could not read the work queue's depth: {e}")
+            await asyncio.sleep(max(1.0, self.poll_seconds * 4))
+
+    async def _consume(self, run):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim, self.worker, self.lease_seconds, self.max_attempts)
+            except Exception as e:
+                logger.warning(f"Could not claim a job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_seconds)
+                continue
+            self._stats["claimed"] += 1
+            if job.attempts > 1:
+                self._stats["reclaimed"] += 1
+                logger.info(f"Reclaimed job {job.id} after a lost lease (attempt {job.attempts})")
+            await self._execute(job, run)
+
+    async def _execute(self, job: Job, run):
+        deadline = Deadline(time.monotonic() + job.deadline_at - time.time())
+        self._running[job.id] = deadline
+        renewal = asyncio.create_task(self._renew(job, deadline))
+        status, result, error = "done", None, None
+        try:
+            result = await run(job, deadline)
+        except asyncio.CancelledError:
+            # Shutting down: another worker picks the job up straight away
+            await asyncio.shield(asyncio.to_thread(self.store.release, job.id, self.worker))
+            self._stats["released"] += 1
+            raise
+        except RequestCancelled:
+            status, error = "cancelled", None
+        except Exception as e:
+            status, error = "failed", error_detail(e)
+        finally:
+            renewal.cancel()
+            del self._running[job.id]
+
+        self._stats[{"done": "completed", "failed": "failed", "cancelled": "cancelled"}[status]] += 1
+        if not await asyncio.to_thread(self.store.finish, job.id, self.worker, status, result, error, self.result_ttl):
+            logger.warning(f"Job {job.id} finished after its lease was lost; the result was dropped")
+
+    async def _renew(self, job: Job, deadline: Deadline):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                state = await asyncio.to_thread(self.store.renew, job.id, self.worker, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"Could not renew the lease of job {job.id}: {e}")
+                continue
+            if state is None:
+                self._stats["leases_lost"] += 1
+                deadline.cancel("lease_lost")
+                return
+            deadline_at, cancel_reason = state
+            deadline.extend(time.monotonic() + deadline_at - time.time())
+            if cancel_reason:
+                deadline.cancel(cancel_reason)
+
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        return {"enabled": True, "worker": self.worker, "running": len(self._running), "jobs": self.store.counts(), **self._stats}
+
+work_queue = WorkQueue.from_env()
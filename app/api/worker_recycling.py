@@ -0,0 +1,45 @@
+import os
+import resource
+import signal
+from app.api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        # Peak RSS is the best we can do without /proc (kilobytes on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class WorkerRecycleMiddleware:
+    """
+    Gracefully restarts a gunicorn worker whose memory grew too much.
+
+    After each response the worker compares its RSS with the value measured at its
+    first request; past WEB_MAX_RSS_GROWTH_MB it sends itself SIGTERM, finishes the
+    requests it is serving and the master replaces it. Outside gunicorn (no
+    WEB_WORKER in the environment) it does nothing.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.max_growth_mb = float(os.environ.get("WEB_MAX_RSS_GROWTH_MB", 300))
+        self.baseline_mb = None
+        self.recycling = False
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope["type"] != "http" or self.recycling or not os.environ.get("WEB_WORKER"):
+            return
+
+        rss = current_rss_mb()
+        if self.baseline_mb is None:
+            self.baseline_mb = rss
+        elif rss - self.baseline_mb > self.max_growth_mb:
+            self.recycling = True
+            logger.warning(f"Worker {os.getpid()} grew {rss - self.baseline_mb:.0f}MB, recycling")
+            os.kill(os.getpid(), signal.SIGTERM)
@@ -3,10 +3,21 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from app.api.router import router
+from app.api.router import router, run_job
 from app.api.logger import setup_logger
 from app.api.error_utilities import ErrorResponse
+from app.api.rate_limiter import UpstreamCapacityError
+from app.api.worker_recycling import WorkerRecycleMiddleware
+from app.api.responses import CompressionMiddleware, FastJSONResponse
+from app.api.tools import warm_shared_tools
+from app.api.runtime_monitor import THREAD_POOL_SIZE, RuntimeMonitorMiddleware, monitor
+from app.api.scheduler import scheduler
+from app.api.coalescing import coalescer
+from app.api.rate_limiter import limiter_stats
+from app.api.work_queue import work_queue
+from app.api.admission import load_tokenizer
 
+import asyncio
 import os
 
 from dotenv import load_dotenv, find_dotenv
@@ -18,12 +29,25 @@ logger = setup_logger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info(f"Initializing Application Startup")
+    monitor.gauge("crews_waiting", scheduler.queue_depth)
+    monitor.gauge("crews_running", lambda: scheduler.in_flight)
+    monitor.gauge("coalesced_runs", lambda: coalescer.in_flight)
+    monitor.gauge("llm_calls_waiting", lambda: sum(stats["waiting"] for stats in limiter_stats().values()))
+    monitor.gauge("work_queue_queued", lambda: work_queue.queued)
+    monitor.start(THREAD_POOL_SIZE)
+    await asyncio.to_thread(warm_shared_tools)
+    await asyncio.to_thread(load_tokenizer)
+    if work_queue.enabled:
+        work_queue.start(run_job)
     logger.info(f"Successfully Completed Application Startup")
     
     yield
+    if work_queue.enabled:
+        await work_queue.stop()
+    await monitor.stop()
     logger.info("Application shutdown")
 
-app = FastAPI(lifespan = lifespan)
+app = FastAPI(lifespan = lifespan, default_response_class = FastJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -31,6 +55,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(WorkerRecycleMiddleware)
+app.add_middleware(RuntimeMonitorMiddleware, monitor=monitor)
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.environ.get("COMPRESSION_MINIMUM_SIZE", 1024)))
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -48,4 +75,14 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content=error_response.dict()
     )
 
+@app.exception_handler(UpstreamCapacityError)
+async def upstream_capacity_exception_handler(request: Request, exc: UpstreamCapacityError):
+    logger.error(str(exc))
+    error_response = ErrorResponse(status=503, message=str(exc))
+    return JSONResponse(
+        status_code=503,
+        content=error_response.dict(),
+        headers=exc.headers
+    )
+
 app.include_router(router)
\ No newline at end of file
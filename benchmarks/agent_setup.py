@@ -0,0 +1,100 @@
+"""
+Per-request setup cost of a crew's agents: building everything per request vs binding templates.
+
+    PYTHONPATH=. python benchmarks/agent_setup.py [--runs 200]
+
+"per-request" reproduces what `CustomAgents` used to do for the refactoring crew on
+every request: two new chat model clients and a new set of research tools for each of
+the four agents. "templates" calls the same tool factories and `get_chat_model` that
+`AgentTemplate.bind()` uses. Tools that cannot be built here (Wikidata and Tavily need
+the network or an API key) are skipped in both columns. Constructing the `Agent`
+itself is timed only when it works offline (CrewAI loads a tiktoken encoding).
+"""
+import argparse
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain.tools import Tool
+from langchain_community.tools import WikipediaQueryRun
+from langchain_community.tools.wikidata.tool import WikidataAPIWrapper, WikidataQueryRun
+from langchain_community.utilities import ArxivAPIWrapper, WikipediaAPIWrapper
+from langchain_experimental.tools import PythonREPLTool
+
+from app.api import tools
+from app.api.llm import ManagedChatOpenAI, get_chat_model
+from app.api.features.refactoring_assistant.crew import (
+    ANALYSIS_AGENT, OPPORTUNITY_AGENT, SUGGESTION_AGENT, REFACTORING_AGENT
+)
+
+TEMPLATES = (ANALYSIS_AGENT, OPPORTUNITY_AGENT, SUGGESTION_AGENT, REFACTORING_AGENT)
+
+def _buildable(factory):
+    try:
+        factory()
+        return True
+    except Exception:
+        return False
+
+WIKIDATA = _buildable(lambda: WikidataAPIWrapper())
+
+def per_request():
+    llms = [ManagedChatOpenAI(model="gpt-4o-mini", temperature=0), ManagedChatOpenAI(model="gpt-4o", temperature=0)]
+    agent_tools = []
+    for template in TEMPLATES:
+        if tools.python_repl_tool in template.tools:
+            agent_tools.append([PythonREPLTool()])
+            continue
+        research = [WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper())]
+        if WIKIDATA:
+            research.append(WikidataQueryRun(api_wrapper=WikidataAPIWrapper()))
+        research.append(Tool(name="Arxiv", func=ArxivAPIWrapper().run, description="Arxiv"))
+        agent_tools.append(research)
+    return llms, agent_tools
+
+def templated():
+    bound = []
+    for template in TEMPLATES:
+        built = []
+        for factory in template.tools:
+            if factory is tools.wikidata_query_tool and not WIKIDATA:
+                continue
+            built.append(factory())
+        bound.append((built, get_chat_model(template.model)))
+    return bound
+
+def measure(setup, runs):
+    setup()  # warm caches, as a running worker would be
+    start = time.perf_counter()
+    for _ in range(runs):
+        setup()
+    elapsed = (time.perf_counter() - start) / runs
+    tracemalloc.start()
+    setup()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed * 1000, current / 1024, peak / 1024
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"Wikidata tool {'included' if WIKIDATA else 'skipped (offline)'}")
+    print(f"{'setup':<14} {'ms/request':>11} {'retained KB':>12} {'peak KB':>9}")
+    for name, setup in (("per-request", per_request), ("templates", templated)):
+        ms, retained, peak = measure(setup, args.runs)
+        print(f"{name:<14} {ms:>11.3f} {retained:>12.1f} {peak:>9.1f}")
+
+    try:
+        ANALYSIS_AGENT.bind()
+    except Exception as e:
+        print(f"Agent construction not measured: {type(e).__name__}")
+        return
+    ms, retained, peak = measure(lambda: [template.bind() for template in TEMPLATES], max(1, args.runs // 10))
+    print(f"{'bind (agents)':<14} {ms:>11.3f} {retained:>12.1f} {peak:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Bulk mode against the local stand-in server: the same runs done interactively,
+one chat completion at a time, and in batch rounds.
+
+    PYTHONPATH=. python benchmarks/bulk.py [--runs 200] [--endpoint /doc-generator-assistant]
+
+The crews are replaced by a stand-in that makes one LLM call per stage of the
+endpoint's standard pipeline, on that stage's model, through the app's managed
+chat models; agents cannot be built offline. Interactively, --interactive-slots
+runs go at a time, as the crew scheduler allows, and each call takes about
+--latency-ms. In bulk mode every run's next call waits for the round, and each
+round's batches complete --batch-ms after they are created, with an
+--error-ratio share of lines failing and retried in the next round. Prints, for
+each mode, the wall time under those configured latencies, the requests made to
+the server, and the tokens priced at interactive and batch prices
+(BULK_PRICE_RATIO).
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PORT = 9011
+
+def configure(args):
+    os.environ.setdefault("ENV_TYPE", "dev")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["LLM_BACKENDS"] = f'[{{"name": "stub", "base_url": "http://127.0.0.1:{PORT}/v1"}}]'
+    os.environ["BULK_POLL_SECONDS"] = "0.1"
+    os.environ["LLM_RATE_LIMITS"] = "{}"
+
+def stand_in_crew(endpoint: str):
+    from langchain_core.messages import HumanMessage
+    from app.api.admission import pipeline
+    from app.api.llm import get_chat_model
+
+    def crew(data):
+        output = data.code_snippet
+        for stage in pipeline(endpoint):
+            # Each stage reads the previous one's output, like a sequential crew
+            message = HumanMessage(content=f"{stage.role}: {data.code_snippet}\n\nPrevious output: {output}")
+            output = get_chat_model(stage.model).invoke([message]).content
+        return {"documentation": output}
+    return crew
+
+def payloads(runs: int):
+    return [{"code_snippet": f"def f{i}(x):\n    return x * {i}\n" * 20, "language": "python"} for i in range(runs)]
+
+def priced(usage: dict) -> float:
+    from app.api.admission import admission
+    total = 0.0
+    for model, (prompt, completion) in usage.items():
+        input_price, output_price = admission.prices.get(model, admission.prices["gpt-4o"])
+        total += (prompt * input_price + completion * output_price) / 1_000_000
+    return total
+
+def main(args):
+    configure(args)
+    sys.path.insert(0, os.path.dirname(__file__))
+    from stub_openai_server import StubOptions, serve
+    from app.api import router
+    from app.api.bulk import BATCH_PRICE_RATIO, run_bulk
+    from app.api.batching import BatchRounds
+    from app.api.request_context import record_usage
+
+    options = StubOptions(latency_ms=args.latency_ms, batch_ms=args.batch_ms, seed=1)
+    server = serve(PORT, options)
+    schema, _ = router.CREW_ENDPOINTS[args.endpoint]
+    crew = stand_in_crew(args.endpoint)
+    router.CREW_ENDPOINTS[args.endpoint] = (schema, crew)
+    inputs = payloads(args.runs)
+
+    # Interactive: the usual path, a few crews at a time
+    def interactive(payload):
+        with record_usage() as recorder:
+            crew(schema(**payload))
+        return recorder
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.interactive_slots) as pool:
+        recorders = list(pool.map(interactive, inputs))
+    interactive_seconds = time.monotonic() - started
+    interactive_requests = options.stats["requests"]
+    prompt = sum(recorder.prompt_tokens for recorder in recorders)
+    completion = sum(recorder.completion_tokens for recorder in recorders)
+
+    # Bulk: batch rounds. Failures apply to batch lines only, to exercise the retry rounds
+    options.error_ratio = args.error_ratio
+    rounds = BatchRounds.from_env()
+    rounds.start()
+    started = time.monotonic()
+    results = run_bulk(args.endpoint, inputs, rounds)
+    bulk_seconds = time.monotonic() - started
+    rounds.stop()
+    failed = [result for result in results if "error" in result]
+    usage = {model: tokens for model, tokens in rounds.usage.items()}
+
+    print(f"{args.runs} runs of {args.endpoint}, stub latency {args.latency_ms:.0f} ms per call, {args.batch_ms:.0f} ms per batch")
+    print(f"  interactive ({args.interactive_slots} at a time): {interactive_seconds:.1f}s, "
+          f"{interactive_requests} chat completion requests, {prompt + completion} tokens")
+    print(f"  bulk: {bulk_seconds:.1f}s, {rounds.rounds} rounds, {rounds.batches} batches of {rounds.calls} calls "
+          f"({rounds.retried} retried), {sum(sum(tokens) for tokens in usage.values())} tokens, {len(failed)} failed runs")
+    interactive_cost = priced(usage)
+    print(f"  cost of the same tokens: ${interactive_cost:.4f} interactive, ${interactive_cost * BATCH_PRICE_RATIO:.4f} batched "
+          f"({args.runs / max(interactive_cost, 1e-9):.0f} vs {args.runs / max(interactive_cost * BATCH_PRICE_RATIO, 1e-9):.0f} runs per dollar)")
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--endpoint", default="/doc-generator-assistant")
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--batch-ms", type=float, default=2000.0)
+    parser.add_argument("--interactive-slots", type=int, default=8)
+    parser.add_argument("--error-ratio", type=float, default=0.0, help="share of batch lines that fail")
+    main(parser.parse_args())
@@ -0,0 +1,97 @@
+"""
+Tail latency of LLM calls with and without hedging, against two local stub servers.
+
+    PYTHONPATH=. python benchmarks/hedging.py [--calls 400] [--concurrency 8]
+
+The primary stub answers in about --latency-ms, except for a --slow-ratio share of
+calls that take --slow-ms; the backup stub has the same latency and no slow tail.
+The same calls are made through `get_chat_model` without a hedge key (failover
+only) and with one, after --warmup calls that give the hedged role its latency
+percentile. Prints latency percentiles for both runs and how often hedges fired
+and won. Pass --primary-error-ratio to see failover instead.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+from stub_openai_server import StubOptions, serve
+
+def configure(args):
+    # Before the app modules are imported: backends and limiters are read from the environment
+    os.environ["LLM_BACKENDS"] = (
+        f'[{{"name": "primary", "base_url": "http://127.0.0.1:{args.port}/v1", "api_key_env": "STUB_API_KEY"}},'
+        f' {{"name": "backup", "base_url": "http://127.0.0.1:{args.port + 1}/v1", "api_key_env": "STUB_API_KEY"}}]'
+    )
+    os.environ["STUB_API_KEY"] = "sk-stub"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+    os.environ["LLM_RATE_LIMITS"] = '{"gpt-4o": {"rpm": 1000000, "tpm": 1000000000}}'
+    os.environ["LLM_RATE_LIMIT_DB"] = os.path.join(tempfile.mkdtemp(), "limits.sqlite3")
+    os.environ["LLM_HEDGE_BUDGET_PER_MINUTE"] = str(args.hedge_budget_per_minute)
+
+def run(chat_model, calls: int, concurrency: int):
+    from langchain_core.messages import HumanMessage
+
+    messages = [HumanMessage(content="Identify refactoring opportunities in the following code.\n" + "x = 1\n" * 200)]
+
+    def one(_):
+        started = time.perf_counter()
+        chat_model.invoke(messages)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return sorted(pool.map(one, range(calls)))
+
+def report(name: str, latencies):
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+    print(f"{name:<10} mean {statistics.mean(latencies) * 1000:7.0f} ms  p50 {percentile(50):7.0f}  "
+          f"p95 {percentile(95):7.0f}  p99 {percentile(99):7.0f}  max {latencies[-1] * 1000:7.0f}")
+
+def main(args):
+    configure(args)
+    primary = StubOptions(args.latency_ms, args.slow_ratio, args.slow_ms, args.primary_error_ratio, seed=1)
+    backup = StubOptions(args.latency_ms, seed=2)
+    servers = [serve(args.port, primary), serve(args.port + 1, backup)]
+
+    from app.api.llm import get_chat_model
+    from app.api.llm_backends import backends
+    from app.api.metrics import counters
+
+    report("unhedged", run(get_chat_model("gpt-4o"), args.calls, args.concurrency))
+    hedged = get_chat_model("gpt-4o", hedge_key="benchmark")
+    run(hedged, args.warmup, args.concurrency)
+    before = counters.snapshot()
+    report("hedged", run(hedged, args.calls, args.concurrency))
+    after = counters.snapshot()
+
+    def delta(prefix):
+        return sum(value - before.get(key, 0) for key, value in after.items() if key.startswith(prefix))
+
+    delay = backends.hedge_delay(backends.backends[0], "gpt-4o", "benchmark")
+    print(f"hedge delay: {delay * 1000:.0f} ms (p{backends.hedge_percentile:g} of the role's latencies, at least {backends.hedge_min_delay * 1000:.0f} ms)")
+    fired = delta("llm_hedges_fired")
+    print(f"hedges:    fired {fired:.0f} ({100 * fired / args.calls:.1f}% of calls), won {delta('llm_hedges_won'):.0f}, "
+          f"skipped by budget {delta('llm_hedges_skipped'):.0f}, wasted tokens {delta('llm_hedge_tokens_wasted'):.0f}")
+    print(f"failovers: {delta('llm_failovers'):.0f}")
+    print(f"stubs:     primary {primary.stats}, backup {backup.stats}")
+    for server in servers:
+        server.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--slow-ratio", type=float, default=0.03)
+    parser.add_argument("--slow-ms", type=float, default=4000.0)
+    parser.add_argument("--primary-error-ratio", type=float, default=0.0)
+    parser.add_argument("--hedge-budget-per-minute", type=float, default=10.0)
+    main(parser.parse_args())
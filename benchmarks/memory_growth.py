@@ -0,0 +1,115 @@
+"""
+Memory leak regression check: serves many crew requests in-process and fails when RSS
+keeps growing.
+
+    PYTHONPATH=. python benchmarks/memory_growth.py [--requests 3000] [--max-growth-mb 20]
+
+Every request carries a different snippet, so the fingerprint cache, admission
+statistics, coalescer and scheduler all see new keys, the way they do in production.
+The crews are replaced by a stand-in that builds prompt-sized strings and a response
+of the usual shape, which keeps the run offline and isolates the serving layer;
+pass --live-crews to run the real crews instead (needs OpenAI access).
+
+After --warmup requests (long enough for the caches to fill up to their limits) the
+RSS is taken as the baseline. The check fails, with exit code 1, when the RSS after
+--requests more is over the baseline by more than --max-growth-mb. With --trace,
+the allocation sites that grew most are printed too.
+"""
+import argparse
+import gc
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("ENV_TYPE", "dev")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("FINGERPRINT_CACHE_SIZE", "512")
+
+from fastapi.testclient import TestClient
+
+from app.api import router
+from app.api.worker_recycling import current_rss_mb
+from app.main import app
+
+ENDPOINTS = ("/refactoring-assistant", "/multi-agent-debugging-assistant", "/doc-generator-assistant")
+CREWS = ("run_refactoring_assistant_crew", "run_multi_agent_debugging_crew", "run_documentation_generator_crew")
+
+def stand_in_crew(data):
+    # What four sequential tasks hold on to: the code in every prompt, and a verbose trace
+    prompts = [f"Stage {stage}\n{data.code_snippet}\n{data.context or ''}" for stage in range(4)]
+    trace = "\n".join(prompt[::-1] for prompt in prompts)
+    return {
+        "code_snippet": data.code_snippet,
+        "summary": trace[:200],
+        "issues": [{"issue_id": i, "description": f"issue {i}", "line_number": i, "severity": "low", "suggestion": None} for i in range(10)],
+    }
+
+def snippet(rng: random.Random, size_kb: int) -> str:
+    name = "".join(rng.choices(string.ascii_lowercase, k=12))
+    lines = [f"def {name}(values):", "    total = 0"]
+    while sum(len(line) + 1 for line in lines) < size_kb * 1024:
+        lines.append(f"    total += values[{rng.randrange(1000)}] * {rng.randrange(1000)}  # {name}")
+    lines.append("    return total")
+    return "\n".join(lines) + "\n"
+
+def serve(client: TestClient, rng: random.Random, count: int, size_kb: int) -> int:
+    errors = 0
+    for i in range(count):
+        endpoint = ENDPOINTS[i % len(ENDPOINTS)]
+        response = client.post(endpoint, json={"code_snippet": snippet(rng, size_kb), "context": f"request {i}"},
+                               headers={"api-key": os.environ["ENV_TYPE"]})
+        if response.status_code >= 400:
+            errors += 1
+    return errors
+
+def settled_rss_mb() -> float:
+    gc.collect()
+    return current_rss_mb()
+
+def main(args) -> int:
+    if not args.live_crews:
+        for crew in CREWS:
+            setattr(router, crew, stand_in_crew)
+    rng = random.Random(args.seed)
+    with TestClient(app) as client:
+        started_rss = settled_rss_mb()
+        errors = serve(client, rng, args.warmup, args.snippet_kb)
+        baseline = settled_rss_mb()
+        if args.trace:
+            tracemalloc.start(10)
+            before = tracemalloc.take_snapshot()
+        started = time.perf_counter()
+        errors += serve(client, rng, args.requests, args.snippet_kb)
+        elapsed = time.perf_counter() - started
+        final = settled_rss_mb()
+
+    growth = final - baseline
+    print(f"requests:        {args.warmup} warmup + {args.requests} measured ({errors} errors), {args.requests / elapsed:.0f} req/s")
+    print(f"rss mb:          start {started_rss:.1f}  after warmup {baseline:.1f}  final {final:.1f}")
+    print(f"growth:          {growth:+.1f} MB ({growth * 1000 / args.requests:+.2f} MB per 1000 requests), limit {args.max_growth_mb} MB")
+    if args.trace:
+        for stat in tracemalloc.take_snapshot().compare_to(before, "traceback")[:10]:
+            print(f"\n{stat.size_diff / 1024:+.1f} KB in {stat.count_diff:+d} blocks")
+            print("\n".join(stat.traceback.format()[-4:]))
+    if errors:
+        print("FAIL: some requests failed")
+        return 1
+    if growth > args.max_growth_mb:
+        print("FAIL: memory kept growing after warmup")
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--warmup", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--snippet-kb", type=int, default=4)
+    parser.add_argument("--max-growth-mb", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--live-crews", action="store_true")
+    parser.add_argument("--trace", action="store_true")
+    sys.exit(main(parser.parse_args()))
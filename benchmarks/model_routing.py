@@ -0,0 +1,128 @@
+"""
+Pipelines with every role on the API against the easy roles routed to a local
+inference server, through a model config file that is swapped while running.
+
+    PYTHONPATH=. python benchmarks/model_routing.py [--runs 40] [--concurrency 4]
+
+Two stub servers stand in for the API (about --api-latency-ms per call) and for
+a local OpenAI-compatible server (about --local-latency-ms); both latencies are
+configured, not measured. Each run makes one call per stage of the endpoint's
+pipeline with the chat model its agent template would bind. The runs go first
+without routes, then with --roles routed to the local server, written to the
+config file while the app is running. Prints the mean and p95 run time per
+endpoint and the calls each server took, how long the reload took to apply, and
+what a route lookup costs.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+from stub_openai_server import StubOptions, serve
+
+ENDPOINTS = ("/doc-generator-assistant", "/multi-agent-debugging-assistant")
+EASY_ROLES = "Code Parser,Examples Generator,Fix Planner,Bug Finder"
+LOCAL_MODEL = "qwen2.5-coder-1.5b-instruct"
+
+def configure(args, config_path: str):
+    os.environ.setdefault("ENV_TYPE", "dev")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["OPENAI_API_KEY"] = "sk-stub"
+    os.environ["LLM_BACKENDS"] = f'[{{"name": "api", "base_url": "http://127.0.0.1:{args.port}/v1"}}]'
+    os.environ["LLM_MODEL_CONFIG"] = config_path
+    os.environ["LLM_MODEL_CONFIG_CHECK_SECONDS"] = str(args.check_seconds)
+    os.environ["LLM_RATE_LIMITS"] = json.dumps({model: {"rpm": 1000000, "tpm": 1000000000}
+                                                for model in ("gpt-4o", "gpt-4o-mini", LOCAL_MODEL)})
+    os.environ["LLM_RATE_LIMIT_DB"] = os.path.join(tempfile.mkdtemp(), "limits.sqlite3")
+
+def write_config(path: str, config: dict):
+    # Written aside and renamed, so a reload never reads half a file
+    with open(path + ".tmp", "w") as f:
+        json.dump(config, f)
+    os.replace(path + ".tmp", path)
+
+def templates() -> dict:
+    from app.api.agent_templates import AgentTemplate
+    from app.api.features.doc_generator_assistant import crew as doc_crew
+    from app.api.features.multi_agent_debugging_assistant import crew as debugging_crew
+
+    return {value.role: value for module in (doc_crew, debugging_crew)
+            for value in vars(module).values() if isinstance(value, AgentTemplate)}
+
+def run(endpoint: str, by_role: dict, runs: int, concurrency: int):
+    from langchain_core.messages import HumanMessage
+    from app.api.admission import pipeline
+    from app.api.request_context import endpoint_scope
+
+    code = "def total(items):\n    return sum(item.price for item in items)\n" * 20
+
+    def one(_):
+        started = time.perf_counter()
+        with endpoint_scope(endpoint):
+            output = code
+            for stage in pipeline(endpoint):
+                message = HumanMessage(content=f"{stage.role}: {code}\n\nPrevious output: {output}")
+                output = by_role[stage.role].chat_model().invoke([message]).content
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return sorted(pool.map(one, range(runs)))
+
+def report(name: str, seconds, api: StubOptions, local: StubOptions, before: tuple):
+    p95 = seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))]
+    print(f"  {name:<34} mean {statistics.mean(seconds):5.2f} s  p95 {p95:5.2f} s  "
+          f"calls: api {api.stats['requests'] - before[0]:4}, local {local.stats['requests'] - before[1]:4}")
+
+def main(args):
+    config_path = os.path.join(tempfile.mkdtemp(), "models.json")
+    write_config(config_path, {})
+    configure(args, config_path)
+    api = StubOptions(args.api_latency_ms, seed=1)
+    local = StubOptions(args.local_latency_ms, seed=2)
+    servers = [serve(args.port, api), serve(args.port + 1, local)]
+    from app.api.model_config import model_routing
+
+    by_role = templates()
+    routed = {
+        "backends": [{"name": "local", "base_url": f"http://127.0.0.1:{args.port + 1}/v1"}],
+        "roles": {role: {"model": LOCAL_MODEL, "backend": "local"} for role in args.roles.split(",")},
+    }
+    print(f"{args.runs} runs per endpoint, {args.concurrency} at a time; stub latency "
+          f"{args.api_latency_ms:.0f} ms on the api, {args.local_latency_ms:.0f} ms on the local server")
+    for endpoint in ENDPOINTS:
+        before = (api.stats["requests"], local.stats["requests"])
+        report(f"{endpoint} (api only)", run(endpoint, by_role, args.runs, args.concurrency), api, local, before)
+
+    written = time.monotonic()
+    write_config(config_path, routed)
+    while model_routing.route(None, args.roles.split(",")[0]) is None:
+        time.sleep(0.01)
+    print(f"  routes applied {(time.monotonic() - written) * 1000:.0f} ms after the file was written "
+          f"(checked every {args.check_seconds:g} s)")
+    for endpoint in ENDPOINTS:
+        before = (api.stats["requests"], local.stats["requests"])
+        report(f"{endpoint} (easy roles local)", run(endpoint, by_role, args.runs, args.concurrency), api, local, before)
+
+    lookups = 100000
+    started = time.perf_counter()
+    for _ in range(lookups):
+        model_routing.route("/doc-generator-assistant", "Documentation Writer")
+    print(f"  route lookup: {(time.perf_counter() - started) / lookups * 1e6:.2f} us")
+    for server in servers:
+        server.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--port", type=int, default=9021)
+    parser.add_argument("--api-latency-ms", type=float, default=1500.0)
+    parser.add_argument("--local-latency-ms", type=float, default=400.0)
+    parser.add_argument("--roles", default=EASY_ROLES, help="comma-separated roles to route to the local server")
+    parser.add_argument("--check-seconds", type=float, default=1.0)
+    main(parser.parse_args())
@@ -0,0 +1,76 @@
+"""
+Serialization time and payload size for large crew outputs.
+
+    python benchmarks/serialization.py
+
+Compares the standard library encoder (what JSONResponse uses), orjson and
+MessagePack, and the size and cost of compressing each body with gzip and brotli,
+using a real standard library module as the code and documentation being returned.
+"""
+import argparse
+import gzip
+import inspect
+import json
+import timeit
+
+import brotli
+import msgpack
+import orjson
+
+def _documentation(module):
+    """Markdown in the shape the doc generator produces, built from a real module's docstrings."""
+    sections = [f"# Module `{module.__name__}`\n\n{inspect.getdoc(module) or ''}\n"]
+    for name, member in inspect.getmembers(module, lambda m: inspect.isclass(m) or inspect.isfunction(m)):
+        if getattr(member, "__module__", None) != module.__name__:
+            continue
+        try:
+            signature = str(inspect.signature(member))
+        except (TypeError, ValueError):
+            signature = "(...)"
+        sections.append(f"## `{name}{signature}`\n\n{inspect.getdoc(member) or 'No description.'}\n")
+        sections.append(f"```python\nfrom {module.__name__} import {name}\n```\n")
+    return "\n".join(sections)
+
+def payloads(module=argparse):
+    """Outputs for a real ~100 KB source file (argparse by default)."""
+    code = inspect.getsource(module)
+    functions = [name for name, _ in inspect.getmembers(module, inspect.isfunction)]
+    changes = {name: f"Simplified control flow in {name} and added type hints" for name in functions}
+    return {
+        "DocumentationOutput": {"documentation": _documentation(module)},
+        "RefactoredCode": {"code_snippet": code, "changes_made": changes, "new_dependencies": []},
+        "FixedCode": {
+            "code_snippet": code,
+            "changes_made": changes,
+            "bugs_fixed": list(range(len(functions))),
+            "new_dependencies": None,
+            "tests_performed": [f"test_{name}" for name in functions],
+            "performance_improvements": {"runtime": 0.12},
+            "remaining_issues": [],
+            "code_quality_metrics": {"maintainability_index": 71.5},
+            "documentation_updates": [],
+        },
+    }
+
+ENCODERS = {
+    "json (stdlib)": lambda content: json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+    "orjson": lambda content: orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS),
+    "msgpack": lambda content: msgpack.packb(content, use_bin_type=True),
+}
+
+def main():
+    print(f"{'payload':<20} {'encoder':<14} {'encode ms':>10} {'raw KB':>8} {'gzip KB':>8} {'br KB':>8} {'gzip ms':>8} {'br ms':>8}")
+    for name, content in payloads().items():
+        for encoder_name, encode in ENCODERS.items():
+            runs = 50
+            elapsed = timeit.timeit(lambda: encode(content), number=runs) / runs
+            body = encode(content)
+            gzipped = gzip.compress(body, compresslevel=6)
+            brotlied = brotli.compress(body, quality=5)
+            gzip_ms = timeit.timeit(lambda: gzip.compress(body, compresslevel=6), number=10) / 10 * 1000
+            brotli_ms = timeit.timeit(lambda: brotli.compress(body, quality=5), number=10) / 10 * 1000
+            print(f"{name:<20} {encoder_name:<14} {elapsed * 1000:>10.3f} {len(body) / 1024:>8.1f} "
+                  f"{len(gzipped) / 1024:>8.1f} {len(brotlied) / 1024:>8.1f} {gzip_ms:>8.2f} {brotli_ms:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Closed-loop load generator for a running server.
+
+    python benchmarks/serving_throughput.py --url http://localhost:8000/ --concurrency 32 --requests 2000
+
+Prints throughput and latency percentiles. Pass --method POST --body payload.json
+and --api-key to exercise the crew endpoints.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+async def _worker(client, args, body, latencies, errors, remaining):
+    while True:
+        if remaining[0] <= 0:
+            return
+        remaining[0] -= 1
+        started = time.perf_counter()
+        try:
+            response = await client.request(args.method, args.url, json=body, headers={"api-key": args.api_key})
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - started)
+
+async def run(args):
+    body = None
+    if args.body:
+        with open(args.body) as f:
+            body = json.load(f)
+    latencies, errors, remaining = [], [], [args.requests]
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            _worker(client, args, body, latencies, errors, remaining) for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+    print(f"requests:    {len(latencies)} ({len(errors)} errors)")
+    print(f"throughput:  {len(latencies) / elapsed:.1f} req/s")
+    print(f"latency ms:  mean {statistics.mean(latencies) * 1000:.1f}  p50 {percentile(50):.1f}  "
+          f"p95 {percentile(95):.1f}  p99 {percentile(99):.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000/")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--body")
+    parser.add_argument("--api-key", default="dev")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=600)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,70 @@
+"""
+Times the debugging assistant's static pre-pass on real code: every top-level
+module of the running interpreter's standard library, grouped by size.
+
+    PYTHONPATH=. python benchmarks/static_analysis.py [--repeat 3]
+
+For each size bucket prints the module count and the median and slowest time of
+`analyze_code` (the best of --repeat runs per module), and how much of it is the
+interpreter's own parse and symbol table pass. Then prints the findings by kind;
+the standard library is well-tested code, so undefined names and syntax errors
+there would be false positives.
+"""
+import argparse
+import ast
+import glob
+import os
+import statistics
+import symtable
+import sysconfig
+import time
+from collections import Counter
+
+BUCKETS = ((0, 500), (500, 2000), (2000, 5000), (5000, 10 ** 9))
+
+def best_of(repeat, run):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(args):
+    os.environ.setdefault("ENV_TYPE", "dev")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from app.api.features.multi_agent_debugging_assistant.static_analysis import analyze_code
+
+    rows = []
+    kinds = Counter()
+    for path in sorted(glob.glob(os.path.join(sysconfig.get_paths()["stdlib"], "*.py"))):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            source = f.read()
+        report = analyze_code(source)
+        if report is None:
+            continue
+        kinds.update(finding.kind for finding in report.findings)
+        total = best_of(args.repeat, lambda: analyze_code(source))
+        parse = best_of(args.repeat, lambda: (ast.parse(source), symtable.symtable(source, path, "exec")))
+        rows.append((len(source.splitlines()), total, parse, os.path.basename(path)))
+
+    print(f"{len(rows)} modules, best of {args.repeat} runs each")
+    for low, high in BUCKETS:
+        bucket = [row for row in rows if low <= row[0] < high]
+        if not bucket:
+            continue
+        label = f"{low}-{high} lines" if high < 10 ** 9 else f"{low}+ lines"
+        slowest = max(bucket, key=lambda row: row[1])
+        print(f"  {label:>14}: {len(bucket):3} modules, median {statistics.median(row[1] for row in bucket) * 1000:6.1f} ms "
+              f"(parse + symtable {statistics.median(row[2] for row in bucket) * 1000:5.1f} ms), "
+              f"slowest {slowest[1] * 1000:6.1f} ms ({slowest[3]}, {slowest[0]} lines)")
+    lines = sum(row[0] for row in rows)
+    seconds = sum(row[1] for row in rows)
+    print(f"  overall: {lines} lines in {seconds:.2f} s, {seconds / lines * 1e6:.0f} us per line")
+    print("findings: " + ", ".join(f"{kind} {count}" for kind, count in sorted(kinds.items())))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    main(parser.parse_args())
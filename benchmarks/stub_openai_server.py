@@ -0,0 +1,215 @@
+"""
+Local OpenAI-compatible chat completions server with a controllable latency tail, for
+exercising hedging and failover without the real API.
+
+    python benchmarks/stub_openai_server.py --port 9001 --latency-ms 300 --slow-ratio 0.05 --slow-ms 5000
+
+Point a backend at it with LLM_BACKENDS, e.g.
+'[{"name": "stub", "base_url": "http://localhost:9001/v1"}]' (any API key works).
+
+Each call sleeps about --latency-ms (plus or minus 20%), or --slow-ms for a
+--slow-ratio share of calls, and fails with --error-status for an --error-ratio
+share. GET /stats returns the counts so far.
+
+It also stands in for the Files and Batches APIs used by bulk runs
+(app/api/batching.py): uploaded JSONL files are kept in memory, and a batch
+completes --batch-ms after it is created, answering every chat completion line
+at once. --error-ratio applies to batch lines too; failed lines go to the
+batch's error file.
+"""
+import argparse
+import email.parser
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "Thought: I now know the final answer\nFinal Answer: {}"
+
+class StubOptions:
+    def __init__(self, latency_ms=300.0, slow_ratio=0.0, slow_ms=5000.0, error_ratio=0.0, error_status=500,
+                 reply=DEFAULT_REPLY, seed=None, batch_ms=2000.0):
+        self.latency_ms = latency_ms
+        self.slow_ratio = slow_ratio
+        self.slow_ms = slow_ms
+        self.error_ratio = error_ratio
+        self.error_status = error_status
+        self.reply = reply
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.batch_ms = batch_ms
+        self.stats = {"requests": 0, "slow": 0, "errors": 0, "batches": 0, "batch_requests": 0, "batch_errors": 0}
+        self.files = {}
+        self.batches = {}
+
+    def draw(self):
+        """Latency in seconds and whether the call fails."""
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.random.random() < self.error_ratio:
+                self.stats["errors"] += 1
+                return self.latency_ms / 1000, True
+            if self.random.random() < self.slow_ratio:
+                self.stats["slow"] += 1
+                return self.slow_ms / 1000, False
+            return self.latency_ms * self.random.uniform(0.8, 1.2) / 1000, False
+
+    def batch_line_fails(self) -> bool:
+        with self.lock:
+            self.stats["batch_requests"] += 1
+            if self.random.random() < self.error_ratio:
+                self.stats["batch_errors"] += 1
+                return True
+            return False
+
+def completion(request: dict, reply: str) -> dict:
+    prompt_tokens = sum(len(str(message.get("content", ""))) for message in request.get("messages", [])) // 4
+    completion_tokens = len(reply) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "stub"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+def _file_object(file_id: str, content: bytes, purpose: str) -> dict:
+    return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": f"{file_id}.jsonl", "purpose": purpose, "status": "processed"}
+
+def _run_batch(options: StubOptions, batch: dict):
+    """Answers every line of the batch's input file after --batch-ms, like a provider's batch worker."""
+    time.sleep(options.batch_ms / 1000)
+    output, errors = [], []
+    for line in options.files[batch["input_file_id"]].decode().splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if options.batch_line_fails():
+            errors.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                           "response": {"status_code": options.error_status, "body": {"error": {"message": "Stub failure"}}},
+                           "error": None})
+        else:
+            output.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                           "response": {"status_code": 200, "body": completion(request["body"], options.reply)}, "error": None})
+    with options.lock:
+        for key, lines in (("output_file_id", output), ("error_file_id", errors)):
+            if lines:
+                file_id = f"file-{uuid.uuid4().hex}"
+                options.files[file_id] = "\n".join(json.dumps(line) for line in lines).encode()
+                batch[key] = file_id
+        batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output), "failed": len(errors)}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+def _handler(options: StubOptions):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _not_found(self):
+            self._send(404, {"error": {"message": "Not found"}})
+
+        def do_GET(self):
+            parts = self.path.rstrip("/").split("/")
+            if parts[-1] == "stats":
+                with options.lock:
+                    self._send(200, dict(options.stats))
+            elif parts[-1] == "content" and parts[-3] == "files" and parts[-2] in options.files:
+                content = options.files[parts[-2]]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            elif parts[-2] == "batches" and parts[-1] in options.batches:
+                with options.lock:
+                    self._send(200, dict(options.batches[parts[-1]]))
+            else:
+                self._not_found()
+
+        def _upload(self, body: bytes):
+            # The client sends the file as multipart/form-data
+            message = email.parser.BytesParser().parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+            fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                      for part in message.get_payload()}
+            file_id = f"file-{uuid.uuid4().hex}"
+            with options.lock:
+                options.files[file_id] = fields["file"]
+            self._send(200, _file_object(file_id, fields["file"], (fields.get("purpose") or b"batch").decode()))
+
+        def _create_batch(self, request: dict):
+            if request.get("input_file_id") not in options.files:
+                self._send(400, {"error": {"message": "Unknown input_file_id"}})
+                return
+            batch = {"id": f"batch_{uuid.uuid4().hex}", "object": "batch", "endpoint": request.get("endpoint"),
+                     "input_file_id": request["input_file_id"], "completion_window": request.get("completion_window", "24h"),
+                     "status": "in_progress", "created_at": int(time.time())}
+            with options.lock:
+                options.batches[batch["id"]] = batch
+                options.stats["batches"] += 1
+                snapshot = dict(batch)
+            threading.Thread(target=_run_batch, args=(options, batch), daemon=True).start()
+            self._send(200, snapshot)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.rstrip("/").endswith("/files"):
+                self._upload(body)
+                return
+            request = json.loads(body or b"{}")
+            if self.path.rstrip("/").endswith("/batches"):
+                self._create_batch(request)
+                return
+            if not self.path.endswith("/chat/completions"):
+                self._not_found()
+                return
+            latency, fails = options.draw()
+            time.sleep(latency)
+            if fails:
+                self._send(options.error_status, {"error": {"message": "Stub failure", "type": "server_error"}})
+                return
+            self._send(200, completion(request, options.reply))
+
+    return Handler
+
+def serve(port: int, options: StubOptions) -> ThreadingHTTPServer:
+    """Starts the stub on `port` in a background thread; call `shutdown()` to stop it."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(options))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--slow-ratio", type=float, default=0.0)
+    parser.add_argument("--slow-ms", type=float, default=5000.0)
+    parser.add_argument("--error-ratio", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--batch-ms", type=float, default=2000.0)
+    args = parser.parse_args()
+    server = serve(args.port, StubOptions(args.latency_ms, args.slow_ratio, args.slow_ms, args.error_ratio, args.error_status,
+                                          args.reply, batch_ms=args.batch_ms))
+    print(f"Stub OpenAI server on http://127.0.0.1:{args.port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
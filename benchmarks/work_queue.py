@@ -0,0 +1,135 @@
+"""
+The shared work queue on one host: several worker processes consume jobs from one
+SQLite store, and one of them is killed mid-run.
+
+    PYTHONPATH=. python benchmarks/work_queue.py [--workers 3] [--jobs 60] [--crew-seconds 0.5]
+
+Each worker process runs the app's consumers (`work_queue.start(router.run_job)`)
+with the crews replaced by a stand-in that sleeps for --crew-seconds over four
+stages, checking the deadline between them, and reports which process ran it. The
+main process submits --jobs distinct requests at once and waits for all results.
+--kill-after seconds after a worker is first seen holding a job, that worker gets
+SIGKILL; the jobs it held are claimed again once their --lease-seconds lease runs
+out. Prints how the jobs were spread over the workers, how many were claimed
+again, whether any were lost, and the time from the first claim to the last
+result (the workers take a while to start).
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+from collections import Counter
+
+def configure(args):
+    os.environ.setdefault("ENV_TYPE", "dev")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["WORK_QUEUE_URL"] = f"sqlite:///{args.db}"
+    os.environ["WORK_QUEUE_LEASE_SECONDS"] = str(args.lease_seconds)
+    os.environ["WORK_QUEUE_POLL_SECONDS"] = "0.05"
+    os.environ["WORK_QUEUE_CONCURRENCY"] = str(args.concurrency)
+    os.environ["CREW_CONCURRENCY"] = str(args.concurrency)
+    os.environ["LLM_RATE_LIMIT_DB"] = os.path.join(os.path.dirname(args.db), "limits.sqlite3")
+
+def stand_in_crew(crew_seconds: float):
+    def crew(data):
+        from app.api.deadlines import check_deadline
+        for _ in range(4):
+            check_deadline()
+            time.sleep(crew_seconds / 4)
+        return {"worker": os.getpid(), "code_snippet": data.code_snippet}
+    return crew
+
+def worker(args):
+    configure(args)
+    from app.api import router
+    from app.api.work_queue import work_queue
+
+    for endpoint, (schema, _) in router.CREW_ENDPOINTS.items():
+        router.CREW_ENDPOINTS[endpoint] = (schema, stand_in_crew(args.crew_seconds))
+
+    async def consume():
+        work_queue.start(router.run_job)
+        await asyncio.Event().wait()
+
+    asyncio.run(consume())
+
+async def submit_all(args):
+    from app.api.auth.tenants import default_tenant
+    from app.api.coalescing import request_key
+    from app.api.deadlines import Deadline
+    from app.api.schemas.refactoring_assistant_schema import CodeInput
+    from app.api.work_queue import Job, work_queue
+
+    async def one(i):
+        data = CodeInput(code_snippet=f"def f{i}():\n    return {i}\n", language="python")
+        tenant = default_tenant()
+        job = Job(id=request_key("/refactoring-assistant", data, tenant.name), endpoint="/refactoring-assistant",
+                  payload=data.model_dump(), tenant=tenant.model_dump())
+        return await work_queue.submit(job, Deadline.after(120))
+
+    return await asyncio.gather(*(one(i) for i in range(args.jobs)), return_exceptions=True)
+
+def main(args):
+    args.db = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+    configure(args)
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=worker, args=(args,), daemon=True) for _ in range(args.workers)]
+    for process in workers:
+        process.start()
+
+    from app.api.work_queue import work_queue
+
+    async def watch():
+        # Waits for the first claim, then kills the worker that made it --kill-after seconds later
+        while True:
+            running = work_queue.store._connection().execute("SELECT worker FROM jobs WHERE status = 'running' LIMIT 1").fetchone()
+            if running is not None:
+                break
+            await asyncio.sleep(0.05)
+        first_claim = time.monotonic()
+        if args.kill_after < 0:
+            return first_claim, None
+        await asyncio.sleep(args.kill_after)
+        victim = int(running[0].split(":")[1])
+        os.kill(victim, signal.SIGKILL)
+        print(f"killed worker {victim} while it held jobs")
+        return first_claim, victim
+
+    async def run():
+        watcher = asyncio.ensure_future(watch())
+        results = await submit_all(args)
+        finished = time.monotonic()
+        first_claim, victim = await watcher
+        return results, finished - first_claim, victim
+
+    results, elapsed, victim = asyncio.run(run())
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    spread = Counter(result["worker"] for result in results if not isinstance(result, BaseException))
+    print(f"{len(results) - len(errors)}/{args.jobs} jobs completed {elapsed:.1f}s after the first claim, {len(errors)} failed")
+    for pid, count in sorted(spread.items()):
+        print(f"  worker {pid}: {count} jobs")
+    reclaimed = work_queue.store._connection().execute("SELECT COUNT(*) FROM jobs WHERE attempts > 1").fetchone()[0]
+    print(f"jobs claimed again after a lost lease: {reclaimed}")
+    print(f"ideal time without the kill: {args.jobs * args.crew_seconds / (args.workers * args.concurrency):.1f}s")
+    for error in errors[:3]:
+        print(f"  error: {error!r}")
+    for process in workers:
+        if process.pid != victim:
+            process.terminate()
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--jobs", type=int, default=60)
+    parser.add_argument("--crew-seconds", type=float, default=0.5)
+    parser.add_argument("--lease-seconds", type=float, default=3.0)
+    parser.add_argument("--kill-after", type=float, default=1.0, help="negative: kill no worker")
+    main(parser.parse_args())
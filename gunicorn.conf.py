@@ -0,0 +1,73 @@
+# Production serving configuration.
+# Run with: gunicorn -c gunicorn.conf.py app.main:app
+import gc
+import multiprocessing
+import os
+
+def _available_memory_mb():
+    # Prefer the container limit over the host total
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            value = f.read().strip()
+        if value != "max":
+            return int(value) // (1024 * 1024)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def recommended_workers():
+    """
+    Worker count bounded by CPU ((2 x cores) + 1) and by memory.
+
+    With the app preloaded most of the import footprint is shared copy-on-write, so
+    only the private growth of each worker (WEB_WORKER_MEMORY_MB) is budgeted
+    against what is left after WEB_MEMORY_RESERVE_MB for the master and the OS.
+    """
+    if os.environ.get("WEB_CONCURRENCY"):
+        return int(os.environ["WEB_CONCURRENCY"])
+    by_cpu = multiprocessing.cpu_count() * 2 + 1
+    memory = _available_memory_mb()
+    if memory is None:
+        return by_cpu
+    per_worker = int(os.environ.get("WEB_WORKER_MEMORY_MB", 150))
+    reserve = int(os.environ.get("WEB_MEMORY_RESERVE_MB", 200))
+    by_memory = max(1, (memory - reserve) // per_worker)
+    return max(1, min(by_cpu, by_memory))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = recommended_workers()
+
+# Import LangChain, CrewAI and the app once in the master; workers inherit them.
+preload_app = True
+
+# Recycle workers after a bounded number of requests (jittered so they do not all
+# restart together). Memory-based recycling is done by WorkerRecycleMiddleware.
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 500))
+max_requests_jitter = int(os.environ.get("WEB_MAX_REQUESTS_JITTER", 50))
+
+# Crews take minutes; do not kill a worker that is busy running one. A worker that
+# is recycled or shut down gets as long as the longest crew deadline to finish.
+timeout = int(os.environ.get("WEB_TIMEOUT", 600))
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT") or float(os.environ.get("REQUEST_DEADLINE_MAX_SECONDS", 900)))
+keepalive = 5
+
+accesslog = "-"
+
+def when_ready(server):
+    server.log.info(f"Serving with {workers} workers")
+
+def pre_fork(server, worker):
+    # Move everything imported so far out of the GC's reach so collections in the
+    # workers do not touch (and un-share) the preloaded pages.
+    gc.freeze()
+
+def post_fork(server, worker):
+    os.environ["WEB_WORKER"] = "1"
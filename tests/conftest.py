@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Settings the app reads at import time; tests never call a real LLM
+os.environ.setdefault("ENV_TYPE", "dev")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("LLM_RATE_LIMIT_DB", os.path.join(tempfile.mkdtemp(), "limits.sqlite3"))
@@ -0,0 +1,21 @@
+import pytest
+from fastapi import HTTPException
+from app.api.admission import AdmissionController
+from app.api.schemas.refactoring_assistant_schema import CodeInput
+
+ENDPOINT = "/refactoring-assistant"
+
+def payload(lines: int) -> CodeInput:
+    return CodeInput(code_snippet="x = 1\n" * lines, language="python")
+
+def test_shed_requests_retry_after_the_queue_drains():
+    admission = AdmissionController(max_input_tokens=100000, max_cost_usd=100.0, max_latency_seconds=10000.0,
+                                    overload_queue_depth=2, crew_slots=2)
+    for lines in range(1, 21):
+        admission.admit(ENDPOINT, payload(lines))
+    latency = admission.estimate(ENDPOINT, payload(20)).latency_seconds
+    with pytest.raises(HTTPException) as shed:
+        admission.admit(ENDPOINT, payload(5000), queue_depth=5)
+    assert shed.value.status_code == 429
+    # 4 crews over the overload depth, drained 2 at a time
+    assert int(shed.value.headers["Retry-After"]) == pytest.approx(2 * latency, abs=1)
@@ -0,0 +1,95 @@
+import io
+import json
+from types import SimpleNamespace
+import pytest
+from langchain_core.messages import HumanMessage
+from app.api import router
+from app.api.batching import BatchRounds
+from app.api.bulk import run_bulk
+from app.api.llm import get_chat_model
+
+ENDPOINT = "/doc-generator-assistant"
+STAGES = ("analyst", "writer", "reviewer")
+
+class FakeBatchClient:
+    """The Files and Batches APIs: a batch completes at once, failing every line that mentions 'poison'."""
+
+    def __init__(self):
+        self.files = SimpleNamespace(create=self._upload, content=self._content)
+        self.batches = SimpleNamespace(create=self._create, retrieve=self._retrieve)
+        self.stored = {}
+        self.created = {}
+        self.batch_sizes = []
+
+    def _upload(self, file, purpose):
+        file_id = f"file-{len(self.stored)}"
+        self.stored[file_id] = file[1].read().decode()
+        return SimpleNamespace(id=file_id)
+
+    def _content(self, file_id):
+        return SimpleNamespace(text=self.stored[file_id])
+
+    def _create(self, input_file_id, endpoint, completion_window):
+        lines = [json.loads(line) for line in self.stored[input_file_id].splitlines()]
+        self.batch_sizes.append(len(lines))
+        output, errors = [], []
+        for line in lines:
+            prompt = line["body"]["messages"][-1]["content"]
+            if "poison" in prompt:
+                errors.append({"custom_id": line["custom_id"], "response": {"status_code": 500, "body": {}},
+                               "error": {"message": "server_error"}})
+                continue
+            body = {"id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": line["body"]["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": prompt.split(":")[0]},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}}
+            output.append({"custom_id": line["custom_id"], "response": {"status_code": 200, "body": body}})
+        batch_id = f"batch-{len(self.created)}"
+        self.created[batch_id] = SimpleNamespace(
+            id=batch_id, status="completed",
+            output_file_id=self._upload(("output.jsonl", io.BytesIO("\n".join(map(json.dumps, output)).encode())), "batch_output").id,
+            error_file_id=self._upload(("errors.jsonl", io.BytesIO("\n".join(map(json.dumps, errors)).encode())), "batch_output").id,
+        )
+        return self.created[batch_id]
+
+    def _retrieve(self, batch_id):
+        return self.created[batch_id]
+
+def stand_in_crew(data):
+    """One LLM call per stage, each reading the previous one's output, like a sequential crew."""
+    output = data.code_snippet
+    for stage in STAGES:
+        output = get_chat_model("gpt-4o").invoke([HumanMessage(content=f"{stage}: {output}")]).content
+    return {"documentation": output}
+
+@pytest.fixture
+def bulk(monkeypatch):
+    schema, _ = router.CREW_ENDPOINTS[ENDPOINT]
+    monkeypatch.setitem(router.CREW_ENDPOINTS, ENDPOINT, (schema, stand_in_crew))
+    client = FakeBatchClient()
+    rounds = BatchRounds(poll_seconds=0.01, max_wait_seconds=5, max_attempts=2, completion_window="24h")
+    monkeypatch.setattr(rounds, "_client", lambda backend: client)
+    rounds.start()
+    yield rounds, client
+    rounds.stop()
+
+def payloads(snippets):
+    return [{"code_snippet": snippet, "language": "python"} for snippet in snippets]
+
+def test_each_stage_of_every_run_goes_out_as_one_batch(bulk):
+    rounds, client = bulk
+    results = run_bulk(ENDPOINT, payloads([f"def f{i}(): pass" for i in range(5)]), rounds)
+    assert [result["output"] for result in results] == [{"documentation": "reviewer"}] * 5
+    assert [result["index"] for result in results] == list(range(5))
+    assert client.batch_sizes == [5, 5, 5]
+    assert rounds.stats()["rounds"] == 3
+    assert rounds.stats()["tokens"] == {"gpt-4o": {"prompt": 150, "completion": 75}}
+
+def test_failed_item_does_not_sink_the_batch(bulk):
+    rounds, client = bulk
+    results = run_bulk(ENDPOINT, payloads(["def ok(): pass", "poison = True", "def fine(): pass"]), rounds)
+    assert results[0]["output"] == results[2]["output"] == {"documentation": "reviewer"}
+    assert "BatchCallFailed" in results[1]["error"]
+    # The poisoned call was retried once alongside the others' second stage, then given up on
+    assert client.batch_sizes == [3, 3, 2]
+    assert (rounds.stats()["retried"], rounds.stats()["failed"]) == (1, 1)
@@ -0,0 +1,36 @@
+import pytest
+from app.api.features.doc_generator_assistant.renderer import RENDERERS, merge_examples, render_documentation
+
+MODULE = {
+    "module_name": "prices",
+    "functions": [{"function_name": "total", "parameters": [{"name": "items", "type": "list"}], "return_type": "float"}],
+}
+
+def module():
+    return {**MODULE, "functions": [dict(function) for function in MODULE["functions"]]}
+
+def test_examples_go_to_the_element_they_show():
+    merged = merge_examples(module(), {"examples": [{"element_name": "total(items)", "example_code": "total([])"}]})
+    assert merged["functions"][0]["examples"] == ["total([])"]
+
+@pytest.mark.parametrize("examples", [
+    {"examples": ["total([1])"]},
+    ["total([1])"],
+    {"examples": ["total([1])", 3, None, {"element_name": "total"}, {"example_code": ["x"]}]},
+])
+def test_malformed_examples_are_skipped_or_kept_as_module_examples(examples):
+    merged = merge_examples(module(), examples)
+    assert merged["examples"] == ["total([1])"]
+    assert "examples" not in merged["functions"][0]
+
+@pytest.mark.parametrize("examples", [None, "total([1])", 3, {"examples": "total"}])
+def test_examples_of_the_wrong_shape_are_ignored(examples):
+    assert merge_examples(module(), examples) == MODULE
+
+@pytest.mark.parametrize("output_format", sorted(RENDERERS))
+def test_modules_of_the_wrong_shape_render(output_format):
+    assert render_documentation([], output_format) == ""
+    assert render_documentation("Plain text from the model", output_format) == "Plain text from the model"
+    assert "total" in render_documentation([module(), 3], output_format)
+    rendered = render_documentation({"module_name": 7, "examples": "f()", "classes": [{"class_name": 1, "methods": "x"}]}, output_format)
+    assert "7" in rendered and "f()" in rendered
@@ -0,0 +1,34 @@
+from app.api.fingerprint import FingerprintIndex, fingerprint
+from app.api.schemas.refactoring_assistant_schema import CodeInput
+
+ENDPOINT = "/refactoring-assistant"
+
+def fingerprints():
+    return FingerprintIndex(max_entries=16, ttl_seconds=60, near_threshold=0.85)
+
+def payload(code, **fields):
+    return CodeInput(code_snippet=code, language=fields.pop("language", "python"), **fields)
+
+def test_c_preprocessor_lines_are_not_comments():
+    a = fingerprint(payload("#define LIMIT 10\nint x;\n", language="c"))
+    b = fingerprint(payload("#define LIMIT 99999\nint x;\n", language="c"))
+    assert a.exact_key != b.exact_key
+
+def test_python_that_does_not_parse_keeps_its_indentation():
+    a = fingerprint(payload("def f(:\n    return 1\n"))
+    b = fingerprint(payload("def f(:\nreturn 1\n"))
+    assert a.exact_key != b.exact_key
+
+def test_results_without_code_are_reused_across_comments():
+    index = fingerprints()
+    index.add(ENDPOINT, fingerprint(payload("x = 1  # one\n")), {"changes_made": {}})
+    match = index.lookup(ENDPOINT, fingerprint(payload("x = 1  # uno\n")))
+    assert match.exact and match.result == {"changes_made": {}}
+
+def test_results_quoting_the_code_are_only_reused_for_the_same_text():
+    index = fingerprints()
+    result = {"code_snippet": "y = 1  # one\n", "patch": "--- a/code.py\n", "changes_made": {}}
+    index.add(ENDPOINT, fingerprint(payload("x = 1  # one\n", output_mode="diff")), result)
+    assert index.lookup(ENDPOINT, fingerprint(payload("x = 1  # one\n", output_mode="diff"))).exact
+    other = index.lookup(ENDPOINT, fingerprint(payload("x = 1  # uno\n", output_mode="diff")))
+    assert other is None or not other.exact
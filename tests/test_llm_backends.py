@@ -0,0 +1,148 @@
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+import app.api.llm as llm
+from app.api.llm_backends import Backend, LLMBackends
+from app.api.metrics import counters
+
+MODEL = "gpt-4o"
+ROLE = "reviewer"
+MESSAGES = [HumanMessage(content="Review this code.")]
+
+class FakeModel:
+    """A backend's chat model: answers with the backend's name after `delay`, or raises `error`."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.delay = 0.0
+        self.error = None
+        self.calls = 0
+
+    def _generate(self, messages, stop=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.name))],
+                          llm_output={"token_usage": {"total_tokens": 10}})
+
+class FakeBudget:
+    def __init__(self, allow: bool = True):
+        self.allow = allow
+        self.spent = 0
+
+    def deposit(self):
+        pass
+
+    def try_spend(self) -> bool:
+        self.spent += 1
+        return self.allow
+
+class FakePermit:
+    def completed(self, actual_tokens=None):
+        pass
+
+    def throttled(self):
+        pass
+
+class FakeLimiter:
+    """Grants permits at once, or once `gate` is set."""
+
+    def __init__(self, retry_budget: FakeBudget):
+        self.retry_budget = retry_budget
+        self.gate = None
+        self.waiting = threading.Event()
+
+    @contextmanager
+    def permit(self, estimated_tokens: int, timeout=None):
+        if self.gate is not None:
+            self.waiting.set()
+            self.gate.wait(5)
+        yield FakePermit()
+
+@pytest.fixture
+def fake(monkeypatch):
+    fleet = LLMBackends([Backend(name="primary"), Backend(name="backup")], cooldown_seconds=30, hedge_percentile=95,
+                        hedge_min_samples=1, hedge_min_delay=0.05, window=10)
+    fleet._hedge_budget = FakeBudget()
+    models = {backend.name: FakeModel(backend.name) for backend in fleet.backends}
+    retry_budget = FakeBudget(allow=False)
+    limiters = {}
+    monkeypatch.setattr(fleet, "chat_model", lambda backend, *args: models[backend.name])
+    monkeypatch.setattr(llm, "backends", fleet)
+    monkeypatch.setattr(llm, "get_rate_limiter", lambda key: limiters.setdefault(key, FakeLimiter(retry_budget)))
+    return fleet, models, limiters, retry_budget
+
+def server_error() -> openai.InternalServerError:
+    response = httpx.Response(500, request=httpx.Request("POST", "http://primary/v1/chat/completions"))
+    return openai.InternalServerError("upstream failed", response=response, body=None)
+
+def hedged_model(fleet: LLMBackends) -> llm.ManagedChatOpenAI:
+    # One fast sample gives the role a hedge delay of hedge_min_delay
+    fleet.succeeded(fleet.backends[0], MODEL, ROLE, 0.01)
+    return llm.ManagedChatOpenAI(model=MODEL, temperature=0, max_retries=0, hedge_key=ROLE)
+
+def delta(before: dict, name: str) -> float:
+    return counters.snapshot().get(name, 0) - before.get(name, 0)
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+def test_slow_primary_is_hedged_and_the_first_response_wins(fake):
+    fleet, models, limiters, retry_budget = fake
+    models["primary"].delay = 0.5
+    model = hedged_model(fleet)
+    before = counters.snapshot()
+    started = time.monotonic()
+    assert model.invoke(MESSAGES).content == "backup"
+    assert time.monotonic() - started < 0.4
+    assert delta(before, f"llm_hedges_fired{{backend=backup,role={ROLE}}}") == 1
+    assert delta(before, f"llm_hedges_won{{role={ROLE}}}") == 1
+    # The primary was already sent: it completes and its tokens count as wasted
+    wait_for(lambda: delta(before, "llm_hedge_tokens_wasted") == 10)
+    assert models["primary"].calls == models["backup"].calls == 1
+
+def test_losing_hedge_that_was_not_sent_is_cancelled(fake):
+    fleet, models, limiters, retry_budget = fake
+    models["primary"].delay = 0.2
+    backup = limiters.setdefault("backup/gpt-4o", FakeLimiter(retry_budget))
+    backup.gate = threading.Event()
+    model = hedged_model(fleet)
+    before = counters.snapshot()
+    assert model.invoke(MESSAGES).content == "primary"
+    assert backup.waiting.is_set()
+    assert delta(before, f"llm_hedges_lost{{role={ROLE}}}") == 1
+    backup.gate.set()
+    wait_for(lambda: delta(before, "llm_hedge_calls_avoided") == 1)
+    assert models["backup"].calls == 0
+    assert delta(before, "llm_hedge_tokens_wasted") == 0
+
+@pytest.mark.parametrize("hedged", [False, True])
+def test_server_error_fails_over_without_a_retry(fake, hedged):
+    fleet, models, limiters, retry_budget = fake
+    models["primary"].error = server_error()
+    model = hedged_model(fleet) if hedged else llm.ManagedChatOpenAI(model=MODEL, temperature=0, max_retries=0)
+    before = counters.snapshot()
+    assert model.invoke(MESSAGES).content == "backup"
+    assert delta(before, "llm_failovers{source=primary,target=backup}") == 1
+    assert models["primary"].calls == models["backup"].calls == 1
+    assert retry_budget.spent == 0
+    # The failed backend is tried last until it cools down
+    assert [backend.name for backend in fleet.available()] == ["backup", "primary"]
+
+def test_failing_every_backend_spends_one_retry(fake):
+    fleet, models, limiters, retry_budget = fake
+    models["primary"].error = models["backup"].error = server_error()
+    model = llm.ManagedChatOpenAI(model=MODEL, temperature=0, max_retries=0)
+    with pytest.raises(openai.InternalServerError):
+        model.invoke(MESSAGES)
+    assert models["primary"].calls == models["backup"].calls == 1
+    assert retry_budget.spent == 1
@@ -0,0 +1,31 @@
+from app.api.patching import apply_edits, patched_output
+from app.api.schemas.patch_schema import CodeEdit
+
+SOURCE = "a\nb\nc\n"
+INSERT = CodeEdit(start_line=2, end_line=1, original="", replacement="B")
+REPLACE = CodeEdit(start_line=2, end_line=2, original="b", replacement="B")
+
+def test_insertion_before_replacement_in_either_order():
+    assert apply_edits(SOURCE, [INSERT, REPLACE]) == ("a\nB\nB\nc\n", [])
+    assert apply_edits(SOURCE, [REPLACE, INSERT]) == ("a\nB\nB\nc\n", [])
+
+def test_insertion_inside_replaced_range_is_rejected():
+    replace = CodeEdit(start_line=1, end_line=2, original="a\nb", replacement="x")
+    patched, errors = apply_edits(SOURCE, [replace, INSERT])
+    assert patched == "x\nc\n"
+    assert errors == ["Edit 2: overlaps an earlier edit"]
+
+def test_two_insertions_at_one_line_are_rejected():
+    patched, errors = apply_edits(SOURCE, [INSERT, INSERT])
+    assert patched == "a\nB\nb\nc\n"
+    assert errors == ["Edit 2: overlaps an earlier edit"]
+
+def test_edits_that_are_not_a_list_give_one_error():
+    output = patched_output(SOURCE, "python", {"edits": "garbage"})
+    assert output["code_snippet"] == SOURCE
+    assert output["patch_errors"] == ["`edits` must be a list of edits, not str"]
+
+def test_edits_that_are_not_objects_are_skipped():
+    output = patched_output(SOURCE, "python", {"edits": ["x", REPLACE.model_dump()]})
+    assert output["code_snippet"] == "a\nB\nc\n"
+    assert output["patch_errors"] == ["Edit 1: must be an object, not str"]
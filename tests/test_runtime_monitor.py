@@ -0,0 +1,83 @@
+import asyncio
+import time
+from app.api.runtime_monitor import RuntimeMonitor, RuntimeMonitorMiddleware
+
+def run_monitored(body, interval=0.05, lag_warning_ms=100.0):
+    """Runs `body(monitor)` on a fresh event loop with a started monitor; returns the monitor and its last snapshot."""
+    monitor = RuntimeMonitor(interval, lag_warning_ms, window=100)
+
+    async def main():
+        monitor.start(thread_pool_size=2)
+        try:
+            await body(monitor)
+            # Thread pool stats need the running loop
+            return monitor.snapshot()
+        finally:
+            await monitor.stop()
+
+    return monitor, asyncio.run(main())
+
+def block_the_loop():
+    time.sleep(0.4)
+
+def test_lag_is_sampled_and_a_stall_names_the_blocking_call():
+    async def body(monitor):
+        await asyncio.sleep(0.2)
+        block_the_loop()
+        await asyncio.sleep(0.2)
+
+    monitor, snapshot = run_monitored(body)
+    lags = [sample["loop_lag_ms"] for sample in monitor.samples]
+    assert len(lags) >= 4
+    assert max(lags) >= 250
+    assert min(lags) < 100
+    assert monitor.lag_warnings == 1
+    assert "block_the_loop" in monitor.stalls[0]["stack"]
+    assert snapshot["loop"]["warnings"] == 1
+
+def test_registered_gauges_are_sampled():
+    depth = {"value": 3}
+
+    async def body(monitor):
+        monitor.gauge("crews_waiting", lambda: depth["value"])
+        await asyncio.sleep(0.12)
+        depth["value"] = 5
+        await asyncio.sleep(0.12)
+
+    monitor, snapshot = run_monitored(body)
+    values = [sample["queues"]["crews_waiting"] for sample in monitor.samples]
+    assert values[0] == 3 and values[-1] == 5
+    assert snapshot["queues"] == {"crews_waiting": 5}
+
+def test_thread_pool_counts_calls_waiting_for_a_thread():
+    async def body(monitor):
+        calls = [asyncio.to_thread(time.sleep, 0.3) for _ in range(4)]
+        gathered = asyncio.gather(*calls)
+        await asyncio.sleep(0.15)
+        pool = monitor.snapshot()["thread_pools"]["to_thread"]
+        assert (pool["size"], pool["running"], pool["queued"]) == (2, 2, 2)
+        await gathered
+
+    run_monitored(body)
+
+def test_rss_growth_is_recorded_by_path():
+    leaked = []
+
+    async def leaky_app(scope, receive, send):
+        leaked.append(b"x" * (64 * 1024 * 1024))
+
+    async def small_app(scope, receive, send):
+        pass
+
+    async def body(monitor):
+        await RuntimeMonitorMiddleware(leaky_app, monitor)({"type": "http", "path": "/leaky"}, None, None)
+        await RuntimeMonitorMiddleware(small_app, monitor)({"type": "http", "path": "/small"}, None, None)
+        await asyncio.sleep(0.12)
+
+    _, snapshot = run_monitored(body)
+    by_path = snapshot["requests"]["by_path"]
+    assert by_path["/leaky"]["requests"] == 1
+    assert by_path["/leaky"]["max_rss_growth_mb"] >= 48
+    assert by_path["/small"]["max_rss_growth_mb"] < 8
+    assert snapshot["memory"]["growth_mb"] >= 48
+    assert snapshot["requests"]["in_flight"] == 0
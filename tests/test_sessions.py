@@ -0,0 +1,60 @@
+import pytest
+from app.api.features.multi_agent_debugging_assistant.harness import CaseResult, HarnessReport
+from app.api.features.multi_agent_debugging_assistant.sessions import SessionError, SessionStore, Turn
+from app.api.schemas.multi_agent_debugging_assistant_schema import CodeInput
+from app.api.work_queue import SQLiteJobStore
+
+def worker(shared=None) -> SessionStore:
+    return SessionStore(max_sessions=10, ttl_seconds=60, session_budget_bytes=64 * 1024,
+                        total_budget_bytes=1024 * 1024, shared=shared)
+
+@pytest.fixture
+def shared(tmp_path):
+    return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+def started(store: SessionStore):
+    session = store.create("acme", CodeInput(code_snippet="print(undefined)"))
+    session.record(["find"], {"find": {"bugs": [{"bug_id": 1}]}})
+    session.turns.append(Turn("start", ["find"]))
+    session.execution_report = HarnessReport([CaseResult(0, None, None, "", "NameError", 1, None)])
+    store.save(session)
+    return session
+
+def test_session_resumes_on_another_worker(shared):
+    first, second = worker(shared), worker(shared)
+    session = started(first)
+    resumed = second.get(session.id, "acme")
+    assert resumed is not session
+    assert resumed.to_state() == session.to_state()
+    assert resumed.execution_report.cases[0].stderr == "NameError"
+    assert second.stats()["loaded"] == 1
+
+def test_worker_picks_up_turns_saved_elsewhere(shared):
+    first, second = worker(shared), worker(shared)
+    session = started(first)
+    assert first.get(session.id, "acme") is session
+    moved_on = second.get(session.id, "acme")
+    moved_on.evidence.append("Error message: NameError")
+    second.save(moved_on)
+    current = first.get(session.id, "acme")
+    assert current is not session
+    assert (current.revision, current.evidence) == (moved_on.revision, ["Error message: NameError"])
+
+def test_closed_session_is_gone_everywhere(shared):
+    first, second = worker(shared), worker(shared)
+    session = started(first)
+    second.get(session.id, "acme")
+    first.close(session.id)
+    with pytest.raises(SessionError):
+        second.get(session.id, "acme")
+    assert second.stats()["sessions"] == 0
+
+def test_shared_session_keeps_its_tenant(shared):
+    session = started(worker(shared))
+    with pytest.raises(SessionError):
+        worker(shared).get(session.id, "someone-else")
+
+def test_session_without_shared_store_stays_on_its_worker():
+    session = started(worker())
+    with pytest.raises(SessionError):
+        worker().get(session.id, "acme")
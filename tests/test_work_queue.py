@@ -0,0 +1,96 @@
+import time
+import pytest
+from app.api.work_queue import Job, SQLiteJobStore, abandoned_error
+
+TTL = 60
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+def job(job_id: str, tenant: str = "acme", priority: str = "interactive", weight: float = 1, deadline: float = 100) -> Job:
+    return Job(id=job_id, endpoint="/refactoring-assistant", payload={}, deadline_at=time.time() + deadline,
+               tenant={"name": tenant, "priority": priority, "weight": weight})
+
+def claim_all(store: SQLiteJobStore, count: int):
+    return [store.claim("worker", lease_seconds=30, max_attempts=3).id for _ in range(count)]
+
+def test_claims_interactive_before_batch_then_oldest_first(store):
+    store.submit(job("batch-1", tenant="nightly", priority="batch"), TTL)
+    for job_id in ("first", "second"):
+        store.submit(job(job_id), TTL)
+    assert claim_all(store, 3) == ["first", "second", "batch-1"]
+    assert store.claim("worker", lease_seconds=30, max_attempts=3) is None
+
+def test_claims_split_by_tenant_weight(store):
+    for i in range(4):
+        store.submit(job(f"heavy-{i}", tenant="heavy", weight=2), TTL)
+    for i in range(4):
+        store.submit(job(f"light-{i}", tenant="light"), TTL)
+    claimed = claim_all(store, 6)
+    assert [job_id.split("-")[0] for job_id in claimed].count("heavy") == 4
+    # Within a tenant, oldest first
+    assert [job_id for job_id in claimed if job_id.startswith("heavy")] == [f"heavy-{i}" for i in range(4)]
+
+def test_expired_lease_is_claimed_again(store):
+    store.submit(job("crash"), TTL)
+    first = store.claim("worker-1", lease_seconds=0, max_attempts=3)
+    time.sleep(0.01)
+    second = store.claim("worker-2", lease_seconds=30, max_attempts=3)
+    assert (first.id, first.attempts) == ("crash", 1)
+    assert (second.id, second.attempts, second.worker) == ("crash", 2, "worker-2")
+    # The first worker lost the lease
+    assert store.renew("crash", "worker-1", 30) is None
+    assert not store.finish("crash", "worker-1", "done", "late", None, TTL)
+    assert store.finish("crash", "worker-2", "done", "result", None, TTL)
+    assert store.get("crash").result == "result"
+
+def test_job_fails_after_max_attempts(store):
+    store.submit(job("poison"), TTL)
+    store.claim("worker-1", lease_seconds=0, max_attempts=2)
+    time.sleep(0.01)
+    store.claim("worker-2", lease_seconds=0, max_attempts=2)
+    time.sleep(0.01)
+    assert store.claim("worker-3", lease_seconds=30, max_attempts=2) is None
+    failed = store.get("poison")
+    assert (failed.status, failed.attempts, failed.error) == ("failed", 2, abandoned_error(2))
+
+def test_released_job_goes_back_to_the_head_of_the_queue(store):
+    store.submit(job("older"), TTL)
+    store.submit(job("newer"), TTL)
+    claimed = store.claim("worker-1", lease_seconds=30, max_attempts=3)
+    store.submit(job("newest"), TTL)
+    store.release(claimed.id, "worker-1")
+    released = store.get("older")
+    assert (released.status, released.attempts, released.worker) == ("queued", 0, None)
+    assert claim_all(store, 3) == ["older", "newer", "newest"]
+
+def test_released_job_without_waiters_is_cancelled(store):
+    store.submit(job("orphan"), TTL)
+    store.claim("worker", lease_seconds=30, max_attempts=3)
+    store.leave("orphan", "client_disconnected")
+    store.release("orphan", "worker")
+    assert store.get("orphan").status == "cancelled"
+
+def test_job_is_cancelled_when_the_last_waiter_leaves(store):
+    assert store.submit(job("shared"), TTL)
+    assert not store.submit(job("shared"), TTL)
+    store.leave("shared", "client_disconnected")
+    assert store.get("shared").status == "queued"
+    store.leave("shared", "client_disconnected")
+    cancelled = store.get("shared")
+    assert (cancelled.status, cancelled.cancel_reason) == ("cancelled", "client_disconnected")
+    assert store.claim("worker", lease_seconds=30, max_attempts=3) is None
+
+def test_running_job_learns_its_last_waiter_left_on_renew(store):
+    store.submit(job("running"), TTL)
+    store.claim("worker", lease_seconds=30, max_attempts=3)
+    store.leave("running", "client_disconnected")
+    assert store.get("running").status == "running"
+    assert store.renew("running", "worker", 30)[1] == "client_disconnected"
+
+def test_job_past_its_deadline_is_cancelled(store):
+    store.submit(job("late", deadline=-1), TTL)
+    assert store.claim("worker", lease_seconds=30, max_attempts=3) is None
+    late = store.get("late")
+    assert (late.status, late.cancel_reason) == ("cancelled", "deadline")